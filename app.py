@@ -1,34 +1,65 @@
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file, abort
-import sqlite3, os, json, datetime, logging, textwrap
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file, abort, Response, stream_with_context, g
+import os, json, datetime, logging, textwrap, threading, itertools, csv, io, shutil, tempfile, time, hashlib
+from collections import namedtuple
 from werkzeug.utils import secure_filename
+import numpy as np
 import pandas as pd
+import pricing_engines
+from pricing_engines.base import CourierConfig, RESULT_FIELDS, compile_slabs
+from db import Database
+from recent_log import RecentSearchWriter, backfill_daily, daily_history, recent_page
+from quote_cache import QuoteCache
+from quote_pool import QuotePool
+import metrics
+from metrics import stage
+from ingest import ingest_rate_file, load_pincode_frame, load_pincode_store, cache_path, PINCODE_COLUMNS
+from upload_jobs import UploadJobs, CREATE_SQL as UPLOAD_JOBS_SQL, fail_interrupted, fail_orphaned
+from profiling import RequestProfile, list_profiles, profile_path
+
+try:
+    import orjson  # optional; encodes large quote responses several times faster than the stdlib
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
 app.secret_key = "gamma_secret_key_v421"
 
 # ---------- Logging ----------
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s [%(levelname)s] %(message)s")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG").upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s [%(levelname)s] %(message)s")
 log = logging.getLogger("gamma")
+# at DEBUG, log the per-courier quote lines of every Nth pin only (1 = every pin)
+QUOTE_DEBUG_SAMPLE = max(1, int(os.environ.get("QUOTE_DEBUG_SAMPLE", 1)))
 
 APP_DIR   = os.path.dirname(os.path.abspath(__file__))
-DB_PATH   = os.path.join(APP_DIR, "couriers.db")
-UPLOAD_DIR= os.path.join(APP_DIR, "uploads")
+DB_PATH   = os.environ.get("GAMMA_DB_PATH") or os.path.join(APP_DIR, "couriers.db")
+UPLOAD_DIR= os.environ.get("GAMMA_UPLOAD_DIR") or os.path.join(APP_DIR, "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+db = Database(DB_PATH)
+recent_writer = RecentSearchWriter(DB_PATH)
+quote_cache = QuoteCache()
+
+metrics.REGISTRY.gauge("gamma_quote_cache", "Quote cache counters (entries, hits, misses, evictions, expired).",
+                       lambda: {(k,): v for k, v in quote_cache.stats().items()
+                                if k in ("entries", "hits", "misses", "evictions", "expired")}, labels=("stat",))
+metrics.REGISTRY.gauge("gamma_recent_searches_dropped", "recent_searches rows dropped because the write queue was full.",
+                       lambda: recent_writer.dropped)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
 DEFAULT_USER = {"username": "admin", "password": "admin123"}
 
-def db_connect():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+@app.teardown_appcontext
+def release_db(exc):
+    db.release()
 
 def _colset(cur, table):
     cur.execute(f"PRAGMA table_info({table})")
     return {r[1] for r in cur.fetchall()}
 
 def db_init_migrate_and_report():
-    conn = db_connect(); cur = conn.cursor()
+    conn = db.connection(); cur = conn.cursor()
     # Create tables
     cur.execute("""
         CREATE TABLE IF NOT EXISTS couriers(
@@ -45,7 +76,8 @@ def db_init_migrate_and_report():
             oda_fixed REAL,
             gst_pct REAL,
             min_charge REAL,
-            updated_at TEXT
+            updated_at TEXT,
+            pincode_rows INTEGER
         );
     """)
     cur.execute("""
@@ -58,6 +90,54 @@ def db_init_migrate_and_report():
             total REAL
         );
     """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_recent_searches_checked_at ON recent_searches(checked_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_recent_searches_pincode ON recent_searches(pincode)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_recent_searches_courier ON recent_searches(courier)")
+    new_daily = "recent_search_daily" not in {r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS recent_search_daily(
+            day TEXT NOT NULL,
+            courier TEXT NOT NULL,
+            searches INTEGER NOT NULL DEFAULT 0,
+            quoted INTEGER NOT NULL DEFAULT 0,
+            weight_sum REAL NOT NULL DEFAULT 0,
+            total_sum REAL NOT NULL DEFAULT 0,
+            total_min REAL,
+            total_max REAL,
+            PRIMARY KEY (day, courier)
+        ) WITHOUT ROWID;
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS courier_pincodes(
+            courier TEXT NOT NULL,
+            pincode TEXT NOT NULL,
+            zone TEXT,
+            state TEXT,
+            location TEXT,
+            status TEXT,
+            oda_distance REAL,
+            PRIMARY KEY (courier, pincode)
+        ) WITHOUT ROWID;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_courier_pincodes_pin ON courier_pincodes(pincode, courier)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS courier_changesets(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            courier TEXT NOT NULL,
+            version INTEGER,
+            applied_at TEXT,
+            source TEXT,
+            inserted INTEGER,
+            changed INTEGER,
+            removed INTEGER,
+            unchanged INTEGER,
+            apply_ms REAL
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_courier_changesets_courier ON courier_changesets(courier, id)")
+    cur.execute(UPLOAD_JOBS_SQL)
+    cur.execute("CREATE TABLE IF NOT EXISTS app_meta(key TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)")
+    cur.execute("INSERT OR IGNORE INTO app_meta(key, value) VALUES ('courier_version', 0)")
     cols = _colset(cur, "couriers")
     if "fuel_basis" not in cols:
         log.warning("Migrating: adding 'fuel_basis' column (default 'freight')")
@@ -65,10 +145,33 @@ def db_init_migrate_and_report():
     if "updated_at" not in cols:
         log.warning("Migrating: adding 'updated_at' column")
         cur.execute("ALTER TABLE couriers ADD COLUMN updated_at TEXT")
+    if "pincode_rows" not in cols:
+        log.warning("Migrating: adding 'pincode_rows' column")
+        cur.execute("ALTER TABLE couriers ADD COLUMN pincode_rows INTEGER")
     conn.commit()
     # Backfill
     cur.execute("UPDATE couriers SET fuel_basis='freight' WHERE fuel_basis IS NULL OR TRIM(fuel_basis)=''")
     conn.commit()
+    pending = cur.execute("SELECT name, file_path FROM couriers WHERE pincode_rows IS NULL AND file_path IS NOT NULL").fetchall()
+    for r in pending:
+        if not os.path.exists(r["file_path"]):
+            log.warning("Cannot backfill pincodes for %s: file missing (%s)", r["name"], r["file_path"])
+            continue
+        try:
+            changes = store_courier_pincodes(cur, r["name"], load_pincode_frame(r["file_path"]))
+            bump_courier_version(cur)
+            conn.commit()
+            log.warning("Migrating: stored %d pincodes for %s", changes.rows, r["name"])
+        except Exception as e:
+            conn.rollback()
+            log.exception("Failed to backfill pincodes for %s: %s", r["name"], e)
+    if new_daily:
+        days = backfill_daily(conn)
+        if days:
+            log.warning("Migrating: rolled recent_searches up into %d daily aggregates", days)
+    interrupted = fail_interrupted(conn)
+    if interrupted:
+        log.warning("Marked %d upload jobs interrupted by the last shutdown as failed", interrupted)
     # Report
     rows = cur.execute("""SELECT name, fuel_basis, fuel_pct, docket, gst_pct, min_charge, LENGTH(rates) AS rlen, file_path 
                           FROM couriers ORDER BY name""").fetchall()
@@ -80,11 +183,47 @@ def db_init_migrate_and_report():
             log.debug("Courier %-16s basis=%-8s fuel%%=%.2f docket=%.2f gst%%=%.2f min=%.2f rates_len=%s file=%s",
                       r["name"], r["fuel_basis"], r["fuel_pct"] or 0, r["docket"] or 0,
                       r["gst_pct"] or 0, r["min_charge"] or 0, r["rlen"], r["file_path"] or "-")
-    conn.close()
 
 def now_iso():
     return datetime.datetime.now().isoformat(timespec="seconds")
 
+# ---------- Compiled courier configs ----------
+# Parsed once per courier version and shared by every request in this process. The
+# version lives in app_meta so an add/update/delete in one gunicorn worker
+# invalidates the cache in all of them.
+_COURIER_CACHE = {"snapshot": (None, ())}
+_COURIER_CACHE_LOCK = threading.Lock()
+
+def bump_courier_version(cur):
+    cur.execute("UPDATE app_meta SET value = value + 1 WHERE key='courier_version'")
+
+def courier_version(cur) -> int:
+    row = cur.execute("SELECT value FROM app_meta WHERE key='courier_version'").fetchone()
+    return row[0] if row else 0
+
+def load_courier_configs(cur) -> tuple:
+    """Return compiled CourierConfig objects, re-reading couriers only when the version moved."""
+    return courier_snapshot(cur)[1]
+
+def courier_snapshot(cur) -> tuple:
+    """(courier version, compiled configs) as one consistent pair."""
+    version = courier_version(cur)
+    snap = _COURIER_CACHE["snapshot"]
+    if snap[0] == version:
+        return snap
+    with _COURIER_CACHE_LOCK:
+        if _COURIER_CACHE["snapshot"][0] != version:
+            rows = cur.execute("""
+                SELECT name, file_path, rates, docket, fuel_pct, fuel_basis, insurance_pct, insurance_flat,
+                       oda_type, oda_fixed, gst_pct, min_charge, updated_at, pincode_rows
+                FROM couriers
+            """).fetchall()
+            configs = tuple(CourierConfig(dict(r)) for r in rows)
+            for cfg in configs:
+                log.debug("Compiled courier %s (v%s): rates=%s", cfg.name, version, str(cfg.rates)[:200])
+            _COURIER_CACHE["snapshot"] = (version, configs)
+        return _COURIER_CACHE["snapshot"]
+
 @app.route('/', methods=['GET','POST'])
 def login():
     if request.method == 'POST':
@@ -104,6 +243,11 @@ def dashboard():
     if 'user' not in session: return redirect(url_for('login'))
     return render_template('dashboard.html')
 
+@app.route('/recent')
+def recent():
+    if 'user' not in session: return redirect(url_for('login'))
+    return render_template('recent.html')
+
 @app.route('/manage')
 def manage():
     if 'user' not in session: return redirect(url_for('login'))
@@ -124,39 +268,266 @@ def allowed_file(fn: str) -> bool:
     return "." in fn and fn.rsplit(".",1)[1].lower() in ALLOWED_EXTS
 
 # ---------- Courier APIs ----------
-@app.route('/api/couriers', methods=['GET'])
-def api_list_couriers():
-    if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
-    conn = db_connect(); cur = conn.cursor()
-    rows = cur.execute("""
-        SELECT name, file_path, docket, fuel_pct, fuel_basis, insurance_pct, insurance_flat,
-               oda_type, oda_fixed, gst_pct, min_charge, updated_at, rates
-        FROM couriers ORDER BY name
-    """).fetchall()
-    conn.close()
-    out = []
-    for r in rows:
-        d = dict(r)
+# GET /api/couriers and /api/courier/<name> take `fields=a,b,...` to return only those
+# columns (the rates blob is neither read nor parsed unless asked for; `rates_preview` is
+# the first RATES_PREVIEW_CHARS of its JSON text) and answer If-None-Match with 304.
+# The ETag covers the courier version, MAX(updated_at), the courier count and the
+# request's projection, so checking it costs one small query and no JSON.
+COURIER_LIST_FIELDS = ("name", "file_path", "docket", "fuel_pct", "fuel_basis", "insurance_pct", "insurance_flat",
+                       "oda_type", "oda_fixed", "gst_pct", "min_charge", "updated_at", "rates")
+RATES_PREVIEW_CHARS = 200
+COMPUTED_COURIER_FIELDS = {"rates_preview": f"substr(rates, 1, {RATES_PREVIEW_CHARS})"}
+
+def requested_fields(allowed):
+    """The `fields` query parameter as a tuple (None when absent); ValueError for unknown names."""
+    raw = request.args.get("fields")
+    if raw is None:
+        return None
+    fields = tuple(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    unknown = [f for f in fields if f not in allowed and f not in COMPUTED_COURIER_FIELDS]
+    if not fields or unknown:
+        raise ValueError(f"unknown fields {', '.join(unknown)}" if unknown else "fields is empty")
+    return fields
+
+def courier_select(fields) -> str:
+    return ", ".join(f"{COMPUTED_COURIER_FIELDS[f]} AS {f}" if f in COMPUTED_COURIER_FIELDS else f for f in fields)
+
+def courier_dict(row) -> dict:
+    d = dict(row)
+    if "rates" in d:
         try:
             d["rates"] = json.loads(d.get("rates") or "{}")
         except Exception:
             d["rates"] = {}
-        out.append(d)
-    return jsonify(out)
+    return d
+
+def couriers_etag(cur, *parts) -> str:
+    state = cur.execute("""SELECT (SELECT value FROM app_meta WHERE key='courier_version'),
+                                  (SELECT MAX(updated_at) FROM couriers), (SELECT COUNT(*) FROM couriers)""").fetchone()
+    return hashlib.sha1(json.dumps([*state, *parts]).encode()).hexdigest()[:24]
+
+def conditional_json(etag: str, build):
+    """304 when the client already has `etag`, else jsonify(build()); the browser revalidates every time."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+@app.route('/api/couriers', methods=['GET'])
+def api_list_couriers():
+    if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
+    try:
+        fields = requested_fields(COURIER_LIST_FIELDS) or COURIER_LIST_FIELDS
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    cur = db.connection().cursor()
+
+    def build():
+        rows = cur.execute(f"SELECT {courier_select(fields)} FROM couriers ORDER BY name").fetchall()
+        return [courier_dict(r) for r in rows]
+    return conditional_json(couriers_etag(cur, "list", fields), build)
 
 @app.route('/api/courier/<name>', methods=['GET'])
 def api_get_courier(name):
     if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
-    conn = db_connect(); cur = conn.cursor()
-    row = cur.execute("SELECT * FROM couriers WHERE name=?", (name,)).fetchone()
-    conn.close()
+    cur = db.connection().cursor()
+    try:
+        fields = requested_fields(_colset(cur, "couriers"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    etag = couriers_etag(cur, "courier", name, fields)
+    if request.if_none_match.contains(etag):
+        return conditional_json(etag, None)
+    row = cur.execute(f"SELECT {courier_select(fields) if fields else '*'} FROM couriers WHERE name=?", (name,)).fetchone()
     if not row: return jsonify({"error":"Not found"}), 404
-    d = dict(row)
+    return conditional_json(etag, lambda: courier_dict(row))
+
+@app.route('/api/courier/<name>/changesets', methods=['GET'])
+def api_courier_changesets(name):
+    if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
+    limit = max(1, min(int(request.args.get("limit") or 20), 500))
+    rows = db.connection().execute(
+        "SELECT * FROM courier_changesets WHERE courier=? ORDER BY id DESC LIMIT ?", (name, limit)).fetchall()
+    return jsonify([dict(r) for r in rows])
+
+# ---------- Courier uploads ----------
+# A rate-sheet upload is saved under uploads/.staging and processed by an upload job in the
+# background (see upload_jobs.py); the endpoints answer 202 with the job id. The job parses
+# and indexes the staged copy, then moves the sheet and its pincode store into place and
+# commits the courier row, pincode diff and version bump in one transaction, so the
+# previous version keeps serving quotes until the new one is complete. The live files it
+# replaces are kept in the job's staging directory until the commit and moved back if it
+# fails. Requests without a file are applied inline as before.
+STAGING_DIR = os.path.join(UPLOAD_DIR, ".staging")
+UPDATE_FIELDS = {
+    "docket": float, "fuel_pct": float, "insurance_pct": float, "insurance_flat": float,
+    "oda_type": str, "oda_fixed": float, "gst_pct": float, "min_charge": float,
+    "fuel_basis": str
+}
+
+def stage_upload(file) -> tuple:
+    """Save an uploaded sheet in its own staging directory; returns (staged_path, final_path)."""
+    fname = secure_filename(file.filename)
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    staged = os.path.join(tempfile.mkdtemp(dir=STAGING_DIR), fname)
+    file.save(staged)
+    return staged, os.path.join(UPLOAD_DIR, fname)
+
+def promote_upload(staged: str, final: str, moves: list):
+    """
+    Move a processed sheet and its pincode store from staging to their live paths (renames
+    keep the store stamp valid). A live file being replaced is first moved aside in the
+    staging directory; each move is appended to `moves` as (live, backup or None) as soon as
+    it is done, so restore_upload can undo a partial promotion.
+    """
+    for src, dst in ((cache_path(staged), cache_path(final)), (staged, final)):
+        if not os.path.exists(src):
+            continue
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        backup = None
+        if os.path.exists(dst):
+            backup = src + ".prev"
+            os.replace(dst, backup)
+            moves.append((dst, backup))
+        os.replace(src, dst)
+        if backup is None:
+            moves.append((dst, None))
+
+def restore_upload(moves: list):
+    """Undo promote_upload after a failed commit: previous files back, files it added removed."""
+    for live, backup in reversed(moves):
+        try:
+            if backup is None:
+                os.remove(live)
+            elif os.path.exists(backup):
+                os.replace(backup, live)
+        except OSError as e:
+            log.error("Could not restore %s after a failed upload: %s", live, e)
+
+def discard_staged(staged: str):
+    """Remove an upload's staging directory (its leftover sheet, pincode store and backups)."""
+    job_dir = os.path.dirname(staged)
+    if os.path.dirname(os.path.abspath(job_dir)) == os.path.abspath(STAGING_DIR):
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+def apply_courier_add(name: str, fields: dict, saved_path=None, pincodes=None, staged=None) -> dict:
+    """Upsert a courier with its pincode rows and bump the version in one transaction."""
+    conn = db.connection(); cur = conn.cursor()
+    moves = []
+    cur.execute("BEGIN IMMEDIATE")
     try:
-        d["rates"] = json.loads(d.get("rates") or "{}")
+        prev = cur.execute("SELECT file_path FROM couriers WHERE name=?", (name,)).fetchone()
+        # upsert keeps the row (and its id) of an existing courier instead of delete + insert
+        cur.execute("""
+            INSERT INTO couriers
+            (name, file_path, rates, docket, fuel_pct, fuel_basis, insurance_pct, insurance_flat, oda_type, oda_fixed, gst_pct, min_charge, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                file_path=excluded.file_path, rates=excluded.rates, docket=excluded.docket, fuel_pct=excluded.fuel_pct,
+                fuel_basis=excluded.fuel_basis, insurance_pct=excluded.insurance_pct, insurance_flat=excluded.insurance_flat,
+                oda_type=excluded.oda_type, oda_fixed=excluded.oda_fixed, gst_pct=excluded.gst_pct,
+                min_charge=excluded.min_charge, updated_at=excluded.updated_at
+        """, (name, saved_path, fields["rates"], fields["docket"], fields["fuel_pct"], fields["fuel_basis"],
+              fields["insurance_pct"], fields["insurance_flat"], fields["oda_type"], fields["oda_fixed"],
+              fields["gst_pct"], fields["min_charge"], now_iso()))
+        changes = store_courier_pincodes(cur, name, pincodes)
+        bump_courier_version(cur)
+        version = record_changeset(cur, name, saved_path, changes)
+        if staged:
+            promote_upload(staged, saved_path, moves)
+        conn.commit()
     except Exception:
-        d["rates"] = {}
-    return jsonify(d)
+        conn.rollback()
+        restore_upload(moves)
+        raise
+    invalidate_pincode_index(saved_path, prev["file_path"] if prev else None)
+    quote_cache.clear()
+    log.info("Courier added/updated: %s fuel_basis=%s fuel_pct=%.2f min_charge=%.2f rates_preview=%s file=%s",
+             name, fields["fuel_basis"], fields["fuel_pct"], fields["min_charge"],
+             textwrap.shorten(fields["rates"][:1000], width=120), saved_path or "-")
+    return {"message": f"Courier {name} added/updated.", "version": version, "changeset": changes.summary()}
+
+def apply_courier_update(name: str, fields: dict, saved_path=None, sheet=None, staged=None) -> dict:
+    """Apply updated fields (and a parsed sheet) to a courier in one transaction."""
+    conn = db.connection(); cur = conn.cursor()
+    moves = []
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        row = cur.execute("SELECT * FROM couriers WHERE name=?", (name,)).fetchone()
+        if not row:
+            raise LookupError(f"Courier {name} not found")
+        updates, changes = {}, None
+        if sheet is not None:
+            updates["file_path"] = saved_path
+            if sheet.records_json is not None:
+                updates["rates"] = sheet.records_json
+            changes = store_courier_pincodes(cur, name, sheet.pincodes)
+        updates.update(fields)  # form rates win over the sheet's records
+        if not updates:
+            conn.rollback()
+            return {"message": f"Courier {name} updated."}
+        updates["updated_at"] = now_iso()
+        old_version = courier_version(cur)
+        cur.execute(f"UPDATE couriers SET {', '.join(f'{k}=?' for k in updates)} WHERE name=?", (*updates.values(), name))
+        new_row = cur.execute("SELECT * FROM couriers WHERE name=?", (name,)).fetchone()
+        bump_courier_version(cur)
+        version = record_changeset(cur, name, new_row["file_path"], changes) if changes else courier_version(cur)
+        if staged:
+            promote_upload(staged, saved_path, moves)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        restore_upload(moves)
+        raise
+    if saved_path:
+        invalidate_pincode_index(saved_path, row["file_path"])
+    # a sheet refresh that left every price input alone only invalidates the pins it touched
+    old_cfg, new_cfg = CourierConfig(dict(row)), CourierConfig(dict(new_row))
+    if changes and old_cfg.pricing_key() == new_cfg.pricing_key() and old_cfg.pincode_rows and new_cfg.pincode_rows:
+        kept = quote_cache.rekey(old_version, version, changes.pins)
+        log.info("Quote cache: kept %d entries, invalidated %d changed pins of %s", kept, len(changes.pins), name)
+    else:
+        quote_cache.clear()
+    log.info("Courier updated: %s", name)
+    out = {"message": f"Courier {name} updated.", "version": version}
+    if changes:
+        out["changeset"] = changes.summary()
+    return out
+
+def process_upload(job: dict, progress) -> dict:
+    """Upload job handler: ingest the staged sheet, then go live with it."""
+    payload = job["payload"]
+    staged, saved_path = payload["staged_path"], payload["saved_path"]
+    try:
+        progress("parsing")
+        sheet = ingest_rate_file(staged, progress=progress)
+        progress("applying")
+        if job["kind"] == "add":
+            fields = {**payload["fields"], "rates": sheet.records_json or "{}"}
+            return apply_courier_add(job["courier"], fields, saved_path, sheet.pincodes, staged)
+        return apply_courier_update(job["courier"], payload["fields"], saved_path, sheet, staged)
+    finally:
+        discard_staged(staged)
+
+upload_jobs = UploadJobs(DB_PATH, process_upload)
+
+def reap_upload_jobs() -> int:
+    """Fail upload jobs left open by exited workers; gunicorn runs this as each worker starts."""
+    n = fail_orphaned(db.connection())
+    if n:
+        log.warning("Marked %d upload jobs of exited workers as failed", n)
+    return n
+
+def submit_upload(kind: str, name: str, file, fields: dict):
+    staged, saved_path = stage_upload(file)
+    job_id = upload_jobs.submit(db.connection(), kind, name,
+                                {"staged_path": staged, "saved_path": saved_path, "fields": fields})
+    log.info("Queued %s upload job %s for %s (%s)", kind, job_id, name, os.path.basename(saved_path))
+    return jsonify({"message": f"Upload for {name} queued.", "job_id": job_id,
+                    "status_url": url_for("api_upload_job", job_id=job_id)}), 202
 
 @app.route('/api/couriers/add', methods=['POST'])
 def api_add_courier():
@@ -164,90 +535,45 @@ def api_add_courier():
     name = (request.form.get('name') or "").strip()
     if not name: return jsonify({"error": "Missing name"}), 400
     file = request.files.get('file')
+    has_file = bool(file and allowed_file(file.filename))
 
-    rates_json = {}
-    saved_path = None
-    if file and allowed_file(file.filename):
-        fname = secure_filename(file.filename)
-        saved_path = os.path.join(UPLOAD_DIR, fname)
-        file.save(saved_path)
+    rates_text = "{}"
+    if not has_file:
         try:
-            if fname.lower().endswith((".xlsx",".xls")):
-                df = pd.read_excel(saved_path)
-            elif fname.lower().endswith(".csv"):
-                df = pd.read_csv(saved_path)
-            else:
-                df = None
-            if df is not None:
-                rates_json = json.loads(df.to_json(orient="records"))
+            rates = json.loads(request.form.get('rates') or "{}")
         except Exception as e:
-            log.exception("Failed to parse uploaded rates file for %s: %s", name, e)
-            rates_json = {}
-    else:
+            log.warning("Bad 'rates' JSON in form for %s: %s", name, e); rates = {}
         try:
-            rates_json = json.loads(request.form.get('rates') or "{}")
-        except Exception as e:
-            log.warning("Bad 'rates' JSON in form for %s: %s", name, e)
-            rates_json = {}
-
-    docket         = float(request.form.get('docket') or 0)
-    fuel_pct       = float(request.form.get('fuel_pct') or 0)
-    fuel_basis     = (request.form.get('fuel_basis') or "freight").strip().lower()
-    insurance_pct  = float(request.form.get('insurance_pct') or 0)
-    insurance_flat = float(request.form.get('insurance_flat') or 0)
-    oda_type       = (request.form.get('oda_type') or "Fixed").strip()
-    oda_fixed      = float(request.form.get('oda_fixed') or 0)
-    gst_pct        = float(request.form.get('gst_pct') or 18)
-    min_charge     = float(request.form.get('min_charge') or 0)
-
-    conn = db_connect(); cur = conn.cursor()
-    cur.execute("""
-        INSERT OR REPLACE INTO couriers
-        (name, file_path, rates, docket, fuel_pct, fuel_basis, insurance_pct, insurance_flat, oda_type, oda_fixed, gst_pct, min_charge, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (name, saved_path, json.dumps(rates_json), docket, fuel_pct, fuel_basis, insurance_pct, insurance_flat, oda_type, oda_fixed, gst_pct, min_charge, now_iso()))
-    conn.commit(); conn.close()
-    log.info("Courier added/updated: %s fuel_basis=%s fuel_pct=%.2f min_charge=%.2f rates_preview=%s file=%s",
-             name, fuel_basis, fuel_pct, min_charge,
-             textwrap.shorten(json.dumps(rates_json) or "{}", width=120), saved_path or "-")
-    return jsonify({"message": f"Courier {name} added/updated."})
+            compile_slabs(rates)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid slab rate card: {e}"}), 400
+        rates_text = json.dumps(rates)
+
+    fields = {
+        "rates":          rates_text,
+        "docket":         float(request.form.get('docket') or 0),
+        "fuel_pct":       float(request.form.get('fuel_pct') or 0),
+        "fuel_basis":     (request.form.get('fuel_basis') or "freight").strip().lower(),
+        "insurance_pct":  float(request.form.get('insurance_pct') or 0),
+        "insurance_flat": float(request.form.get('insurance_flat') or 0),
+        "oda_type":       (request.form.get('oda_type') or "Fixed").strip(),
+        "oda_fixed":      float(request.form.get('oda_fixed') or 0),
+        "gst_pct":        float(request.form.get('gst_pct') or 18),
+        "min_charge":     float(request.form.get('min_charge') or 0),
+    }
+    if has_file:
+        return submit_upload("add", name, file, fields)
+    return jsonify(apply_courier_add(name, fields))
 
 @app.route('/api/couriers/update/<name>', methods=['POST'])
 def api_update_courier(name):
     if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
-    conn = db_connect(); cur = conn.cursor()
-    row = cur.execute("SELECT * FROM couriers WHERE name=?", (name,)).fetchone()
-    if not row:
-        conn.close()
+    cur = db.connection().cursor()
+    if not cur.execute("SELECT 1 FROM couriers WHERE name=?", (name,)).fetchone():
         return jsonify({"error":"Courier not found"}), 404
 
-    file = request.files.get('file')
-    updates, values = [], []
-
-    if file and allowed_file(file.filename):
-        fname = secure_filename(file.filename)
-        saved_path = os.path.join(UPLOAD_DIR, fname)
-        file.save(saved_path)
-        updates.append("file_path=?"); values.append(saved_path)
-        try:
-            if fname.lower().endswith((".xlsx",".xls")):
-                df = pd.read_excel(saved_path)
-            elif fname.lower().endswith(".csv"):
-                df = pd.read_csv(saved_path)
-            else:
-                df = None
-            if df is not None:
-                rates_json = json.loads(df.to_json(orient="records"))
-                updates.append("rates=?"); values.append(json.dumps(rates_json))
-        except Exception as e:
-            log.exception("Failed to parse updated rates file for %s: %s", name, e)
-
-    field_specs = {
-        "docket": float, "fuel_pct": float, "insurance_pct": float, "insurance_flat": float,
-        "oda_type": str, "oda_fixed": float, "gst_pct": float, "min_charge": float,
-        "fuel_basis": str
-    }
-    for k, caster in field_specs.items():
+    fields = {}
+    for k, caster in UPDATE_FIELDS.items():
         if k in request.form:
             v = request.form.get(k)
             if caster is float:
@@ -255,101 +581,106 @@ def api_update_courier(name):
                 except Exception: v = 0.0
             else:
                 v = (v or "").strip()
-            updates.append(f"{k}=?"); values.append(v)
+            fields[k] = v
 
     if 'rates' in request.form:
         try:
             rjson = json.loads(request.form.get('rates') or "{}")
         except Exception as e:
             log.warning("Bad 'rates' JSON on update for %s: %s", name, e); rjson = {}
-        updates.append("rates=?"); values.append(json.dumps(rjson))
+        try:
+            compile_slabs(rjson)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid slab rate card: {e}"}), 400
+        fields["rates"] = json.dumps(rjson)
 
-    if updates:
-        updates.append("updated_at=?"); values.append(now_iso())
-        values.append(name)
-        cur.execute(f"UPDATE couriers SET {', '.join(updates)} WHERE name=?", values)
-        conn.commit()
+    file = request.files.get('file')
+    if file and allowed_file(file.filename):
+        return submit_upload("update", name, file, fields)
+    return jsonify(apply_courier_update(name, fields))
 
-    conn.close()
-    log.info("Courier updated: %s", name)
-    return jsonify({"message": f"Courier {name} updated."})
+@app.route('/api/couriers/jobs/<job_id>', methods=['GET'])
+def api_upload_job(job_id):
+    if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
+    job = UploadJobs.get(db.connection(), job_id)
+    if not job: return jsonify({"error":"Not found"}), 404
+    job.pop("payload")
+    return jsonify(job)
 
 @app.route('/api/couriers/delete/<name>', methods=['POST'])
 def api_delete_courier(name):
     if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
-    conn = db_connect(); cur = conn.cursor()
+    conn = db.connection(); cur = conn.cursor()
+    row = cur.execute("SELECT file_path FROM couriers WHERE name=?", (name,)).fetchone()
+    if row: invalidate_pincode_index(row["file_path"])
     cur.execute("DELETE FROM couriers WHERE name=?", (name,))
-    conn.commit(); conn.close()
+    cur.execute("DELETE FROM courier_pincodes WHERE courier=?", (name,))
+    bump_courier_version(cur)
+    conn.commit()
+    quote_cache.clear()
     log.info("Courier deleted: %s", name)
     return jsonify({"message": f"Courier {name} deleted."})
 
 @app.route('/api/courier/download/<name>', methods=['GET'])
 def api_download_courier(name):
     if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
-    conn = db_connect(); cur = conn.cursor()
+    cur = db.connection().cursor()
     row = cur.execute("SELECT file_path FROM couriers WHERE name=?", (name,)).fetchone()
-    conn.close()
     if not row or not row["file_path"] or not os.path.exists(row["file_path"]):
         return abort(404)
     return send_file(row["file_path"], as_attachment=True)
 
-# ---------- Helpers for Excel pincode fetch ----------
-def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
-    """Normalize common column header variations to standard names."""
-    if df is None or df.empty:
-        return df
-    # lower-case headers
-    df = df.rename(columns={c: str(c).strip().lower() for c in df.columns})
-    # common aliases
-    aliases = {
-        "pin": "pincode", "pin code": "pincode", "pincode": "pincode", "postal": "pincode", "zip": "pincode",
-        "zone name": "zone", "zonename": "zone",
-        "statename": "state",
-        "loc": "location", "city": "location", "area": "location",
-        "distance": "oda_distance", "dist": "oda_distance", "distance_km": "oda_distance", "oda_km": "oda_distance",
-        "oda": "status"  # sometimes sheet has a column 'oda' with 'yes/no' - map to status
-    }
-    for old, new in list(aliases.items()):
-        if old in df.columns and new not in df.columns:
-            df = df.rename(columns={old: new})
-    # ensure expected columns exist
-    for need in ["pincode","zone","state","location","status","oda_distance"]:
-        if need not in df.columns:
-            df[need] = None
-    # normalize content
-    if "pincode" in df.columns:
-        df["pincode"] = df["pincode"].astype(str).str.replace(r"\.0$", "", regex=True).str.strip()
-    if "status" in df.columns:
-        df["status"] = df["status"].astype(str).str.upper().str.strip()
-        df["status"] = df["status"].replace({"YES":"ODA", "Y":"ODA"})
-    # numeric distance
-    if "oda_distance" in df.columns:
-        def _to_float(x):
-            try: return float(str(x).strip())
-            except: return 0.0
-        df["oda_distance"] = df["oda_distance"].map(_to_float)
-    return df
+# ---------- Pincode index cache ----------
+# excel_path -> ((mtime_ns, size), PincodeStore); the store is a read-only memory map of
+# uploads/.cache/<file>.pins, so every worker shares the same pages. Remapped when the file
+# changes on disk and dropped explicitly by the add/update/delete endpoints.
+_PIN_INDEX = {}
+_PIN_INDEX_LOCK = threading.Lock()
+
+def _file_stamp(path: str):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def build_pincode_index(excel_path: str):
+    """Map the sheet's PincodeStore (parsing and writing it first if missing or stale)."""
+    store = load_pincode_store(excel_path)
+    log.info("Pincode index mapped for %s: %d pins, %d KB", os.path.basename(excel_path), len(store), store.nbytes() // 1024)
+    return store
+
+def get_pincode_index(excel_path: str):
+    """Return the cached pincode store for a sheet, remapping it if the file changed."""
+    stamp = _file_stamp(excel_path)
+    hit = _PIN_INDEX.get(excel_path)
+    if hit and hit[0] == stamp:
+        return hit[1]
+    with _PIN_INDEX_LOCK:
+        hit = _PIN_INDEX.get(excel_path)
+        if hit and hit[0] == stamp:
+            return hit[1]
+        index = build_pincode_index(excel_path)
+        _PIN_INDEX[excel_path] = (stamp, index)
+        return index
+
+def invalidate_pincode_index(*paths):
+    """Drop cached indexes for the given sheet paths (all when called without args)."""
+    with _PIN_INDEX_LOCK:
+        if not paths:
+            _PIN_INDEX.clear()
+        for p in paths:
+            if p: _PIN_INDEX.pop(p, None)
 
 def fetch_pincode_row_from_excel(excel_path: str, pin: str):
-    """Read Excel/CSV, normalize, and return first matching row dict (or None)."""
+    """Look up the first matching row dict for a pincode (or None) via the cached index."""
     if not excel_path or not os.path.exists(excel_path):
         log.warning("Excel not found for pincode fetch: %s", excel_path)
         return None
     try:
-        if excel_path.lower().endswith((".xlsx",".xls")):
-            df = pd.read_excel(excel_path)
-        elif excel_path.lower().endswith(".csv"):
-            df = pd.read_csv(excel_path)
-        else:
-            log.warning("Unsupported file extension for %s", excel_path); return None
-        df = normalize_columns(df)
         pin_s = str(pin).strip()
-        match = df[df["pincode"].astype(str) == pin_s]
-        if match.empty:
-            log.info("No pincode %s in file %s", pin_s, os.path.basename(excel_path))
+        row = get_pincode_index(excel_path).get(pin_s)
+        if row is None:
+            log.debug("No pincode %s in file %s", pin_s, os.path.basename(excel_path))
             return None
-        row = match.iloc[0].to_dict()
-        log.info("Matched pin=%s in %s → zone=%s state=%s loc=%s status=%s dist=%.2f",
+        log.debug("Matched pin=%s in %s → zone=%s state=%s loc=%s status=%s dist=%.2f",
                  pin_s, os.path.basename(excel_path),
                  row.get("zone"), row.get("state"), row.get("location"),
                  row.get("status"), float(row.get("oda_distance") or 0))
@@ -358,172 +689,713 @@ def fetch_pincode_row_from_excel(excel_path: str, pin: str):
         log.exception("Failed reading excel for pin %s: %s", pin, e)
         return None
 
-# ---------- ODA helper ----------
-def get_bluedart_oda_charge(distance_km: float, weight_kg: float) -> float:
-    ODA_MATRIX = [
-        (20, 50,  [(100, 550),  (250, 990),  (500, 1100), (1000, 1375)]),
-        (51, 100, [(100, 825),  (250, 1210), (500, 1375), (1000, 1650)]),
-        (101,150, [(100,1100),  (250,1650),  (500,1925),  (1000,2200)]),
-        (151,200, [(100,1375),  (250,1925),  (500,2200),  (1000,2475)]),
-        (201,250, [(100,1650),  (250,2200),  (500,2475),  (1000,2750)]),
-        (251,300, [(100,1925),  (250,2475),  (500,2750),  (1000,3025)]),
-        (301,350, [(100,2200),  (250,2750),  (500,3025),  (1000,3300)]),
-        (351,400, [(100,2475),  (250,3025),  (500,3300),  (1000,3575)]),
-        (401,450, [(100,2750),  (250,3300),  (500,3575),  (1000,3850)]),
-        (451,500, [(100,3025),  (250,3575),  (500,3850),  (1000,4125)]),
-    ]
-    row = next((r for r in ODA_MATRIX if distance_km <= r[0]), ODA_MATRIX[-1])
-    tiers = row[2]
-    for max_wt, charge in tiers:
-        if weight_kg <= max_wt:
-            return float(charge)
-    return float(tiers[-1][1])
+# ---------- Persisted pincode tables ----------
+SQL_IN_CHUNK = 500  # stay well under SQLITE_MAX_VARIABLE_NUMBER
+
+class PincodeChangeset(namedtuple("PincodeChangeset", "inserted changed removed unchanged apply_ms")):
+    """Pincodes inserted/changed/removed by a sheet update (lists) plus the unchanged count."""
+    @property
+    def pins(self) -> set:
+        return {*self.inserted, *self.changed, *self.removed}
+
+    @property
+    def rows(self) -> int:
+        return len(self.inserted) + len(self.changed) + self.unchanged
+
+    def summary(self, sample: int = 20) -> dict:
+        return {"inserted": len(self.inserted), "changed": len(self.changed), "removed": len(self.removed),
+                "unchanged": self.unchanged, "rows": self.rows, "apply_ms": round(self.apply_ms, 2),
+                "sample": {k: getattr(self, k)[:sample] for k in ("inserted", "changed", "removed")}}
+
+def _pincode_rows(frame) -> dict:
+    """{pincode: (zone, state, location, status, oda_distance)} with NaN as None, as SQLite returns them."""
+    if frame is None or frame.empty:
+        return {}
+    cols = frame[["pincode", *PINCODE_COLUMNS]].astype(object)
+    cols = cols.where(cols.notna(), None)
+    return {r[0]: r[1:] for r in cols.itertuples(index=False, name=None)}
+
+def store_courier_pincodes(cur, courier: str, frame) -> PincodeChangeset:
+    """
+    Bring a courier's courier_pincodes rows in line with an ingested pincode frame by diffing
+    against what is stored: only inserted, changed and removed pincodes are written.
+    """
+    t = time.perf_counter()
+    new = _pincode_rows(frame)
+    raw = cur.connection.cursor()
+    raw.row_factory = None  # plain tuples: sqlite3.Row costs more than the diff itself here
+    old = {r[0]: r[1:] for r in raw.execute(
+        f"SELECT pincode, {', '.join(PINCODE_COLUMNS)} FROM courier_pincodes WHERE courier=?", (courier,))}
+    inserted = [p for p in new if p not in old]
+    changed = [p for p, v in new.items() if p in old and old[p] != v]
+    removed = [p for p in old if p not in new]
+    if removed:
+        cur.executemany("DELETE FROM courier_pincodes WHERE courier=? AND pincode=?", ((courier, p) for p in removed))
+    if inserted or changed:
+        cur.executemany(
+            "INSERT OR REPLACE INTO courier_pincodes(courier, pincode, zone, state, location, status, oda_distance) VALUES (?,?,?,?,?,?,?)",
+            ((courier, p, *new[p]) for p in itertools.chain(inserted, changed)))
+    cur.execute("UPDATE couriers SET pincode_rows=? WHERE name=?", (len(new), courier))
+    changes = PincodeChangeset(inserted, changed, removed, len(new) - len(inserted) - len(changed),
+                               (time.perf_counter() - t) * 1000.0)
+    log.info("Pincode rows for %s: +%d ~%d -%d (=%d) in %.1fms", courier, len(inserted), len(changed),
+             len(removed), changes.unchanged, changes.apply_ms)
+    return changes
+
+def record_changeset(cur, courier: str, source, changes: PincodeChangeset) -> int:
+    """Log a pincode changeset against the (already bumped) courier version; returns that version."""
+    version = courier_version(cur)
+    cur.execute("""INSERT INTO courier_changesets(courier, version, applied_at, source, inserted, changed, removed, unchanged, apply_ms)
+                   VALUES (?,?,?,?,?,?,?,?,?)""",
+                (courier, version, now_iso(), os.path.basename(source) if source else None, len(changes.inserted),
+                 len(changes.changed), len(changes.removed), changes.unchanged, round(changes.apply_ms, 2)))
+    return version
+
+def lookup_courier_pincodes(cur, pins) -> dict:
+    """Resolve every pin for every courier with indexed IN queries: {courier: [row, ...]}."""
+    uniq = list(dict.fromkeys(str(p).strip() for p in pins))
+    out = {}
+    for i in range(0, len(uniq), SQL_IN_CHUNK):
+        chunk = uniq[i:i + SQL_IN_CHUNK]
+        q = (f"SELECT courier, pincode, {', '.join(PINCODE_COLUMNS)} FROM courier_pincodes "
+             f"WHERE pincode IN ({','.join('?' * len(chunk))})")
+        for r in cur.execute(q, chunk).fetchall():
+            out.setdefault(r["courier"], []).append(dict(r))
+    return out
+
+def excel_pincode_rows(excel_path: str, pins) -> list:
+    """Rows for couriers not yet ingested into courier_pincodes, from the sheet's pincode store."""
+    if not excel_path or not os.path.exists(excel_path):
+        log.warning("Excel not found for pincode fetch: %s", excel_path)
+        return []
+    try:
+        return get_pincode_index(excel_path).rows(pins)
+    except Exception as e:
+        log.exception("Failed reading excel %s: %s", excel_path, e)
+        return []
+
+def join_pincode_rows(pins: pd.DataFrame, rows: list) -> pd.DataFrame:
+    """Left-join the requested pins (input order kept) against a courier's serviceability rows."""
+    served = pd.DataFrame(rows, columns=["pincode", *PINCODE_COLUMNS])
+    frame = pins.merge(served, on="pincode", how="left", indicator=True)
+    frame["matched"] = frame.pop("_merge") == "both"
+    return frame
 
 # ---------- Recommend ----------
+RESULT_COLUMNS = ["pincode", "weight", "courier", *RESULT_FIELDS, "reason", "rank"]
+
+def effective_weights(n: int, weights, volweights) -> list:
+    """Chargeable weight per pin: max(actual, volumetric); missing weights repeat the last one."""
+    eff = []
+    for idx in range(n):
+        wt = float(weights[idx] if idx < len(weights) else (weights[-1] if weights else 0))
+        vol = float(volweights[idx] if idx < len(volweights) else 0)
+        eff.append(max(wt, vol) if vol else wt)
+    return eff
+
+NON_SERVICEABLE = {"NOT FOUND", "NOT SERVICEABLE", "NON SERVICEABLE", "NON-SERVICEABLE", "NO", "N"}
+
+def parse_top_k(values) -> int:
+    """top_k from a request: mode=best means 1, top_k=N keeps the N cheapest; 0 returns every quote."""
+    top_k = int(values.get("top_k") or 0)
+    if not top_k and str(values.get("mode") or "").lower() == "best":
+        top_k = 1
+    if top_k < 0:
+        raise ValueError("top_k must be >= 0")
+    return top_k
+
+def _serviceable(c, frame: pd.DataFrame, q: dict) -> np.ndarray:
+    """Pins the courier serves: found in its sheet (when it has one) and not flagged non-serviceable."""
+    has_sheet = bool(c.pincode_rows) or (c.pincode_rows is None and bool(c.file_path))
+    ok = frame["matched"].to_numpy(dtype=bool) if has_sheet else np.ones(len(frame), dtype=bool)
+    return ok & ~np.isin(np.asarray(q["status"], dtype=object), list(NON_SERVICEABLE))
+
+def rank_quotes(quoted, n: int, top_k: int, serviceable_only: bool) -> np.ndarray:
+    """
+    (n, top_k) courier positions ordered by total per pin; -1 where fewer couriers qualify.
+    Only quotes with reason "OK" rank: a total without a rate ("Rate missing ...") is not a price.
+    """
+    totals = np.column_stack([np.array(q["total"], dtype=float) for _, q, _ in quoted])  # None -> nan
+    totals[np.isnan(totals)] = np.inf
+    totals[np.column_stack([np.asarray(q["reason"], dtype=object) != "OK" for _, q, _ in quoted])] = np.inf
+    if serviceable_only:
+        totals[~np.column_stack([ok for _, _, ok in quoted])] = np.inf
+    order = np.argsort(totals, axis=1, kind="stable")[:, :top_k]
+    picked = np.take_along_axis(totals, order, axis=1)
+    return np.where(np.isfinite(picked), order, -1)
+
+def quote_couriers(cur, couriers, pincodes, eff_weights, declared_value, serviceable_only=False) -> list:
+    """Price every pin against every courier: [(name, {field: list}, serviceable mask or None), ...]."""
+    with stage("pincode_lookup"):
+        pin_rows = lookup_courier_pincodes(cur, pincodes)
+        pins = pd.DataFrame({"pincode": [str(p).strip() for p in pincodes], "weight": eff_weights})
+
+    quoted, shared = [], {}
+    for c in couriers:
+        name = c.name
+        with stage("pincode_lookup"):
+            # ---- Stored pincode rows; Excel index only for couriers not yet ingested
+            if c.pincode_rows is not None:
+                served = pin_rows.get(name, [])
+            else:
+                served = excel_pincode_rows(c.file_path, pincodes) if c.file_path else []
+            frame = join_pincode_rows(pins, served)
+        with stage("pricing"):
+            engine = pricing_engines.get_engine(name)
+            q = pricing_engines.quote_many(engine, c, frame, declared_value, shared)
+            quoted.append((name, q, _serviceable(c, frame, q) if serviceable_only else None))
+    return quoted
+
+class StaleCouriers(RuntimeError):
+    """A pool worker compiled a different courier version than the request it was asked to price."""
+
+def _quote_worker_init():
+    # runs once per pool worker: own connection, couriers compiled up front
+    courier_snapshot(db.connection().cursor())
+
+def _quote_shard(pincodes, eff_weights, version, declared_value, serviceable_only):
+    cur = db.connection().cursor()
+    worker_version, couriers = courier_snapshot(cur)
+    if worker_version != version:
+        raise StaleCouriers(f"worker has courier version {worker_version}, request {version}")
+    return quote_couriers(cur, couriers, pincodes, eff_weights, declared_value, serviceable_only)
+
+quote_pool = QuotePool(initializer=_quote_worker_init, preload=[__name__])
+
+def merge_quoted(shards) -> list:
+    """Concatenate per-shard quote_couriers results back into one, in shard order."""
+    merged = []
+    for ci, (name, q, ok) in enumerate(shards[0]):
+        parts = [s[ci] for s in shards]
+        merged.append((name,
+                       {k: list(itertools.chain.from_iterable(p[1][k] for p in parts)) for k in q},
+                       None if ok is None else np.concatenate([p[2] for p in parts])))
+    return merged
+
+def price_couriers(cur, version, couriers, pincodes, eff_weights, declared_value, serviceable_only=False) -> list:
+    """
+    quote_couriers, sharded across quote_pool for batches of at least QUOTE_POOL_THRESHOLD pins
+    (needs the courier version so workers can prove they priced the same configs). Falls back
+    to the request thread if the pool fails.
+    """
+    if version is not None and quote_pool.should_shard(len(pincodes)):
+        try:
+            with stage("pricing"):  # lookups happen inside the workers
+                shards = quote_pool.map_shards(_quote_shard, list(pincodes), list(eff_weights),
+                                               version, declared_value, serviceable_only)
+            log.info("Priced %d pins on %d pool shards", len(pincodes), len(shards))
+            return merge_quoted(shards)
+        except Exception as e:
+            log.warning("Quote pool failed (%s); pricing %d pins in-thread", e, len(pincodes))
+    return quote_couriers(cur, couriers, pincodes, eff_weights, declared_value, serviceable_only)
+
+def cached_quote_couriers(cur, version, couriers, pincodes, eff_weights, declared_value) -> list:
+    """
+    quote_couriers through quote_cache: only pins missing from the cache are priced (and then
+    cached); hits are stitched back in request order. Serviceability is always computed so a
+    cached entry serves both serviceable_only and plain requests.
+    """
+    keys = [(version, str(p).strip(), float(w), declared_value) for p, w in zip(pincodes, eff_weights)]
+    with stage("quote_cache"):
+        entries = quote_cache.get_many(keys)
+    miss = [i for i, e in enumerate(entries) if e is None]
+    if miss:
+        whole = len(miss) == len(keys)
+        fresh = price_couriers(cur, version, couriers,
+                               pincodes if whole else [pincodes[i] for i in miss],
+                               eff_weights if whole else [eff_weights[i] for i in miss],
+                               declared_value, serviceable_only=True)
+        with stage("quote_cache"):
+            per_courier = [(tuple(q), list(zip(*q.values())), ok.tolist()) for _, q, ok in fresh]
+            computed = [tuple((fields, rows[j], ok[j]) for fields, rows, ok in per_courier) for j in range(len(miss))]
+            quote_cache.put_many([keys[i] for i in miss], computed)
+        if whole:
+            return fresh
+        for i, entry in zip(miss, computed):
+            entries[i] = entry
+    quoted = []
+    for ci, c in enumerate(couriers):
+        fields = entries[0][ci][0]
+        columns = zip(*(e[ci][1] for e in entries))
+        quoted.append((c.name, {k: list(col) for k, col in zip(fields, columns)},
+                       np.array([e[ci][2] for e in entries], dtype=bool)))
+    return quoted
+
+def quote_pincodes(cur, couriers, pincodes, eff_weights, declared_value, top_k=0, serviceable_only=False,
+                   version=None, use_cache=False, columnar=False):
+    """
+    Quote every pin against every courier; returns (results, recent rows). Results are in
+    pin x courier order, or with top_k the top_k cheapest couriers per pin (ranked), in which
+    case result dicts are only built for the winners. With columnar, results is the
+    format=columnar body instead (see `columnar_results`). `version` is the courier version
+    the configs were compiled at; it enables the process pool for large batches and, with
+    use_cache, the quote cache.
+    """
+    if not pincodes:
+        return (columnar_results([], [], []) if columnar else []), []
+    if use_cache and version is not None and pincodes and couriers:
+        quoted = cached_quote_couriers(cur, version, couriers, pincodes, eff_weights, declared_value)
+    else:
+        quoted = price_couriers(cur, version, couriers, pincodes, eff_weights, declared_value, serviceable_only)
+
+    checked_at = now_iso()
+    with stage("assemble"):
+        if columnar:
+            ranks = rank_quotes(quoted, len(pincodes), top_k, serviceable_only) if top_k and quoted else None
+            return (columnar_results(quoted, pincodes, eff_weights, ranks),
+                    _recent_rows(quoted, pincodes, eff_weights, checked_at))
+        if top_k:
+            return _best_results(quoted, pincodes, eff_weights, top_k, serviceable_only, checked_at)
+        return _all_results(quoted, pincodes, eff_weights, checked_at)
+
+def _recent_rows(quoted, pincodes, eff_weights, checked_at) -> list:
+    return [(checked_at, str(pin), name, eff_weights[idx], q["total"][idx])
+            for idx, pin in enumerate(pincodes) for name, q, _ in quoted]
+
+def _all_results(quoted, pincodes, eff_weights, checked_at):
+    # per-quote debug lines are built only when DEBUG is on, and then only for every Nth pin
+    debug_every = QUOTE_DEBUG_SAMPLE if log.isEnabledFor(logging.DEBUG) else 0
+    results, recent_rows = [], []
+    for idx, pin in enumerate(pincodes):
+        eff_weight = eff_weights[idx]
+        for name, q, _ in quoted:
+            total = q["total"][idx]
+            if debug_every and not idx % debug_every:
+                log.debug(("RECO pin=%s courier=%s weight=%.2f zone=%s zone_rate=%.2f base=%s docket=%s "
+                           "insurance=%s oda=%s fuel=%s gst=%s total=%s"),
+                          pin, name, eff_weight, q["zone"][idx], q["zone_rate"][idx], q["freight"][idx], q["docket"][idx],
+                          q["insurance"][idx], q["oda"][idx], q["fuel"][idx], q["gst"][idx], total)
+
+            results.append({
+                "pincode": str(pin),
+                "weight": eff_weight,
+                "courier": name,
+                **{k: v[idx] for k, v in q.items()},
+            })
+
+            recent_rows.append((checked_at, str(pin), name, eff_weight, total))
+    return results, recent_rows
+
+def _best_results(quoted, pincodes, eff_weights, top_k, serviceable_only, checked_at):
+    n = len(pincodes)
+    recent_rows = _recent_rows(quoted, pincodes, eff_weights, checked_at)
+    if not quoted or not n:
+        return [], recent_rows
+    ranks = rank_quotes(quoted, n, top_k, serviceable_only)
+    results = []
+    for idx, pin in enumerate(pincodes):
+        for rank, ci in enumerate(ranks[idx], start=1):
+            if ci < 0:
+                break
+            name, q, _ = quoted[ci]
+            results.append({
+                "pincode": str(pin),
+                "weight": eff_weights[idx],
+                "courier": name,
+                **{k: v[idx] for k, v in q.items()},
+                "rank": rank,
+            })
+    return results, recent_rows
+
+STRING_COLUMNS = ("courier", "status", "zone", "state", "location", "reason")
+
+def columnar_results(quoted, pincodes, eff_weights, ranks=None) -> dict:
+    """
+    format=columnar body: {"rows": n, "strings": [...], "columns": {field: list}} with one
+    list per RESULT_COLUMNS field, rows in the order of _all_results (pin x courier) or, with
+    ranks, of _best_results ("rank" is only present then). STRING_COLUMNS hold indexes into
+    the shared `strings` table (null for a missing value), so repeated courier, zone, state
+    and location names are sent once instead of once per row.
+    """
+    n = len(pincodes)
+    if ranks is None:
+        pin_ix, courier_ix = np.repeat(np.arange(n), len(quoted)), np.tile(np.arange(len(quoted)), n)
+    else:
+        pin_ix, slot = np.nonzero(ranks >= 0)  # row-major, so per pin in rank order
+        courier_ix = ranks[pin_ix, slot]
+
+    def take(per_courier):
+        return np.array(per_courier, dtype=object).reshape(len(quoted), n)[courier_ix, pin_ix]
+
+    columns = {
+        "pincode": np.array([str(p) for p in pincodes], dtype=object)[pin_ix].tolist(),
+        "weight": np.array(eff_weights, dtype=float)[pin_ix].tolist(),
+    }
+    text = {"courier": np.array([name for name, _, _ in quoted], dtype=object)[courier_ix]}
+    for k in (*RESULT_FIELDS, "reason"):
+        if k in STRING_COLUMNS:
+            text[k] = take([q[k] for _, q, _ in quoted])
+        else:
+            columns[k] = take([q[k] for _, q, _ in quoted]).tolist()
+    codes, strings = pd.factorize(np.concatenate([text[k] for k in STRING_COLUMNS]))
+    codes = np.where(codes < 0, None, codes) if (codes < 0).any() else codes
+    for i, k in enumerate(STRING_COLUMNS):
+        columns[k] = codes[i * len(pin_ix):(i + 1) * len(pin_ix)].tolist()
+    if ranks is not None:
+        columns["rank"] = (slot + 1).tolist()
+    return {"rows": len(pin_ix), "strings": [str(v) for v in strings],
+            "columns": {k: columns[k] for k in RESULT_COLUMNS if k in columns}}
+
+def json_response(obj):
+    """JSON response through orjson when it is installed (NaN encodes as null there), else jsonify."""
+    if orjson is None:
+        return jsonify(obj)
+    return Response(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), mimetype="application/json")
+
 @app.route('/api/recommend', methods=['POST'])
 def api_recommend():
     if 'user' not in session: return jsonify({"success": False, "error": "Unauthorized"}), 401
+    with metrics.request_stages("recommend") as stages:
+        try:
+            body, status = _recommend(stages)
+        except Exception:
+            metrics.REQUESTS.inc(1, "recommend", 500)
+            raise
+        metrics.REQUESTS.inc(1, "recommend", status)
+        return body, status
+
+def _recommend(stages):
     try:
         data = request.get_json(force=True)
         pincodes = data.get("pincodes", [])
         weights = data.get("weights", [])
         volweights = data.get("volumetric_weights", [])
         declared_value = float(data.get("declared_value", 0) or 0)
+        top_k = parse_top_k({**request.args, **data})
+        serviceable_only = str(data.get("serviceable_only", request.args.get("serviceable_only", ""))).lower() in ("1", "true", "yes")
+        fmt = str(request.args.get("format") or data.get("format") or "rows").lower()
+        if fmt not in ("rows", "columnar"):
+            raise ValueError(f"unknown format {fmt!r} (rows or columnar)")
     except Exception as e:
         log.exception("Bad payload to /api/recommend: %s", e)
         return jsonify({"success": False, "error": f"Invalid payload: {e}"}), 400
 
-    # Load couriers from DB
-    conn = db_connect(); cur = conn.cursor()
-    rows = cur.execute("""
-        SELECT name, file_path, rates, docket, fuel_pct, fuel_basis, insurance_pct, insurance_flat,
-               oda_type, oda_fixed, gst_pct, min_charge
-        FROM couriers
-    """).fetchall()
-    couriers = [dict(r) for r in rows]
-    conn.close()
-
+    # Compiled couriers (cached per courier version)
+    with stage("db_load"):
+        cur = db.connection().cursor()
+        version, couriers = courier_snapshot(cur)
     if not couriers:
         log.error("No couriers in DB; returning empty results")
         return jsonify({"success": True, "results": [], "message": "No couriers configured"}), 200
 
-    results = []
-    for idx, pin in enumerate(pincodes):
-        for c in couriers:
-            name = c["name"]
-            excel_path = c.get("file_path")
-
-            wt = float(weights[idx] if idx < len(weights) else (weights[-1] if weights else 0))
-            vol = float(volweights[idx] if idx < len(volweights) else 0)
-            eff_weight = max(wt, vol) if vol else wt
-
-            # Validate/preview rates JSON
-            raw_rates = c.get("rates")
-            try:
-                rates = json.loads(raw_rates or "{}")
-                log.debug("Rates for %s: %s", name, (raw_rates[:200] + ("..." if raw_rates and len(raw_rates)>200 else "")) if isinstance(raw_rates, str) else str(rates)[:200])
-            except Exception as e:
-                log.warning("Bad rates JSON for %s: %s; using {}", name, e)
-                rates = {}
-
-            # Default lookups
-            state = ""; location = ""; zone = ""; zone_rate = 0.0; oda_distance = 0.0; status = "OK"
-
-            # ---- Dynamic Excel fetch & normalization per courier
-            row = fetch_pincode_row_from_excel(excel_path, pin) if excel_path else None
-            if row:
-                state = row.get("state") or ""
-                location = row.get("location") or ""
-                zone = row.get("zone") or ""
-                status = (row.get("status") or "").upper()
-                if status in ("YES","Y"): status = "ODA"
-                oda_distance = float(row.get("oda_distance") or 0.0)
-                # zone rate from dict-style rates
-                if isinstance(rates, dict) and zone:
-                    try:
-                        zone_rate = float(rates.get(zone) or 0)
-                    except Exception:
-                        zone_rate = 0.0
-
-            # Compute base freight (zone rate or generic)
-            base = 0.0
-            if zone and zone_rate:
-                base = max(base, zone_rate * eff_weight)
-            else:
-                if isinstance(rates, dict) and "rate_per_kg" in rates:
-                    try:
-                        base = max(base, float(rates.get("rate_per_kg") or 0) * eff_weight)
-                    except Exception:
-                        base = base
-                elif isinstance(rates, list) and rates:
-                    rec0 = rates[0]
-                    if isinstance(rec0, dict):
-                        for key in ["rate","rate_per_kg","z_rate","price"]:
-                            if key in rec0:
-                                try:
-                                    base = max(base, float(rec0.get(key) or 0) * eff_weight)
-                                except Exception:
-                                    pass
-                                break
-
-            docket = float(c["docket"] or 0)
-            insurance = (declared_value * (float(c["insurance_pct"] or 0)/100.0)) + float(c["insurance_flat"] or 0)
-
-            # ODA charge
-            if c["oda_type"] == "Special" and status == "ODA":
-                oda = get_bluedart_oda_charge(oda_distance, eff_weight)
-            elif c["oda_type"] == "Fixed":
-                oda = float(c["oda_fixed"] or 0)
-            else:
-                oda = 0.0
+    eff_weights = effective_weights(len(pincodes), weights, volweights)
+    results, recent_rows = quote_pincodes(cur, couriers, pincodes, eff_weights, declared_value,
+                                          top_k=top_k, serviceable_only=serviceable_only,
+                                          version=version, use_cache=True, columnar=fmt == "columnar")
+    metrics.PINS.inc(len(pincodes), "recommend")
 
-            # ---- Min-charge fallback as SUBTOTAL baseline
-            min_charge = float(c["min_charge"] or 0)
-            subtotal_pre_fuel = max(base + docket + insurance + oda, min_charge)
+    # record recent (write-behind; the request never waits on SQLite)
+    with stage("recent_log"):
+        recent_writer.record(recent_rows)
+    with stage("serialize"):
+        if fmt == "columnar":
+            body = json_response({"success": True, "format": "columnar", **results})
+        else:
+            body = jsonify({"success": True, "results": results})
+    log.info("Recommend: %d pins x %d couriers -> %d results; %s", len(pincodes), len(couriers),
+             results["rows"] if fmt == "columnar" else len(results), stages.summary())
+    return body, 200
 
-            # Fuel basis
-            fuel_pct = float(c["fuel_pct"] or 0)
-            basis = (c.get("fuel_basis") or "freight").lower()
-            fuel_base = subtotal_pre_fuel if basis == "subtotal" else (base if base>0 else min_charge)
-            fuel = fuel_base * (fuel_pct/100.0)
+@app.route('/api/recommend/cache', methods=['GET'])
+def api_quote_cache_stats():
+    """Quote cache size and hit/miss counters for this worker process."""
+    if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
+    return jsonify({**quote_cache.stats(), "pid": os.getpid()})
 
-            subtotal_for_tax = subtotal_pre_fuel + fuel
-            gst = subtotal_for_tax * (float(c["gst_pct"] or 0)/100.0)
-            total = subtotal_for_tax + gst
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of this worker's counters and stage histograms."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
-            log.debug(("RECO pin=%s courier=%s weight=%.2f zone=%s zone_rate=%.2f base=%.2f docket=%.2f "
-                       "insurance=%.2f oda=%.2f min=%.2f basis=%s fuel=%.2f gst=%.2f total=%.2f"),
-                      pin, name, eff_weight, zone, zone_rate, base, docket, insurance, oda, min_charge, basis, fuel, gst, total)
+# ---------- Profiling ----------
+# ?profile=1 or X-Gamma-Profile: 1 runs an admin's request under profiling.RequestProfile;
+# the response's X-Gamma-Profile header names the saved report ("busy" when another
+# request in this worker was being profiled). Streamed bodies (bulk CSV) are only
+# profiled up to the headers.
+PROFILE_DIR = os.environ.get("GAMMA_PROFILE_DIR") or os.path.join(UPLOAD_DIR, ".profiles")
 
-            results.append({
-                "pincode": str(pin),
-                "weight": eff_weight,
-                "courier": name,
-                "status": status,
-                "zone": zone,
-                "zone_rate": zone_rate,
-                "oda_distance": oda_distance,
-                "state": state,
-                "location": location,
-                "freight": base if base>0 else min_charge,  # show min when used
-                "fuel": fuel,
-                "insurance": insurance,
-                "oda": oda,
-                "docket": docket,
-                "subtotal": subtotal_for_tax - gst,  # before GST (includes fuel)
-                "gst": gst,
-                "total": total
-            })
+def is_admin() -> bool:
+    return session.get('user') == DEFAULT_USER["username"]
 
-            # record recent
-            conn = db_connect(); cur = conn.cursor()
-            cur.execute("INSERT INTO recent_searches(checked_at, pincode, courier, weight, total) VALUES (?,?,?,?,?)",
-                        (now_iso(), str(pin), name, eff_weight, total))
-            conn.commit(); conn.close()
+def profile_requested() -> bool:
+    flag = request.args.get("profile") or request.headers.get("X-Gamma-Profile") or ""
+    return flag.strip().lower() in ("1", "true", "yes")
 
-    return jsonify({"success": True, "results": results})
+@app.before_request
+def start_request_profile():
+    if not profile_requested():
+        return None
+    if not is_admin():
+        return jsonify({"error": "Profiling is admin-only"}), 403
+    g.profile = RequestProfile.start(f"{request.method} {request.full_path.rstrip('?')}")
+    return None
 
-if __name__ == "__main__":
+@app.after_request
+def finish_request_profile(response):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        report = profile.stop(response.status_code)
+        try:
+            profile.save(PROFILE_DIR, report)
+            response.headers["X-Gamma-Profile"] = profile.id
+        except OSError as e:
+            log.error("Could not save profile %s: %s", profile.id, e)
+    elif profile_requested() and response.status_code != 403:
+        response.headers["X-Gamma-Profile"] = "busy"
+    return response
+
+@app.teardown_request
+def abandon_request_profile(exc):
+    profile = g.pop("profile", None)  # only left here when after_request did not run
+    if profile is not None:
+        profile.stop()
+
+@app.route('/api/profiles', methods=['GET'])
+def api_profiles():
+    """Saved request profiles, newest first (summary only)."""
+    if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
+    if not is_admin(): return jsonify({"error": "Forbidden"}), 403
+    rows = []
+    for profile_id in list_profiles(PROFILE_DIR):
+        try:
+            with open(os.path.join(PROFILE_DIR, profile_id + ".json")) as fh:
+                report = json.load(fh)
+        except (OSError, ValueError):
+            continue  # pruned by another worker meanwhile
+        rows.append({k: report.get(k) for k in ("id", "label", "status", "pid", "created_at", "wall_ms")}
+                    | {"peak_bytes": report["memory"]["peak_bytes"], "sql_ms": report["sql"]["total_ms"]})
+    return jsonify({"profiles": rows})
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def api_profile(profile_id):
+    """One saved report; ?format=pstats downloads the raw cProfile dump instead."""
+    if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
+    if not is_admin(): return jsonify({"error": "Forbidden"}), 403
+    pstats_file = request.args.get("format") == "pstats"
+    path = profile_path(PROFILE_DIR, profile_id, ".prof" if pstats_file else ".json")
+    if path is None:
+        return jsonify({"error": "Not found"}), 404
+    if pstats_file:
+        return send_file(path, as_attachment=True, download_name=profile_id + ".prof")
+    return send_file(path, mimetype="application/json")
+
+# ---------- Recent searches ----------
+@app.route('/api/recent', methods=['GET'])
+def api_recent():
+    """Newest quote log rows; pass `next_before` back as `before` for the next page."""
+    if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
+    try:
+        limit = max(1, min(int(request.args.get("limit") or 20), 500))
+        before = int(request.args["before"]) if request.args.get("before") else None
+    except ValueError:
+        return jsonify({"error": "limit and before must be integers"}), 400
+    rows, next_before = recent_page(db.connection(), limit, before=before,
+                                    pincode=(request.args.get("pincode") or "").strip(),
+                                    courier=(request.args.get("courier") or "").strip(),
+                                    since=request.args.get("since"), until=request.args.get("until"))
+    return jsonify({"rows": rows, "next_before": next_before})
+
+@app.route('/api/recent/daily', methods=['GET'])
+def api_recent_daily():
+    """Per-day, per-courier search counts and totals (kept after raw rows age out)."""
+    if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
+    since = request.args.get("since") or (datetime.date.today() - datetime.timedelta(days=365)).isoformat()
+    return jsonify(daily_history(db.connection(), since=since, until=request.args.get("until"),
+                                 courier=(request.args.get("courier") or "").strip()))
+
+@app.route('/api/recent/clear', methods=['POST'])
+def api_recent_clear():
+    """Delete the raw quote log; `?scope=all` also drops the daily aggregates."""
+    if 'user' not in session: return jsonify({"error":"Unauthorized"}), 401
+    recent_writer.flush()  # rows still queued would reappear after the delete
+    conn = db.connection()
+    deleted = conn.execute("DELETE FROM recent_searches").rowcount
+    if request.args.get("scope") == "all":
+        conn.execute("DELETE FROM recent_search_daily")
+    conn.commit()
+    log.info("Cleared %d recent searches%s", deleted, " and daily aggregates" if request.args.get("scope") == "all" else "")
+    return jsonify({"message": "History cleared.", "deleted": deleted})
+
+# ---------- Bulk manifest quoting ----------
+MANIFEST_ALIASES = {
+    "pincode": ("pincode", "pin", "pin code", "postal", "zip"),
+    "weight": ("weight", "wt", "actual weight", "weight_kg", "weight (kg)"),
+    "volumetric_weight": ("volumetric_weight", "volumetric weight", "vol_weight", "volweight", "vol", "volumetric"),
+}
+BULK_CHUNK_ROWS = 2000
+BULK_ERROR_PINCODE = "#ERROR"  # pincode of the trailing CSV row when a stream fails part way
+
+def _manifest_columns(header) -> dict:
+    """Map manifest header positions to pincode/weight/volumetric_weight."""
+    names = [str(h).strip().lower() if h is not None else "" for h in header]
+    cols = {}
+    for field, aliases in MANIFEST_ALIASES.items():
+        for alias in aliases:
+            if alias in names:
+                cols[field] = names.index(alias)
+                break
+    return cols
+
+def _manifest_value(row, pos):
+    if pos is None or pos >= len(row):
+        return None
+    v = row[pos]
+    if v is None or (isinstance(v, float) and v != v):
+        return None
+    return v
+
+def _manifest_pin(v) -> str:
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    return str(v).strip()
+
+def iter_manifest_chunks(file, fname: str, chunk_rows: int):
+    """Yield (pincodes, weights, volumetric_weights) lists of at most chunk_rows manifest lines."""
+    if fname.lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook
+        wb = load_workbook(file, read_only=True, data_only=True)
+        rows = wb.active.iter_rows(values_only=True)
+    elif fname.lower().endswith(".csv"):
+        rows = csv.reader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+    else:
+        raise ValueError("Manifest must be .csv or .xlsx")
+    cols = _manifest_columns(next(rows, []))
+    if "pincode" not in cols:
+        raise ValueError("Manifest needs a pincode column")
+    pins, wts, vols = [], [], []
+    for row in rows:
+        pin = _manifest_value(row, cols["pincode"])
+        if pin is None or str(pin).strip() == "":
+            continue
+        pins.append(_manifest_pin(pin))
+        wts.append(float(_manifest_value(row, cols.get("weight")) or 0))
+        vols.append(float(_manifest_value(row, cols.get("volumetric_weight")) or 0))
+        if len(pins) >= chunk_rows:
+            yield pins, wts, vols
+            pins, wts, vols = [], [], []
+    if pins:
+        yield pins, wts, vols
+
+@app.route('/api/recommend/bulk', methods=['POST'])
+def api_recommend_bulk():
+    """
+    Quote an uploaded manifest (.csv/.xlsx with pincode, weight and optional volumetric_weight
+    columns) and stream the results back as CSV (default) or NDJSON (format=ndjson). The manifest
+    is read and priced chunk_rows lines at a time, so memory stays bounded; NDJSON interleaves a
+    {"progress": ...} line after each chunk. mode=best / top_k / serviceable_only work as for
+    /api/recommend. A failure after the response has started ends the stream with an error
+    record: {"error": ..., "lines": n} in NDJSON, a row with pincode BULK_ERROR_PINCODE and the
+    message in `reason` in CSV, so a truncated download is never mistaken for a complete one.
+    """
+    if 'user' not in session: return jsonify({"success": False, "error": "Unauthorized"}), 401
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({"success": False, "error": "Missing manifest file"}), 400
+    fmt = (request.values.get("format") or "csv").strip().lower()
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"success": False, "error": f"Unsupported format {fmt}"}), 400
+    # the upload is closed with the request context, so the stream reads from a private copy
+    spool = tempfile.TemporaryFile()
+    shutil.copyfileobj(file.stream, spool)
+    spool.seek(0)
+    try:
+        declared_value = float(request.values.get("declared_value") or 0)
+        # with the quote pool on, default chunks are big enough to be sharded across it
+        default_rows = max(BULK_CHUNK_ROWS, quote_pool.threshold) if quote_pool.enabled else BULK_CHUNK_ROWS
+        chunk_rows = max(1, int(request.values.get("chunk_rows") or default_rows))
+        top_k = parse_top_k(request.values)
+        serviceable_only = (request.values.get("serviceable_only") or "").lower() in ("1", "true", "yes")
+        chunks = iter_manifest_chunks(spool, file.filename, chunk_rows)
+        first = next(chunks, None)
+    except Exception as e:
+        spool.close()
+        log.exception("Bad manifest for /api/recommend/bulk: %s", e)
+        return jsonify({"success": False, "error": f"Invalid manifest: {e}"}), 400
+
+    def generate():
+        done = 0
+        if fmt == "csv":
+            buf = io.StringIO(); writer = csv.DictWriter(buf, fieldnames=RESULT_COLUMNS, extrasaction="ignore")
+            writer.writeheader(); yield buf.getvalue()
+        if first is None:
+            spool.close()
+            return
+        try:
+            for n, (pincodes, weights, volweights) in enumerate(itertools.chain([first], chunks), start=1):
+                with metrics.request_stages("bulk_chunk"):
+                    with stage("db_load"):
+                        cur = db.connection().cursor()
+                        version, couriers = courier_snapshot(cur)
+                    eff_weights = effective_weights(len(pincodes), weights, volweights)
+                    results, recent_rows = quote_pincodes(cur, couriers, pincodes, eff_weights, declared_value,
+                                                          top_k=top_k, serviceable_only=serviceable_only, version=version)
+                    with stage("recent_log"):
+                        recent_writer.record(recent_rows)
+                metrics.PINS.inc(len(pincodes), "bulk")
+                done += len(pincodes)
+                log.info("Bulk quote chunk %d: %d lines (%d total), %d results", n, len(pincodes), done, len(results))
+                if fmt == "csv":
+                    buf = io.StringIO(); writer = csv.DictWriter(buf, fieldnames=RESULT_COLUMNS, extrasaction="ignore")
+                    writer.writerows(results)
+                    yield buf.getvalue()
+                else:
+                    yield "".join(json.dumps(r) + "\n" for r in results)
+                    yield json.dumps({"progress": {"chunk": n, "lines": done}}) + "\n"
+        except Exception as e:
+            # headers are already sent; report in-band and stop
+            log.exception("Bulk quote failed after %d lines: %s", done, e)
+            if fmt == "ndjson":
+                yield json.dumps({"error": str(e), "lines": done}) + "\n"
+            else:
+                buf = io.StringIO(); writer = csv.DictWriter(buf, fieldnames=RESULT_COLUMNS, extrasaction="ignore")
+                writer.writerow({"pincode": BULK_ERROR_PINCODE, "reason": f"Bulk quote failed after {done} lines: {e}"})
+                yield buf.getvalue()
+        finally:
+            spool.close()
+
+    if fmt == "csv":
+        return Response(stream_with_context(generate()), mimetype="text/csv",
+                        headers={"Content-Disposition": "attachment; filename=quotes.csv"})
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+# ---------- Startup ----------
+# Run once per deployment before serving: under gunicorn from the master after the app is
+# preloaded (gunicorn.conf.py), so the migration runs exactly once and every forked worker
+# starts with pandas, the compiled couriers and their pricing engines already in
+# (copy-on-write shared) memory instead of building them on its first request. Pincode
+# stores are only mapped for couriers not yet ingested into courier_pincodes, the one
+# path that reads them.
+WARM_PIN = "000000"  # never served: warms the not-found path
+
+def warm_caches() -> int:
+    """Compile couriers and price a served and an unserved pin through every engine."""
+    cur = db.connection().cursor()
+    version, couriers = courier_snapshot(cur)
+    pins = [WARM_PIN]
+    served = cur.execute("SELECT pincode FROM courier_pincodes LIMIT 1").fetchone()
+    if served:
+        pins.append(served["pincode"])
+    for cfg in couriers:
+        # ingested couriers are served from courier_pincodes; only the sheet fallback reads a store
+        if cfg.pincode_rows is None and cfg.file_path and os.path.exists(cfg.file_path):
+            store = get_pincode_index(cfg.file_path)
+            if len(pins) == 1 and len(store.pins):
+                pins.append(str(store.pins[0]))
+    if couriers:
+        # engine imports, ODA tables and the first-call paths of the pandas joins
+        quote_pincodes(cur, couriers, pins, [1.0] * len(pins), 0)
+    return len(couriers)
+
+def startup():
+    t = time.perf_counter()
     db_init_migrate_and_report()
+    n = warm_caches()
+    db.close()  # no SQLite connection may cross a fork; workers open their own
+    log.info("Startup done in %.2fs (pid %d): %d couriers warm", time.perf_counter() - t, os.getpid(), n)
+
+if __name__ == "__main__":
+    startup()
     log.info("Gamma Courier Suite v4 (SQLite + Fuel Basis + Excel Pincode Fetch) http://localhost:5050")
     app.run(host="0.0.0.0", port=5050, debug=True)
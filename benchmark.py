@@ -0,0 +1,261 @@
+"""
+Benchmark harness for the recommend and ingestion hot paths.
+
+    python benchmark.py                          # 10k, 100k and 1M row sheets
+    python benchmark.py --sizes 10k,100k --out before.json
+    python benchmark.py --sizes 10k,100k --out after.json --compare before.json
+
+Synthetic serviceability sheets are generated from uploads/Bluedart.xlsx: its rows are
+resampled (keeping Location/State/Zone/Status/ODA distance together) and given fresh
+unique pincodes, so every size has the sample's column layout and value mix. Sheets are
+written once per (size, seed, format) into the work directory and reused by later runs.
+
+Every (size, scenario) case runs in its own Python process against a scratch database
+and upload directory (GAMMA_DB_PATH / GAMMA_UPLOAD_DIR), so the real couriers.db is never
+touched and the reported peak RSS belongs to that case alone. Scenarios:
+
+  upload     POST /api/couriers/add and /api/couriers/update/<name> with the sheet, until the
+             upload job is done
+  normalize  ingest.normalize_columns on the raw sheet frame
+  fetch      fetch_pincode_row_from_excel: first (index-building) call, then warm lookups
+  recommend  POST /api/recommend with batches of random pins against three couriers
+
+Results (p50/p95/mean latency in ms, throughput, peak RSS) go to one JSON file together
+with the git commit and library versions, so two runs can be compared with --compare.
+"""
+import argparse, datetime, json, logging, os, platform, random, resource, shutil, subprocess, sys, tempfile, time
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_SHEET = os.path.join(APP_DIR, "uploads", "Bluedart.xlsx")
+SCENARIOS = ("upload", "normalize", "fetch", "recommend")
+DEFAULT_SIZES = "10k,100k,1M"
+
+# ---------- Synthetic sheets ----------
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * mult)
+
+def synthetic_sheet(workdir: str, rows: int, seed: int, fmt: str) -> str:
+    """Path of a rows-long sheet modeled on the sample (plus a .pins.npy of its pincodes); generated on first use."""
+    path = os.path.join(workdir, f"synthetic_{rows}_{seed}.{fmt}")
+    if os.path.exists(path) and os.path.exists(pins_path(path)):
+        return path
+    sample = pd.read_excel(SAMPLE_SHEET)
+    rng = np.random.default_rng(seed)
+    df = sample.sample(n=rows, replace=True, random_state=seed).reset_index(drop=True)
+    df["Pincode"] = np.sort(rng.choice(np.arange(100000, 100000 + max(2 * rows, 900000)), rows, replace=False))
+    tmp = path + ".tmp." + fmt
+    if fmt == "csv":
+        df.to_csv(tmp, index=False)
+    else:
+        df.to_excel(tmp, index=False, engine="openpyxl")
+    os.replace(tmp, path)
+    np.save(pins_path(path), df["Pincode"].to_numpy())
+    return path
+
+def pins_path(sheet: str) -> str:
+    return os.path.splitext(sheet)[0] + ".pins.npy"
+
+# ---------- Measurement ----------
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB elsewhere
+
+def summarize(samples, items_per_sample: int = 1, unit: str = "calls") -> dict:
+    ms = np.asarray(samples, dtype=float) * 1000.0
+    return {
+        "count": len(ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "min_ms": round(float(ms.min()), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "throughput": round(items_per_sample * len(ms) / (ms.sum() / 1000.0), 2) if ms.sum() else None,
+        "throughput_unit": f"{unit}/s",
+    }
+
+def timed(fn):
+    t = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - t, out
+
+# ---------- Cases (run in a child process) ----------
+def _load_app(workdir: str):
+    scratch = tempfile.mkdtemp(prefix="case_", dir=workdir)
+    os.environ["GAMMA_DB_PATH"] = os.path.join(scratch, "couriers.db")
+    os.environ["GAMMA_UPLOAD_DIR"] = os.path.join(scratch, "uploads")
+    sys.path.insert(0, APP_DIR)
+    import app
+    logging.getLogger().setLevel(logging.WARNING)  # per-quote debug lines would dominate the timings
+    app.db_init_migrate_and_report()
+    client = app.app.test_client()
+    client.post("/", data={"username": app.DEFAULT_USER["username"], "password": app.DEFAULT_USER["password"]})
+    return app, client
+
+def _upload(client, sheet: str, name: str, endpoint: str = "/api/couriers/add", **fields):
+    with open(sheet, "rb") as fh:
+        data = {"name": name, **{k: str(v) for k, v in fields.items()},
+                "file": (fh, os.path.basename(sheet))}
+        r = client.post(endpoint, data=data, content_type="multipart/form-data")
+    if r.status_code not in (200, 202):
+        raise RuntimeError(f"{endpoint} failed: {r.status_code} {r.data[:200]!r}")
+    if r.status_code == 202:  # timed until the background upload job has gone live
+        url = r.get_json()["status_url"]
+        while (job := client.get(url).get_json())["status"] not in ("done", "failed"):
+            time.sleep(0.01)
+        if job["status"] == "failed":
+            raise RuntimeError(f"{endpoint} job failed: {job['error']}")
+
+COURIERS = (
+    ("Bluedart", {"docket": 100, "fuel_pct": 22, "fuel_basis": "subtotal", "oda_type": "Special",
+                  "gst_pct": 18, "min_charge": 800}, {"North": 10, "South": 12, "East": 14, "West": 9}),
+    ("FlatCo", {"docket": 50, "fuel_pct": 10, "oda_type": "Fixed", "oda_fixed": 75, "gst_pct": 18,
+                "min_charge": 300, "insurance_pct": 1, "insurance_flat": 20}, {"rate_per_kg": 30}),
+    ("ZoneCo", {"docket": 30, "fuel_pct": 15, "oda_type": "None", "gst_pct": 12, "min_charge": 150},
+     {"North": 8, "South": 9, "East": 11, "West": 7, "North East": 16, "Central": 8}),
+)
+
+def case_upload(client, app, sheet, pins, args) -> dict:
+    adds, updates = [], []
+    for i in range(args.repeat):
+        adds.append(timed(lambda: _upload(client, sheet, f"Bench{i}"))[0])
+        updates.append(timed(lambda: _upload(client, sheet, f"Bench{i}", endpoint=f"/api/couriers/update/Bench{i}"))[0])
+    return {"add": summarize(adds, unit="uploads"), "update": summarize(updates, unit="uploads")}
+
+def case_normalize(client, app, sheet, pins, args) -> dict:
+    from ingest import normalize_columns, read_rate_sheet
+    raw = read_rate_sheet(sheet)
+    samples = [timed(lambda: normalize_columns(raw.copy()))[0] for _ in range(args.repeat)]
+    return {"normalize_columns": summarize(samples, items_per_sample=len(raw), unit="rows")}
+
+def case_fetch(client, app, sheet, pins, args) -> dict:
+    # a fresh copy, so the first call parses the sheet instead of reading a columnar cache from an earlier run
+    sheet = shutil.copy(sheet, app.UPLOAD_DIR)
+    cold, _ = timed(lambda: app.fetch_pincode_row_from_excel(sheet, pins[0]))
+    rng = random.Random(args.seed)
+    lookups = [rng.choice(pins) for _ in range(args.lookups)]
+    warm = [timed(lambda: app.fetch_pincode_row_from_excel(sheet, p))[0] for p in lookups]
+    return {"cold_index_build_ms": round(cold * 1000.0, 3),
+            "fetch_pincode_row_from_excel": summarize(warm, unit="lookups")}
+
+def case_recommend(client, app, sheet, pins, args) -> dict:
+    for name, fields, rates in COURIERS:
+        _upload(client, sheet, name, **fields)
+        client.post(f"/api/couriers/update/{name}", data={"rates": json.dumps(rates)})
+    rng = random.Random(args.seed)
+    weights = (0.5, 3, 12, 40, 150, 300, 700, 1200)
+    samples = []
+    for _ in range(args.requests):
+        batch = [rng.choice(pins) for _ in range(args.batch - 1)] + ["000000"]  # one unserviceable pin
+        payload = {"pincodes": batch, "weights": [rng.choice(weights) for _ in batch], "declared_value": 5000}
+        elapsed, r = timed(lambda: client.post("/api/recommend", json=payload))
+        if r.status_code != 200:
+            raise RuntimeError(f"/api/recommend failed: {r.status_code} {r.data[:200]!r}")
+        samples.append(elapsed)
+    app.recent_writer.flush()
+    return {"batch_pins": args.batch, "couriers": len(COURIERS),
+            "api_recommend": summarize(samples, items_per_sample=args.batch, unit="pins")}
+
+CASES = {"upload": case_upload, "normalize": case_normalize, "fetch": case_fetch, "recommend": case_recommend}
+
+def run_case(args) -> dict:
+    sheet = synthetic_sheet(args.workdir, args.case_rows, args.seed, args.format)
+    app, client = _load_app(args.workdir)
+    pins = [str(p) for p in np.load(pins_path(sheet)).tolist()]
+    result = CASES[args.case](client, app, sheet, pins, args)
+    return {"scenario": args.case, "rows": args.case_rows, **result, "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+# ---------- Driver ----------
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return ""
+
+def metadata(args) -> dict:
+    return {
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(), "label": args.label,
+        "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+        "pandas": pd.__version__, "numpy": np.__version__,
+        "args": {k: getattr(args, k) for k in ("sizes", "scenarios", "seed", "format", "repeat", "requests",
+                                                "batch", "lookups", "quote_cache")},
+    }
+
+def _latencies(result: dict):
+    """(name, stats) for every latency summary in a case result."""
+    for k, v in result.items():
+        if isinstance(v, dict) and "p50_ms" in v:
+            yield k, v
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path) as fh:
+        base = {(r["scenario"], r["rows"]): r for r in json.load(fh)["results"]}
+    print(f"\n{'scenario':<10} {'rows':>8} {'metric':<30} {'p50 before':>11} {'p50 after':>10} {'change':>8}")
+    for r in results:
+        old = base.get((r["scenario"], r["rows"]))
+        if not old:
+            continue
+        for name, stats in _latencies(r):
+            if name in old:
+                before, after = old[name]["p50_ms"], stats["p50_ms"]
+                change = f"{(after - before) / before * 100:+.1f}%" if before else "-"
+                print(f"{r['scenario']:<10} {r['rows']:>8} {name:<30} {before:>11.2f} {after:>10.2f} {change:>8}")
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0], formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated sheet sizes (default %(default)s)")
+    p.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    p.add_argument("--format", choices=("xlsx", "csv"), default="xlsx", help="synthetic sheet format")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--repeat", type=int, default=3, help="uploads / normalize runs per size")
+    p.add_argument("--requests", type=int, default=50, help="/api/recommend calls per size")
+    p.add_argument("--batch", type=int, default=50, help="pins per /api/recommend call")
+    p.add_argument("--lookups", type=int, default=2000, help="warm fetch_pincode_row_from_excel lookups")
+    p.add_argument("--quote-cache", action="store_true", help="leave the quote cache on (off by default so repeats price)")
+    p.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "gamma_bench"))
+    p.add_argument("--out", default="bench_results.json")
+    p.add_argument("--compare", metavar="BASELINE_JSON", help="print p50 changes against an earlier results file")
+    p.add_argument("--label", default="")
+    p.add_argument("--case", choices=SCENARIOS, help=argparse.SUPPRESS)
+    p.add_argument("--case-rows", type=int, help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    if args.case:
+        print(json.dumps(run_case(args)))
+        return
+
+    env = dict(os.environ)
+    if not args.quote_cache:
+        env["QUOTE_CACHE_SIZE"] = "0"
+    results = []
+    for rows in (parse_size(s) for s in args.sizes.split(",") if s.strip()):
+        synthetic_sheet(args.workdir, rows, args.seed, args.format)
+        for scenario in (s.strip() for s in args.scenarios.split(",") if s.strip()):
+            cmd = [sys.executable, os.path.abspath(__file__), *(argv if argv is not None else sys.argv[1:]),
+                   "--case", scenario, "--case-rows", str(rows)]
+            t = time.perf_counter()
+            proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+            if proc.returncode != 0:
+                sys.stderr.write(proc.stderr)
+                raise SystemExit(f"{scenario} @ {rows} rows failed")
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            results.append(result)
+            headline = ", ".join(f"{k} p50={v['p50_ms']:.2f}ms p95={v['p95_ms']:.2f}ms" for k, v in _latencies(result))
+            print(f"{scenario:<10} {rows:>8} rows  {headline}  peak_rss={result['peak_rss_mb']}MB  "
+                  f"({time.perf_counter() - t:.1f}s)")
+
+    with open(args.out, "w") as fh:
+        json.dump({"meta": metadata(args), "results": results}, fh, indent=1)
+    print(f"Results written to {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+SQLite access layer.
+
+Every connection is opened through `connect()`, which puts the database in WAL mode
+(readers no longer block the recent_searches writer and vice versa), relaxes fsyncs to
+synchronous=NORMAL, memory-maps the file and keeps a larger prepared-statement cache.
+
+`Database` hands each worker thread one long-lived connection instead of opening a
+fresh one per call. Request handlers use `db.connection()`; the app's teardown hook
+calls `db.release()`, which rolls back anything a failed request left uncommitted so
+the next request on that thread starts clean. Connections are tied to the process
+that opened them, so a gunicorn worker forked from a preloaded master opens its own.
+
+Inside `traced_statements(record)` every statement the thread runs on a `connect()`
+connection is reported as record(sql, seconds, executions); fetches are charged to the
+cursor's last statement with executions=0. Outside such a block the traced cursors add
+about 2us per statement.
+"""
+import logging, os, sqlite3, threading, time
+from contextlib import contextmanager
+
+log = logging.getLogger("gamma")
+
+BUSY_TIMEOUT = 30.0
+CACHED_STATEMENTS = 256
+MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+
+_trace = threading.local()
+
+@contextmanager
+def traced_statements(record):
+    """Report this thread's statements to record(sql, seconds, executions) inside the block."""
+    previous = getattr(_trace, "record", None)
+    _trace.record = record
+    try:
+        yield
+    finally:
+        _trace.record = previous
+
+class TracedCursor(sqlite3.Cursor):
+    def _timed(self, sql, executions, call, *args):
+        record = getattr(_trace, "record", None)
+        if record is None:
+            return call(*args)
+        t = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            record(sql, time.perf_counter() - t, executions)
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        return self._timed(sql, 1, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        return self._timed(sql, 1, super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, script):
+        self._sql = script
+        return self._timed(script, 1, super().executescript, script)
+
+    def fetchone(self):
+        return self._timed(getattr(self, "_sql", ""), 0, super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed(getattr(self, "_sql", ""), 0, super().fetchmany, *(() if size is None else (size,)))
+
+    def fetchall(self):
+        return self._timed(getattr(self, "_sql", ""), 0, super().fetchall)
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose cursors (including the execute shortcuts) report to traced_statements."""
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open a connection with row access by name and the WAL/performance pragmas applied."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS, factory=TracedConnection)
+    conn.row_factory = sqlite3.Row
+    mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    if mode.lower() != "wal":
+        log.warning("SQLite %s stayed in %s journal mode", path, mode)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE:d}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+class Database:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = connect(self.path)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def release(self):
+        """End-of-request hook: roll back an uncommitted transaction, keep the connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid() and conn.in_transaction:
+            log.warning("Rolling back uncommitted transaction left by request")
+            conn.rollback()
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
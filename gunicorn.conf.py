@@ -0,0 +1,24 @@
+"""
+gunicorn settings, picked up from the working directory: `gunicorn app:app`.
+
+The app is preloaded in the master and `app.startup()` runs there once (migration, then
+warm caches) before any worker is forked. Workers inherit the imported modules and warm
+caches copy-on-write, so they start in milliseconds and serve their first request at
+steady-state latency. The trade-off is that code changes need a full restart
+(`kill -HUP` re-forks workers from the same preloaded master).
+"""
+import os
+
+bind = os.environ.get("GAMMA_BIND", "0.0.0.0:5050")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+preload_app = True
+
+def when_ready(server):
+    # the master has imported app (preload_app) and is about to fork the workers
+    import app
+    app.startup()
+
+def post_fork(server, worker):
+    # a worker killed mid-upload (OOM, timeout) leaves its jobs open; its replacement closes them
+    import app
+    app.reap_upload_jobs()
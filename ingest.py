@@ -0,0 +1,188 @@
+"""
+Rate-sheet ingestion.
+
+An uploaded Excel/CSV is parsed once (with the calamine reader when python-calamine is
+installed, openpyxl otherwise), normalized with `normalize_columns`, and its serviceability
+columns are written to a memory-mappable PincodeStore next to the upload
+(uploads/.cache/<file>.pins: int32 pincodes, dictionary-encoded zone/state/location/status
+and float32 oda_distance, see pin_store.py). Later loads of the same file map the store
+instead of re-parsing the workbook; it is rebuilt whenever the source file's mtime/size
+changes.
+"""
+import logging, os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from pin_store import PincodeStore
+
+log = logging.getLogger("gamma")
+
+try:
+    import python_calamine  # noqa: F401  (optional; several times faster than openpyxl)
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
+PINCODE_COLUMNS = ("zone", "state", "location", "status", "oda_distance")
+CACHE_DIRNAME = ".cache"
+CACHE_FORMAT = 2
+
+IngestedSheet = namedtuple("IngestedSheet", "records_json pincodes")
+
+# header aliases, applied in order; an alias is skipped when its target column already exists
+COLUMN_ALIASES = {
+    "pin": "pincode", "pin code": "pincode", "postal": "pincode", "zip": "pincode",
+    "zone name": "zone", "zonename": "zone",
+    "statename": "state",
+    "loc": "location", "city": "location", "area": "location",
+    "distance": "oda_distance", "dist": "oda_distance", "distance_km": "oda_distance", "oda_km": "oda_distance",
+    "oda": "status"  # sometimes sheet has a column 'oda' with 'yes/no' - map to status
+}
+STATUS_ALIASES = {"YES": "ODA", "Y": "ODA"}
+
+def _header_names(columns) -> list:
+    names = [str(c).strip().lower() for c in columns]
+    present, renames = set(names), {}
+    for old, new in COLUMN_ALIASES.items():
+        if old in present and new not in present:
+            renames[old] = new
+            present.discard(old); present.add(new)
+    return [renames.get(n, n) for n in names]
+
+def _pincode_text(col: pd.Series) -> pd.Series:
+    """Pincodes as text, without the '.0' a float column would print."""
+    if pd.api.types.is_integer_dtype(col.dtype):
+        return col.astype(str)
+    def slow(s):
+        return s.astype(str).str.replace(r"\.0$", "", regex=True).str.strip()
+    if not pd.api.types.is_float_dtype(col.dtype):
+        return slow(col)
+    # whole non-zero floats below 1e16 print as '<int>.0', so their int text is the same result
+    v = col.to_numpy(dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        whole = np.isfinite(v) & (np.abs(v) < 1e16) & (v != 0) & (np.floor(v) == v)
+    if whole.all():
+        return pd.Series(v.astype(np.int64), index=col.index).astype(str)
+    out = slow(col)
+    out[whole] = v[whole].astype(np.int64).astype(str)
+    return out
+
+def _status_text(col: pd.Series) -> pd.Series:
+    """Upper-cased, stripped status with YES/Y read as ODA; computed once per distinct value."""
+    codes, uniques = pd.factorize(col, use_na_sentinel=False)
+    canon = pd.Series(uniques).astype(str).str.upper().str.strip().replace(STATUS_ALIASES)
+    return pd.Series(canon.array.take(codes), index=col.index)
+
+def _to_float(x) -> float:
+    try:
+        return float(str(x).strip())
+    except (TypeError, ValueError):
+        return 0.0
+
+def _distance_values(col: pd.Series) -> pd.Series:
+    """oda_distance as float; text that does not parse (blanks, '-', None) becomes 0.0."""
+    if pd.api.types.is_bool_dtype(col.dtype):
+        return pd.Series(0.0, index=col.index)  # float("True") does not parse either
+    if pd.api.types.is_numeric_dtype(col.dtype):
+        return col.astype(np.float64)
+    values = pd.to_numeric(col, errors="coerce").to_numpy(dtype=np.float64, copy=True)
+    redo = np.isnan(values)  # unparsable text and missing cells: only NaN itself stays NaN
+    if redo.any():
+        values[redo] = [_to_float(x) for x in col.to_numpy(dtype=object)[redo]]
+    return pd.Series(values, index=col.index)
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Normalize common column header variations to standard names."""
+    if df is None or df.empty:
+        return df
+    # lower-case headers, then aliases
+    df = df.set_axis(_header_names(df.columns), axis=1)
+    # ensure expected columns exist
+    for need in ["pincode","zone","state","location","status"]:
+        if need not in df.columns:
+            df[need] = None
+    if "oda_distance" not in df.columns:
+        df["oda_distance"] = 0.0  # what a column of missing cells normalizes to
+    # normalize content
+    df["pincode"] = _pincode_text(df["pincode"])
+    df["status"] = _status_text(df["status"])
+    df["oda_distance"] = _distance_values(df["oda_distance"])
+    return df
+
+def read_rate_sheet(excel_path: str):
+    """Read an Excel/CSV rate sheet into a DataFrame (None for unsupported extensions)."""
+    if excel_path.lower().endswith((".xlsx",".xls")):
+        return pd.read_excel(excel_path, engine=EXCEL_ENGINE)
+    if excel_path.lower().endswith(".csv"):
+        return pd.read_csv(excel_path)
+    log.warning("Unsupported file extension for %s", excel_path)
+    return None
+
+def pincode_frame(df: pd.DataFrame):
+    """pincode + PINCODE_COLUMNS of a normalized sheet, first row per pincode; None if it lists no pincodes."""
+    if df is None or df.empty:
+        return None
+    frame = df[["pincode", *PINCODE_COLUMNS]].drop_duplicates(subset="pincode", keep="first")
+    frame = frame[~frame["pincode"].isin(["None", "nan", ""])].reset_index(drop=True)
+    return frame if not frame.empty else None
+
+# ---------- Pincode store cache ----------
+def cache_path(path: str) -> str:
+    return os.path.join(os.path.dirname(path), CACHE_DIRNAME, os.path.basename(path) + ".pins")
+
+def _stamp(path: str) -> list:
+    st = os.stat(path)
+    return [CACHE_FORMAT, st.st_mtime_ns, st.st_size]
+
+def write_pincode_cache(path: str, frame: pd.DataFrame) -> PincodeStore:
+    target = cache_path(path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    store = PincodeStore.from_frame(frame, stamp=_stamp(path))
+    store.write(target)
+    return store
+
+def open_pincode_store(path: str):
+    """Memory-mapped store for a sheet, or None when missing, stale or unreadable."""
+    target = cache_path(path)
+    if not os.path.exists(target):
+        return None
+    try:
+        store = PincodeStore.open(target)
+    except Exception as e:
+        log.warning("Ignoring unreadable pincode store %s: %s", target, e)
+        return None
+    return store if list(store.stamp) == _stamp(path) else None
+
+def load_pincode_store(path: str) -> PincodeStore:
+    """The sheet's pincode store: mapped from the cache when fresh, else parsed, written and mapped."""
+    store = open_pincode_store(path)
+    if store is None:
+        ingest_rate_file(path)
+        store = open_pincode_store(path) or PincodeStore.from_frame(None)
+    return store
+
+def load_pincode_frame(path: str):
+    """Normalized pincode frame for a sheet (from the store when fresh); None if it lists no pincodes."""
+    store = open_pincode_store(path)
+    if store is not None:
+        return store.to_frame() if len(store) else None
+    return ingest_rate_file(path).pincodes
+
+def ingest_rate_file(path: str, progress=None) -> IngestedSheet:
+    """
+    Parse a rate sheet once: records JSON for couriers.rates plus the (cached) pincode frame.
+    `progress(stage)` is told when normalizing and indexing start (upload jobs report it).
+    """
+    progress = progress or (lambda stage: None)
+    df = read_rate_sheet(path)
+    if df is None:
+        return IngestedSheet(None, None)
+    progress("normalizing")
+    records_json = df.to_json(orient="records")
+    frame = pincode_frame(normalize_columns(df))
+    progress("indexing")
+    write_pincode_cache(path, frame)  # an empty store too, so sheets without pincodes are not re-parsed
+    log.info("Ingested %s: %d rows, %d pincodes", os.path.basename(path), len(df), 0 if frame is None else len(frame))
+    return IngestedSheet(records_json, frame)
@@ -0,0 +1,162 @@
+"""
+In-process counters and histograms rendered in the Prometheus text format.
+
+A request opens a `StageTimer` with `request_stages()`; code anywhere below it (including
+helpers that know nothing about the request) wraps work in `with stage("pricing"):` and
+the elapsed time is added to that request's stage total. When the request finishes each
+stage total is observed once into STAGE_SECONDS. Outside a request `stage()` is a no-op.
+
+Metrics are per process: under gunicorn each worker keeps and serves its own values
+(the `pid` label on gamma_process_info tells scrapes apart).
+"""
+import os, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join('%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"')) for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, v in items:
+            yield self.name, _labels(self.label_names, labels), v
+
+class Gauge:
+    """Value read from a callback at scrape time: fn() -> number or {label tuple: number}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn, labels=()):
+        self.name, self.help, self.label_names, self.fn = name, help, tuple(labels), fn
+
+    def samples(self):
+        value = self.fn()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, v in items:
+            yield self.name, _labels(self.label_names, labels), v
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(s)) for labels, s in self._series.items()]
+        names = self.label_names + ("le",)
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket", _labels(names, (*labels, bound if bound == "+Inf" else repr(bound))), cumulative
+            yield f"{self.name}_count", _labels(self.label_names, labels), cumulative
+            yield f"{self.name}_sum", _labels(self.label_names, labels), series[-1]
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, fn, labels=()):
+        return self.register(Gauge(name, help, fn, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{labels} {float(value):.6g}" if isinstance(value, float) else f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+REGISTRY.gauge("gamma_process_info", "Worker process serving this scrape.", lambda: {(os.getpid(),): 1}, labels=("pid",))
+REQUESTS = REGISTRY.counter("gamma_requests_total", "Quote requests by endpoint and HTTP status.", ("endpoint", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("gamma_request_seconds", "Quote request wall time.", ("endpoint",))
+STAGE_SECONDS = REGISTRY.histogram("gamma_stage_seconds", "Time per request spent in each quoting stage.", ("endpoint", "stage"))
+PINS = REGISTRY.counter("gamma_pins_total", "Pincodes quoted, by endpoint.", ("endpoint",))
+
+# ---------- Stage timing ----------
+_active = threading.local()
+
+class StageTimer:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.totals = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + (time.perf_counter() - t)
+
+    def observe(self):
+        for name, seconds in self.totals.items():
+            STAGE_SECONDS.observe(seconds, self.endpoint, name)
+
+    def summary(self) -> str:
+        return " ".join(f"{k}={v * 1000:.1f}ms" for k, v in self.totals.items())
+
+@contextmanager
+def request_stages(endpoint: str):
+    """Make a StageTimer current for this thread; its stage totals are recorded when the block exits."""
+    timer, previous = StageTimer(endpoint), getattr(_active, "timer", None)
+    _active.timer = timer
+    try:
+        yield timer
+    finally:
+        _active.timer = previous
+        timer.observe()
+        REQUEST_SECONDS.observe(time.perf_counter() - timer.started, endpoint)
+
+@contextmanager
+def stage(name: str):
+    """Charge the block to the current request's `name` stage (no-op outside request_stages)."""
+    timer = getattr(_active, "timer", None)
+    if timer is None:
+        yield
+    else:
+        with timer.stage(name):
+            yield
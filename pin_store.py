@@ -0,0 +1,193 @@
+"""
+Compact, memory-mapped pincode serviceability store.
+
+A normalized sheet (the pincode + zone/state/location/status/oda_distance frame produced
+from `normalize_columns`) is packed into flat arrays:
+
+  pins          int32, sorted, for binary search (numeric pincodes without a leading zero)
+  <col>_codes   int8/int16/int32 per zone/state/location/status, -1 for missing values,
+                decoded through a small per-column string table
+  oda_distance  float32
+
+Pincodes that are not plain integers (leading zeros, letters) are rare; they keep their
+original text in an `extra` map and their rows follow the numeric ones.
+
+Everything is written to one file: an 8-byte magic, the JSON header length, the JSON
+header (array offsets and dtypes, string tables, caller stamp) and the 64-byte aligned
+array data. `PincodeStore.open` maps it read-only with numpy.memmap, so every gunicorn
+worker shares the same page-cache pages instead of holding its own copy of the sheet.
+
+The store only backs the sheet fallback: couriers not yet ingested into the
+courier_pincodes table, and fetch_pincode_row_from_excel. Ingested couriers are looked
+up in SQLite and never map it.
+"""
+import json, os, struct
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"GAMPINS1"
+ALIGN = 64
+CATEGORY_COLUMNS = ("zone", "state", "location", "status")
+COLUMNS = (*CATEGORY_COLUMNS, "oda_distance")
+INT32_MAX = np.iinfo(np.int32).max
+
+def _pin_number(pin: str):
+    """int for canonical integer pincodes that fit int32 (so str(int) round-trips), else None."""
+    if pin.isdigit() and (len(pin) == 1 or pin[0] != "0") and len(pin) <= 10:
+        n = int(pin)
+        if n <= INT32_MAX:
+            return n
+    return None
+
+def _code_dtype(n: int):
+    for dt in (np.int8, np.int16, np.int32):
+        if n <= np.iinfo(dt).max:
+            return dt
+    return np.int64
+
+def _distances(values) -> list:
+    # float32 -> shortest decimal text -> float, so 12.3 comes back as 12.3 and not 12.300000190734863
+    return np.asarray(values, dtype=np.float32).astype(str).astype(np.float64).tolist()
+
+class PincodeStore:
+    __slots__ = ("pins", "codes", "categories", "oda_distance", "extra", "stamp", "_mm")
+
+    def __init__(self, pins, codes, categories, oda_distance, extra, stamp=(), mm=None):
+        self.pins = pins                  # int32[n_numeric], sorted
+        self.codes = codes                # {col: int array[n]}
+        self.categories = categories      # {col: [str, ...]}
+        self.oda_distance = oda_distance  # float32[n]
+        self.extra = extra                # {pincode text: row}
+        self.stamp = tuple(stamp)
+        self._mm = mm
+
+    # ---------- Build ----------
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame, stamp=()) -> "PincodeStore":
+        """Pack a normalized pincode frame (first row per pincode wins)."""
+        if frame is None or frame.empty:
+            frame = pd.DataFrame(columns=["pincode", *COLUMNS])
+        frame = frame.drop_duplicates(subset="pincode", keep="first")
+        pins = frame["pincode"].astype(str).tolist()
+        numbers = [_pin_number(p) for p in pins]
+        numeric = np.array([i for i, n in enumerate(numbers) if n is not None], dtype=np.int64)
+        order = numeric[np.argsort(np.array([numbers[i] for i in numeric], dtype=np.int64), kind="stable")]
+        others = np.array([i for i, n in enumerate(numbers) if n is None], dtype=np.int64)
+        rows = np.concatenate([order, others])
+
+        codes, categories = {}, {}
+        for col in CATEGORY_COLUMNS:
+            values = frame[col].to_numpy(dtype=object)[rows]
+            values = np.array([None if v is None or (isinstance(v, float) and v != v) else str(v) for v in values],
+                              dtype=object)
+            cat = pd.Categorical(values)
+            categories[col] = [str(c) for c in cat.categories]
+            codes[col] = cat.codes.astype(_code_dtype(len(categories[col])))
+        dist = pd.to_numeric(frame["oda_distance"], errors="coerce").fillna(0.0).to_numpy(dtype=np.float32)[rows]
+        return cls(np.array([numbers[i] for i in order], dtype=np.int32), codes, categories, dist,
+                   {pins[i]: len(order) + j for j, i in enumerate(others)}, stamp)
+
+    # ---------- File ----------
+    def write(self, path: str):
+        """Write atomically (temp file + rename) so readers never map a half-written store."""
+        arrays = {"pins": self.pins, "oda_distance": self.oda_distance,
+                  **{f"{c}_codes": a for c, a in self.codes.items()}}
+        layout, offset = {}, 0
+        for name, arr in arrays.items():
+            layout[name] = {"dtype": arr.dtype.str, "offset": offset, "count": int(arr.size)}
+            offset += -(-arr.nbytes // ALIGN) * ALIGN
+        header = json.dumps({"arrays": layout, "categories": self.categories, "extra": self.extra,
+                             "stamp": list(self.stamp)}).encode()
+        data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            for name, arr in arrays.items():
+                fh.seek(data_start + layout[name]["offset"])
+                fh.write(np.ascontiguousarray(arr).tobytes())
+            fh.truncate(data_start + offset)
+        os.replace(tmp, path)
+
+    @classmethod
+    def open(cls, path: str) -> "PincodeStore":
+        """Map a store file read-only; raises ValueError if it is not one."""
+        mm = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(mm[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a pincode store")
+        (hlen,) = struct.unpack("<Q", bytes(mm[len(MAGIC):len(MAGIC) + 8]))
+        header = json.loads(bytes(mm[len(MAGIC) + 8:len(MAGIC) + 8 + hlen]))
+        data_start = -(-(len(MAGIC) + 8 + hlen) // ALIGN) * ALIGN
+        arrays = {name: np.frombuffer(mm, dtype=np.dtype(a["dtype"]), count=a["count"], offset=data_start + a["offset"])
+                  for name, a in header["arrays"].items()}
+        codes = {c: arrays[f"{c}_codes"] for c in CATEGORY_COLUMNS}
+        return cls(arrays["pins"], codes, header["categories"], arrays["oda_distance"], header["extra"],
+                   header["stamp"], mm)
+
+    # ---------- Lookups ----------
+    def __len__(self):
+        return len(self.oda_distance)
+
+    def position(self, pin) -> int:
+        """Row of a pincode, or -1."""
+        pin = str(pin).strip()
+        n = _pin_number(pin)
+        if n is None:
+            return self.extra.get(pin, -1)
+        i = int(self.pins.searchsorted(np.int32(n)))  # an int64 key would cast the whole array per call
+        return i if i < len(self.pins) and int(self.pins[i]) == n else -1
+
+    def positions(self, pins) -> np.ndarray:
+        """Vectorized `position` (binary search over the sorted pins)."""
+        pins = [str(p).strip() for p in pins]
+        numbers = [_pin_number(p) for p in pins]
+        keys = np.array([-1 if n is None else n for n in numbers], dtype=np.int32)
+        idx = np.searchsorted(self.pins, keys)
+        idx_c = np.minimum(idx, max(len(self.pins) - 1, 0))
+        found = (idx < len(self.pins)) & (keys >= 0)
+        if len(self.pins):
+            found &= self.pins[idx_c] == keys
+        out = np.where(found, idx, -1)
+        for j, n in enumerate(numbers):
+            if n is None:
+                out[j] = self.extra.get(pins[j], -1)
+        return out
+
+    def _decode(self, col: str, rows) -> list:
+        table = self.categories[col]
+        return [table[c] if c >= 0 else None for c in np.asarray(self.codes[col][rows]).tolist()]
+
+    def get(self, pin):
+        """Row dict (pincode, zone, state, location, status, oda_distance) or None."""
+        i = self.position(pin)
+        if i < 0:
+            return None
+        row = {"pincode": str(pin).strip()}
+        for c in CATEGORY_COLUMNS:
+            code = int(self.codes[c][i])
+            row[c] = self.categories[c][code] if code >= 0 else None
+        row["oda_distance"] = float(str(self.oda_distance[i]))
+        return row
+
+    def rows(self, pins) -> list:
+        """Row dicts for the pins found (unique, in first-seen order)."""
+        pins = list(dict.fromkeys(str(p).strip() for p in pins))
+        pos = self.positions(pins)
+        hit = np.flatnonzero(pos >= 0)
+        rows = pos[hit]
+        cols = {c: self._decode(c, rows) for c in CATEGORY_COLUMNS}
+        cols["oda_distance"] = _distances(self.oda_distance[rows])
+        return [{"pincode": pins[j], **{c: cols[c][k] for c in COLUMNS}} for k, j in enumerate(hit.tolist())]
+
+    def to_frame(self) -> pd.DataFrame:
+        """The store as a normalized pincode frame (numeric pincodes ascending, then the rest)."""
+        extra = sorted(self.extra.items(), key=lambda kv: kv[1])
+        everything = np.arange(len(self))
+        data = {"pincode": [str(p) for p in self.pins.tolist()] + [p for p, _ in extra]}
+        for c in CATEGORY_COLUMNS:
+            data[c] = self._decode(c, everything)
+        data["oda_distance"] = _distances(self.oda_distance)
+        return pd.DataFrame(data)
+
+    def nbytes(self) -> int:
+        return self.pins.nbytes + self.oda_distance.nbytes + sum(a.nbytes for a in self.codes.values())
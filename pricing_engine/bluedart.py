@@ -1,46 +1,20 @@
-import pandas as pd
 import os
 
+from pricing_engines.oda import OdaTable, load_oda_table
+
 ODA_CHARGES_FILE = os.path.join("uploads", "Bluedart ODA Charges copy.xlsx")
 
 def load_oda_metrics():
-    """Load the ODA charge metrics Excel for Bluedart."""
+    """Load the ODA charge metrics Excel for Bluedart (compiled once, reloaded when the file changes)."""
     if not os.path.exists(ODA_CHARGES_FILE):
         raise FileNotFoundError(f"ODA Charges file not found: {ODA_CHARGES_FILE}")
-    df = pd.read_excel(ODA_CHARGES_FILE)
-    df.columns = [c.strip().lower() for c in df.columns]
-    return df
+    return load_oda_table(ODA_CHARGES_FILE, outside=0.0)
 
 def get_oda_charge(distance_km, weight, oda_metrics):
-    """Fetch ODA charge using distance range and weight slab."""
-    matched_row = None
-    for _, row in oda_metrics.iterrows():
-        if row.get('min_km', 0) <= distance_km <= row.get('max_km', 999999):
-            matched_row = row
-            break
-
-    if matched_row is None:
-        return 0.0
-
-    # Dynamically find correct weight column
-    weight_cols = [c for c in oda_metrics.columns if 'kg' in c or 'weight' in c]
-    rate = 0.0
-    for col in weight_cols:
-        try:
-            limit = float(col.replace('upto_', '').replace('kg', '').replace('weight_', '').strip())
-            if weight <= limit:
-                rate = float(matched_row[col])
-                break
-        except Exception:
-            continue
-
-    if not rate and weight_cols:
-        try:
-            rate = float(matched_row[weight_cols[-1]])
-        except Exception:
-            rate = 0.0
-
-    return rate
+    """Fetch ODA charge using distance range and weight slab (0.0 when no range matches)."""
+    if not isinstance(oda_metrics, OdaTable):
+        oda_metrics = OdaTable.from_frame(oda_metrics, outside=0.0)
+    return oda_metrics.charge(float(distance_km), float(weight))
 
 def calculate_price(data, metrics):
     """Bluedart pricing rule with ODA (Special) fetched from Excel."""
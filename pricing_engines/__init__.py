@@ -1,23 +1,39 @@
 from importlib import import_module
 
+from .base import quote_rows
+
 _registry = {}
 
+DEFAULT_ENGINE = "standard"
+
+def _load(modname):
+    try:
+        module = import_module(f".{modname}", __name__)
+    except ModuleNotFoundError:
+        return None
+    # helper modules (base, oda, ...) share the namespace; only real engines expose quote()
+    return module if hasattr(module, "quote") else None
+
 def get_engine(courier_name: str):
     key = (courier_name or "").lower().strip().replace(" ", "_")
     if key in _registry:
         return _registry[key]
     # try known modules first
-    candidates = [key]
+    candidates = [key] if key.isidentifier() else []
     if key == "blue_dart":
         candidates.append("bluedart")
     for modname in candidates:
-        try:
-            module = import_module(f".{modname}", __name__)
+        module = _load(modname)
+        if module is not None:
             _registry[key] = module
             return module
-        except ModuleNotFoundError:
-            continue
-    # default generic
-    module = import_module(".generic", __name__)
+    # default: the app's standard pricing
+    module = import_module(f".{DEFAULT_ENGINE}", __name__)
     _registry[key] = module
     return module
+
+def quote_many(engine, cfg, frame, declared_value, shared):
+    """Batch-quote through an engine, falling back to per-row `quote` for engines without `quote_many`."""
+    if hasattr(engine, "quote_many"):
+        return engine.quote_many(cfg, frame, declared_value, shared)
+    return quote_rows(engine.quote, cfg, frame, declared_value, shared)
@@ -2,11 +2,257 @@
 Pricing engine plugin interface.
 Each engine exposes a `quote(cfg, pincode, row, used_weight, declared_value, shared)` function
 that returns a dict with fields: freight, fuel, insurance, oda, docket, subtotal, gst, total, reason
+
+Engines may also expose `quote_many(cfg, frame, declared_value, shared)` to price a whole
+manifest at once. `frame` has one row per requested pincode (pincode, weight, matched and
+the serviceability columns zone/state/location/status/oda_distance); the result is
+{field: list} over RESULT_FIELDS + reason, aligned with the frame. `quote_rows` is the
+default for engines that only implement `quote`.
+
+`cfg` is a CourierConfig (or a plain courier dict, see CourierConfig.of); both support
+cfg["field"] and cfg.get("field", default).
+
+Weight-slab rate cards live under a "slabs" key of the rates dict, one card per zone
+(zone names match case-insensitively; zones without a card keep the per-kg zone rate):
+
+  {"North": 40, "slabs": {"South": {"slabs": [[0.5, 40], [1, 70], [2, 120]],
+                                    "add_step": 0.5, "add_rate": 30,
+                                    "per_kg_above": 10, "per_kg": 18}}}
+
+  weight <= a slab's max kg    the charge of the first slab that covers it
+  above the last slab          last slab charge + add_rate per started add_step kg
+  above per_kg_above (or above the last slab when there are no add steps)
+                               weight x per_kg
+
+Cards are compiled once per courier version into SlabTable breakpoint arrays, so pricing
+a weight is a bisect (a numpy searchsorted for a manifest) instead of a walk over slabs.
 """
+import json, logging, math
+from bisect import bisect_left
 from typing import Dict, Any
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger("gamma")
+
+FLAT_RATE_KEYS = ["rate", "rate_per_kg", "z_rate", "price"]
+NUMERIC_FIELDS = ("docket", "fuel_pct", "insurance_pct", "insurance_flat", "oda_fixed", "gst_pct", "min_charge")
+AMOUNT_FIELDS = ("freight", "fuel", "insurance", "oda", "docket", "subtotal", "gst", "total")
+RESULT_FIELDS = ("status", "zone", "zone_rate", "oda_distance", "state", "location", *AMOUNT_FIELDS)
+
+def zone_rate_for(rates, zone) -> float:
+    if isinstance(rates, dict) and zone:
+        try:
+            return float(rates.get(zone) or 0)
+        except Exception:
+            return 0.0
+    return 0.0
+
+def flat_rate(rates) -> float:
+    """Per-kg rate used when there is no zone rate: rates["rate_per_kg"] or the first record's rate."""
+    if isinstance(rates, dict) and "rate_per_kg" in rates:
+        try:
+            return float(rates.get("rate_per_kg") or 0)
+        except Exception:
+            return 0.0
+    if isinstance(rates, list) and rates and isinstance(rates[0], dict):
+        for key in FLAT_RATE_KEYS:
+            if key in rates[0]:
+                try:
+                    return float(rates[0].get(key) or 0)
+                except Exception:
+                    return 0.0
+    return 0.0
+
+class SlabTable:
+    """One zone's compiled weight-slab card (see the module docstring); raises ValueError on a bad card."""
+    __slots__ = ("bounds", "charges", "bounds_array", "charges_array", "add_step", "add_rate", "per_kg_above", "per_kg")
+
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            raise ValueError("a slab card must be an object")
+        try:
+            slabs = sorted((float(kg), float(charge)) for kg, charge in spec.get("slabs") or [])
+            add_step, add_rate = float(spec.get("add_step") or 0), float(spec.get("add_rate") or 0)
+            per_kg = float(spec.get("per_kg") or 0)
+            per_kg_above = float(spec["per_kg_above"]) if spec.get("per_kg_above") is not None else None
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"slab values must be numbers: {e}") from None
+        if not slabs:
+            raise ValueError("needs at least one [max_kg, charge] slab")
+        if any(kg <= 0 or charge < 0 for kg, charge in slabs) or len({kg for kg, _ in slabs}) != len(slabs):
+            raise ValueError("slab weights must be positive and distinct, charges not negative")
+        if add_step < 0 or add_rate < 0 or per_kg < 0:
+            raise ValueError("add_step, add_rate and per_kg cannot be negative")
+        if bool(add_step) != bool(add_rate):
+            raise ValueError("add_step and add_rate go together")
+        if not add_step and not per_kg:
+            raise ValueError("weights above the last slab need add_step/add_rate or per_kg")
+        if add_step and per_kg and per_kg_above is None:
+            raise ValueError("per_kg with add steps needs per_kg_above")
+        if per_kg_above is not None and per_kg_above < slabs[-1][0]:
+            raise ValueError("per_kg_above must not be below the last slab")
+        self.bounds, self.charges = [kg for kg, _ in slabs], [charge for _, charge in slabs]
+        self.bounds_array, self.charges_array = np.array(self.bounds), np.array(self.charges)
+        self.add_step, self.add_rate, self.per_kg = add_step, add_rate, per_kg
+        # with no add steps, per-kg pricing starts right after the last slab
+        self.per_kg_above = math.inf if not per_kg else (self.bounds[-1] if per_kg_above is None else per_kg_above)
+
+    def key(self) -> tuple:
+        return (tuple(self.bounds), tuple(self.charges), self.add_step, self.add_rate, self.per_kg_above, self.per_kg)
+
+    def _steps(self, extra):
+        # started steps; the epsilon stops float noise ((1.1 - 0.5) / 0.2 = 3.0000000000000004) billing a 4th step
+        return np.ceil(extra / self.add_step - 1e-9)
+
+    def freight(self, weight: float) -> float:
+        weight = float(weight)
+        if math.isnan(weight):
+            return math.nan
+        if weight <= self.bounds[-1]:
+            return self.charges[bisect_left(self.bounds, weight)]
+        if weight > self.per_kg_above:
+            return weight * self.per_kg
+        return self.charges[-1] + float(self._steps(weight - self.bounds[-1])) * self.add_rate
+
+    def freights(self, weights) -> np.ndarray:
+        w = np.asarray(weights, dtype=float)
+        i = np.searchsorted(self.bounds_array, w, side="left")
+        out = self.charges_array[np.minimum(i, len(self.bounds) - 1)]
+        over = w > self.bounds[-1]
+        if over.any():
+            if self.add_step:
+                out = np.where(over, self.charges[-1] + self._steps(w - self.bounds[-1]) * self.add_rate, out)
+            out = np.where(w > self.per_kg_above, w * self.per_kg, out)
+        # searchsorted puts NaN after every bound; price it NaN like `freight` does
+        return np.where(np.isnan(w), np.nan, out)
+
+def compile_slabs(rates) -> Dict[str, SlabTable]:
+    """{ZONE (stripped, upper-case): SlabTable} for a rates dict's "slabs" cards; ValueError names the bad zone."""
+    cards = rates.get("slabs") if isinstance(rates, dict) else None
+    if cards is None:
+        return {}
+    if not isinstance(cards, dict):
+        raise ValueError('"slabs" must map zone names to slab cards')
+    tables = {}
+    for zone, spec in cards.items():
+        try:
+            tables[str(zone).strip().upper()] = SlabTable(spec)
+        except ValueError as e:
+            raise ValueError(f"zone {zone}: {e}") from None
+    return tables
+
+class CourierConfig:
+    """
+    Immutable, pre-parsed courier row: rates JSON decoded once, numeric fields cast to
+    float, zone rates and the flat per-kg fallback precomputed.
+    """
+    __slots__ = ("name", "file_path", "rates", "fuel_basis", "oda_type", "updated_at", "pincode_rows",
+                 *NUMERIC_FIELDS, "zone_rates", "zone_rates_upper", "flat_rate", "slabs")
+
+    def __init__(self, row: Dict[str, Any]):
+        rates = row.get("rates")
+        if isinstance(rates, (str, bytes)) or rates is None:
+            try:
+                rates = json.loads(rates or "{}")
+            except Exception as e:
+                log.warning("Bad rates JSON for %s: %s; using {}", row.get("name"), e)
+                rates = {}
+        try:
+            slabs = compile_slabs(rates)
+        except ValueError as e:
+            log.warning("Bad slab rate card for %s: %s; pricing per kg", row.get("name"), e)
+            slabs = {}
+        zone_keys = [k for k in rates if k != "slabs"] if isinstance(rates, dict) else []
+        values = {
+            "name": row.get("name"),
+            "file_path": row.get("file_path"),
+            "rates": rates,
+            "fuel_basis": (row.get("fuel_basis") or "freight").lower(),
+            "oda_type": row.get("oda_type"),
+            "updated_at": row.get("updated_at"),
+            "pincode_rows": row.get("pincode_rows"),
+            **{k: float(row.get(k) or 0) for k in NUMERIC_FIELDS},
+            "zone_rates": {k: zone_rate_for(rates, k) for k in zone_keys},
+            "zone_rates_upper": {str(k).strip().upper(): zone_rate_for(rates, k) for k in zone_keys},
+            "flat_rate": flat_rate(rates),
+            "slabs": slabs,
+        }
+        for k, v in values.items():
+            object.__setattr__(self, k, v)
+
+    @classmethod
+    def of(cls, cfg):
+        return cfg if isinstance(cfg, cls) else cls(cfg)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("CourierConfig is immutable")
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def pricing_key(self) -> tuple:
+        """Everything engines price from; equal keys quote identically for the same pincode row."""
+        return (self.fuel_basis, self.oda_type, *(getattr(self, k) for k in NUMERIC_FIELDS),
+                tuple(sorted(self.zone_rates.items())), self.flat_rate,
+                tuple(sorted((z, t.key()) for z, t in self.slabs.items())))
+
+    def __repr__(self):
+        return f"CourierConfig({self.name!r}, updated_at={self.updated_at!r})"
+
+def rate_for_zone(cfg: CourierConfig, zone) -> float:
+    """Per-kg zone rate, matching the rate card key exactly first and then case-insensitively."""
+    if not zone:
+        return 0.0
+    return cfg.zone_rates.get(zone) or cfg.zone_rates_upper.get(str(zone).strip().upper(), 0.0)
+
+def slab_for_zone(cfg, zone):
+    """The zone's SlabTable, or None when the courier prices that zone per kg."""
+    slabs = getattr(cfg, "slabs", None)
+    if not slabs or not zone:
+        return None
+    return slabs.get(str(zone).strip().upper())
+
+def row_fields(row) -> Dict[str, Any]:
+    """Display fields of a serviceability row (None when the pincode is not served)."""
+    if not row:
+        return {"status": "OK", "zone": "", "oda_distance": 0.0, "state": "", "location": ""}
+    status = (row.get("status") or "").upper()
+    if status in ("YES","Y"): status = "ODA"
+    return {
+        "status": status,
+        "zone": row.get("zone") or "",
+        "oda_distance": float(row.get("oda_distance") or 0.0),
+        "state": row.get("state") or "",
+        "location": row.get("location") or "",
+    }
+
+def quote_rows(quote, cfg, frame: pd.DataFrame, declared_value, shared) -> Dict[str, list]:
+    """Default `quote_many`: call an engine's `quote` per frame row and collect columns."""
+    cfg = CourierConfig.of(cfg)
+    out = {k: [] for k in (*RESULT_FIELDS, "reason")}
+    for rec in frame.to_dict(orient="records"):
+        row = {k: (None if pd.isna(v) else v) for k, v in rec.items()} if rec["matched"] else None
+        fields = row_fields(row)
+        fields["zone_rate"] = rate_for_zone(cfg, fields["zone"])
+        q = quote(cfg, rec["pincode"], row or {}, rec["weight"], declared_value, shared)
+        for k in AMOUNT_FIELDS:
+            fields[k] = q.get(k)
+        fields["reason"] = q.get("reason", "OK")
+        for k, v in fields.items():
+            out[k].append(v)
+    return out
 
-def common_components(cfg: Dict[str, Any], perkg: float, used_weight: float, declared_value: float, status: str) -> Dict[str,float]:
-    freight = perkg * used_weight
+def common_components(cfg: Dict[str, Any], perkg: float, used_weight: float, declared_value: float, status: str,
+                      zone=None) -> Dict[str,float]:
+    slab = slab_for_zone(cfg, zone)
+    freight = slab.freight(used_weight) if slab is not None else perkg * used_weight
     pct_amt  = (cfg.get("insurance_pct",0)/100.0) * float(declared_value or 0)
     flat_amt = float(cfg.get("insurance_flat",0) or 0)
     insurance = max(pct_amt, flat_amt)
@@ -1,84 +1,66 @@
 # pricing_engines/bluedart.py
-from .base import common_components, apply_min_and_tax
+"""
+Bluedart pricing.
 
-# ----------------------------------------------------------------------
-# Bluedart ODA Matrix: (min_km, max_km, [ (max_weight, charge) ... ])
-# ----------------------------------------------------------------------
-ODA_MATRIX = [
-    (20, 50,  [(100, 550),  (250, 990),  (500, 1100), (1000, 1375)]),
-    (51, 100, [(100, 825),  (250, 1210), (500, 1375), (1000, 1650)]),
-    (101,150, [(100,1100),  (250,1650),  (500,1925),  (1000,2200)]),
-    (151,200, [(100,1375),  (250,1925),  (500,2200),  (1000,2475)]),
-    (201,250, [(100,1650),  (250,2200),  (500,2750),  (1000,3300)]),
-    (251,300, [(100,1925),  (250,2500),  (500,3150),  (1000,3800)]),
-    (301,350, [(100,2200),  (250,2800),  (500,3550),  (1000,4300)]),
-    (351,400, [(100,2475),  (250,3100),  (500,3950),  (1000,4800)]),
-]
-
-def get_oda_charge(distance_km: float, weight_kg: float) -> float:
-    """
-    Compute ODA charge from internal matrix.
-    Uses inclusive upper bound on both distance and weight.
-    """
-    distance_km = float(distance_km)
-    weight_kg = float(weight_kg)
-
-    for (min_d, max_d, weight_brackets) in ODA_MATRIX:
-        # correct inclusive logic
-        if min_d <= distance_km <= max_d:
-            for (max_w, charge) in weight_brackets:
-                if weight_kg <= max_w:
-                    return charge
-            # heavier than last bracket
-            return weight_brackets[-1][1]
-    # above max distance → use highest bracket in last range
-    return ODA_MATRIX[-1][2][-1][1]
+Bluedart is priced by the rules the app has always quoted it with (pricing_engines/standard):
+zone or flat per-kg freight, the "Special" ODA distance-weight matrix for ODA pincodes, min
+charge as the pre-fuel subtotal floor and fuel on cfg["fuel_basis"]. The one Bluedart
+addition: a matched ODA row without a distance takes it from a legacy shared sheet
+(shared["df"] with pincode and distance_km columns) when the caller passes one.
+"""
+import pandas as pd
 
+from . import standard
+from .oda import get_bluedart_oda_charge
 
-def quote(cfg, pincode, row, used_weight, declared_value, shared):
-    """
-    Bluedart pricing with embedded ODA logic (distance-weight matrix).
-    """
-    status = str(row.get("status", "")).upper()
-    zone = str(row.get("zone", "")).upper()
-    perkg = cfg["rates"].get(zone)
+def get_oda_charge(distance_km: float, weight_kg: float) -> float:
+    """ODA charge from the shared Bluedart matrix (pricing_engines/oda.py)."""
+    return get_bluedart_oda_charge(float(distance_km), float(weight_kg))
 
-    if not perkg:
-        return {"reason": f"Rate missing for zone {zone}"}
 
-    parts = common_components(cfg, perkg, used_weight, declared_value, status)
+def _distance_index(df):
+    """pincode -> distance_km for the first row of each pincode in a legacy shared df."""
+    if df is None or df.empty or "distance_km" not in df.columns:
+        return {}
+    first = df.drop_duplicates(subset="pincode", keep="first")
+    return dict(zip(first["pincode"], first["distance_km"]))
 
-    oda = 0.0
-    if any(k in status for k in ("ODA", "EDL", "SPECIAL")):
-        # ---- get distance safely ----
-        df = shared.get("df")
-        dist = 0.0
-        if df is not None and not df.empty:
-            match = df.loc[df["pincode"] == pincode]
-            if not match.empty:
-                val = match.iloc[0].get("distance_km", 0)
-                try:
-                    dist = float(val)
-                except ValueError:
-                    dist = 0.0
-        if dist <= 0:
-            dist = 50.0  # safe default
-        oda = get_oda_charge(dist, used_weight)
+def _distance(pincode, row, shared):
+    dist = row.get("oda_distance")
+    if not dist:
+        by_pin = shared.get("distance_by_pin")
+        if by_pin is not None:
+            dist = by_pin.get(pincode, 0.0)
+        else:
+            df = shared.get("df")
+            if df is not None and not df.empty:
+                match = df.loc[df["pincode"] == pincode]
+                if not match.empty:
+                    dist = match.iloc[0].get("distance_km", 0)
+    try:
+        return float(dist or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
 
-    subtotal_before_fuel = (
-        parts["freight"] + parts["docket"] + parts["insurance"] + oda
-    )
-    fuel = subtotal_before_fuel * (cfg.get("fuel_pct", 0) / 100.0)
+def quote(cfg, pincode, row, used_weight, declared_value, shared=None):
+    """standard.quote, with the ODA distance filled from the legacy shared sheet when the row has none."""
+    shared = shared or {}
+    if row and not row.get("oda_distance") and (shared.get("distance_by_pin") or shared.get("df") is not None):
+        row = {**row, "oda_distance": _distance(pincode, row, shared)}
+    return standard.quote(cfg, pincode, row, used_weight, declared_value, shared)
 
-    subtotal_no_gst = subtotal_before_fuel + fuel
-    subtotal, gst, total = apply_min_and_tax(cfg, subtotal_no_gst)
 
-    return {
-        **parts,
-        "oda": round(oda, 2),
-        "fuel": round(fuel, 2),
-        "subtotal": round(subtotal, 2),
-        "gst": round(gst, 2),
-        "total": round(total, 2),
-        "reason": "OK",
-    }
+def quote_many(cfg, frame: pd.DataFrame, declared_value, shared=None) -> dict:
+    """
+    Vectorized `quote`: missing distances are filled from the legacy sheet with one column
+    map, then standard.quote_many prices the frame column-wise (ODA through
+    oda.get_bluedart_oda_charges).
+    """
+    by_pin = _distance_index((shared or {}).get("df"))
+    if by_pin:
+        dist = pd.to_numeric(frame["oda_distance"], errors="coerce").fillna(0.0)
+        fill = frame["matched"].astype(bool).to_numpy() & (dist == 0).to_numpy()
+        if fill.any():
+            legacy = pd.to_numeric(frame["pincode"].map(by_pin), errors="coerce").fillna(0.0)
+            frame = frame.assign(oda_distance=frame["oda_distance"].where(~fill, legacy))
+    return standard.quote_many(cfg, frame, declared_value, shared)
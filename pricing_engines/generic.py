@@ -1,11 +1,12 @@
-from .base import common_components, apply_min_and_tax
+from .base import CourierConfig, common_components, apply_min_and_tax, rate_for_zone, quote_rows, slab_for_zone
 
 def quote(cfg, pincode, row, used_weight, declared_value, shared):
+    cfg = CourierConfig.of(cfg)
     status = str(row.get("status","")).upper()
-    perkg  = cfg["rates"].get(str(row.get("zone","")).upper())
-    if not perkg:
+    perkg  = rate_for_zone(cfg, row.get("zone"))
+    if not perkg and slab_for_zone(cfg, row.get("zone")) is None:
         return {"reason": f"Rate missing for zone {row.get('zone')}"}
-    parts = common_components(cfg, perkg, used_weight, declared_value, status)
+    parts = common_components(cfg, perkg, used_weight, declared_value, status, row.get("zone"))
     oda = 0.0
     if "ODA" in status or "EDL" in status:
         oda = float(cfg.get("oda_fixed", 0))
@@ -17,3 +18,6 @@ def quote(cfg, pincode, row, used_weight, declared_value, shared):
         **parts, "oda": oda, "fuel": fuel,
         "subtotal": subtotal, "gst": gst, "total": total, "reason":"OK"
     }
+
+def quote_many(cfg, frame, declared_value, shared):
+    return quote_rows(quote, cfg, frame, declared_value, shared)
@@ -0,0 +1,127 @@
+# pricing_engines/oda.py
+"""
+Bluedart "Special" ODA surcharge table shared by every engine.
+
+The matrix is compiled once into sorted distance and weight band arrays. `charge`
+looks a single shipment up with bisect, and `charges` looks up arrays of
+(distance, weight) with numpy.searchsorted. Both bounds are inclusive: a distance
+belongs to the first band whose max_km it does not exceed, a weight to the first
+tier whose max_weight it does not exceed. Shipments past the last band or tier
+are charged at the last one.
+
+The table comes from the built-in ODA_MATRIX or, when ODA_CHARGES_FILE points at
+an existing sheet (min_km, max_km, upto_<N>kg columns), from that Excel file.
+"""
+import os, threading
+from bisect import bisect_left
+
+import numpy as np
+
+# ----------------------------------------------------------------------
+# (min_km, max_km, [ (max_weight, charge) ... ])
+# ----------------------------------------------------------------------
+ODA_MATRIX = [
+    (20, 50,  [(100, 550),  (250, 990),  (500, 1100), (1000, 1375)]),
+    (51, 100, [(100, 825),  (250, 1210), (500, 1375), (1000, 1650)]),
+    (101,150, [(100,1100),  (250,1650),  (500,1925),  (1000,2200)]),
+    (151,200, [(100,1375),  (250,1925),  (500,2200),  (1000,2475)]),
+    (201,250, [(100,1650),  (250,2200),  (500,2475),  (1000,2750)]),
+    (251,300, [(100,1925),  (250,2475),  (500,2750),  (1000,3025)]),
+    (301,350, [(100,2200),  (250,2750),  (500,3025),  (1000,3300)]),
+    (351,400, [(100,2475),  (250,3025),  (500,3300),  (1000,3575)]),
+    (401,450, [(100,2750),  (250,3300),  (500,3575),  (1000,3850)]),
+    (451,500, [(100,3025),  (250,3575),  (500,3850),  (1000,4125)]),
+]
+
+ODA_CHARGES_FILE = os.environ.get("ODA_CHARGES_FILE", "")
+
+class OdaTable:
+    """
+    Compiled ODA matrix. `outside` is returned for distances that fall outside every
+    band (below the first, above the last or in a gap); None clamps to the nearest
+    band instead.
+    """
+    __slots__ = ("min_km", "max_km", "weights", "table", "_min_km", "_max_km", "_weights", "_table", "outside")
+
+    def __init__(self, rows, outside=None):
+        rows = sorted(rows, key=lambda r: r[1])
+        # one shared weight axis; every band is expected to use the same tiers
+        tiers = [sorted(r[2]) for r in rows]
+        # python lists for bisect on single lookups, arrays for searchsorted
+        self._min_km = [float(r[0]) for r in rows]
+        self._max_km = [float(r[1]) for r in rows]
+        self._weights = [float(w) for w, _ in tiers[0]]
+        self._table = [[float(c) for _, c in t] for t in tiers]
+        self.min_km = np.array(self._min_km)
+        self.max_km = np.array(self._max_km)
+        self.weights = np.array(self._weights)
+        self.table = np.array(self._table)
+        self.outside = outside
+
+    @classmethod
+    def from_frame(cls, df, outside=None):
+        """Build from an ODA sheet: min_km, max_km and one column per weight tier (upto_100kg, ...)."""
+        df = df.rename(columns={c: str(c).strip().lower() for c in df.columns})
+        tiers = []
+        for col in df.columns:
+            if "kg" in col or "weight" in col:
+                try:
+                    tiers.append((float(col.replace("upto_", "").replace("kg", "").replace("weight_", "").strip()), col))
+                except ValueError:
+                    continue
+        tiers.sort()
+        rows = [(r.get("min_km", 0), r.get("max_km", 999999), [(w, r[col]) for w, col in tiers])
+                for r in df.to_dict(orient="records")]
+        return cls(rows, outside=outside)
+
+    def charge(self, distance_km: float, weight_kg: float) -> float:
+        n = len(self._max_km)
+        i = bisect_left(self._max_km, distance_km)
+        if self.outside is not None and (i == n or distance_km < self._min_km[i]):
+            return float(self.outside)
+        i = min(i, n - 1)
+        j = min(bisect_left(self._weights, weight_kg), len(self._weights) - 1)
+        return self._table[i][j]
+
+    def charges(self, distances, weights) -> np.ndarray:
+        d = np.asarray(distances, dtype=float)
+        w = np.asarray(weights, dtype=float)
+        n = len(self.max_km)
+        i = np.searchsorted(self.max_km, d, side="left")
+        inside = (i < n)
+        i = np.minimum(i, n - 1)
+        j = np.minimum(np.searchsorted(self.weights, w, side="left"), len(self.weights) - 1)
+        out = self.table[i, j]
+        if self.outside is not None:
+            inside &= d >= self.min_km[i]
+            out = np.where(inside, out, float(self.outside))
+        return out
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+def load_oda_table(path: str = None, outside=None) -> OdaTable:
+    """Compiled table for an ODA sheet (rebuilt when the file changes) or the built-in matrix."""
+    path = ODA_CHARGES_FILE if path is None else path
+    if path and os.path.exists(path):
+        key = (path, os.stat(path).st_mtime_ns, outside)
+    else:
+        key = (None, None, outside)
+    table = _tables.get(key)
+    if table is None:
+        with _tables_lock:
+            table = _tables.get(key)
+            if table is None:
+                if key[0] is None:
+                    table = OdaTable(ODA_MATRIX, outside=outside)
+                else:
+                    import pandas as pd
+                    table = OdaTable.from_frame(pd.read_excel(path), outside=outside)
+                _tables[key] = table
+    return table
+
+def get_bluedart_oda_charge(distance_km: float, weight_kg: float) -> float:
+    return load_oda_table().charge(distance_km, weight_kg)
+
+def get_bluedart_oda_charges(distances, weights) -> np.ndarray:
+    return load_oda_table().charges(distances, weights)
@@ -0,0 +1,151 @@
+# pricing_engines/standard.py
+"""
+Default pricing used by /api/recommend.
+
+freight   = zone rate (or flat rate_per_kg / first record's rate) x weight, or the
+            zone's weight-slab card when it has one (zone_rate is then freight / weight)
+insurance = declared_value x insurance_pct + insurance_flat
+oda       = Bluedart matrix for oda_type 'Special' + ODA status, oda_fixed for 'Fixed'
+min_charge floors the pre-fuel subtotal; fuel is on freight or on that subtotal
+(cfg["fuel_basis"]); GST is applied last.
+
+A row with no slab card, zone rate, flat rate or min charge has no price at all (its
+total is only the charges on top of zero freight); it is still returned, with reason
+"Rate missing ...", so rankings can tell it from a real quote. Min-charge quotes are "OK".
+
+`quote` prices a single pincode row. `quote_many` prices a frame of pincodes
+joined against the courier's serviceability rows with column operations and
+returns exactly the same numbers.
+"""
+import numpy as np
+import pandas as pd
+
+from .base import CourierConfig, row_fields, slab_for_zone
+from .oda import get_bluedart_oda_charge, get_bluedart_oda_charges
+
+def _insurance(cfg, declared_value):
+    return (declared_value * (cfg.insurance_pct/100.0)) + cfg.insurance_flat
+
+def quote(cfg, pincode, row, used_weight, declared_value, shared=None):
+    cfg = CourierConfig.of(cfg)
+    fields = row_fields(row)
+    status, zone, oda_distance = fields["status"], fields["zone"], fields["oda_distance"]
+    zone_rate = cfg.zone_rates.get(zone, 0.0) if zone else 0.0
+    slab = slab_for_zone(cfg, zone)
+
+    if slab is not None:
+        base = max(0.0, slab.freight(used_weight))
+        zone_rate = base / used_weight if used_weight > 0 else 0.0
+    elif zone and zone_rate:
+        base = max(0.0, zone_rate * used_weight)
+    else:
+        base = max(0.0, cfg.flat_rate * used_weight)
+
+    docket, insurance = cfg.docket, _insurance(cfg, declared_value)
+
+    if cfg.oda_type == "Special" and status == "ODA":
+        oda = get_bluedart_oda_charge(oda_distance, used_weight)
+    elif cfg.oda_type == "Fixed":
+        oda = cfg.oda_fixed
+    else:
+        oda = 0.0
+
+    # ---- Min-charge fallback as SUBTOTAL baseline
+    min_charge = cfg.min_charge
+    subtotal_pre_fuel = max(base + docket + insurance + oda, min_charge)
+
+    fuel_base = subtotal_pre_fuel if cfg.fuel_basis == "subtotal" else (base if base>0 else min_charge)
+    fuel = fuel_base * (cfg.fuel_pct/100.0)
+
+    subtotal_for_tax = subtotal_pre_fuel + fuel
+    gst = subtotal_for_tax * (cfg.gst_pct/100.0)
+    total = subtotal_for_tax + gst
+    rated = slab is not None or (zone and zone_rate) or cfg.flat_rate or cfg.min_charge
+
+    return {
+        **fields, "zone_rate": zone_rate,
+        "freight": base if base>0 else min_charge,  # show min when used
+        "fuel": fuel, "insurance": insurance, "oda": oda, "docket": docket,
+        "subtotal": subtotal_for_tax - gst,
+        "gst": gst, "total": total, "reason": "OK" if rated else _rate_missing(zone),
+    }
+
+def _rate_missing(zone: str) -> str:
+    return f"Rate missing for zone {zone}" if zone else "Rate missing"
+
+def _text(col: pd.Series, matched: pd.Series) -> pd.Series:
+    return col.where(matched & col.notna(), "").astype(str)
+
+def quote_many(cfg, frame: pd.DataFrame, declared_value, shared=None) -> dict:
+    """
+    Vectorized `quote` over a frame with columns pincode, weight, matched and the
+    serviceability columns (zone, state, location, status, oda_distance; NaN when
+    unmatched). Returns {field: list} aligned with the frame rows.
+    """
+    cfg = CourierConfig.of(cfg)
+    n = len(frame)
+    w = frame["weight"].to_numpy(dtype=float)
+    matched = frame["matched"].astype(bool)
+
+    state = _text(frame["state"], matched)
+    location = _text(frame["location"], matched)
+    zone = _text(frame["zone"], matched)
+    status = _text(frame["status"], matched).str.upper().replace({"YES": "ODA", "Y": "ODA"})
+    status = status.where(matched, "OK")
+    oda_distance = pd.to_numeric(frame["oda_distance"].where(matched), errors="coerce").fillna(0.0).to_numpy(dtype=float)
+
+    has_zone = (zone != "").to_numpy()
+    if cfg.zone_rates:
+        zone_rate = zone.map(cfg.zone_rates).fillna(0.0).to_numpy(dtype=float)
+        zone_rate = np.where(has_zone, zone_rate, 0.0)
+    else:
+        zone_rate = np.zeros(n)
+
+    zone_base = zone_rate * w
+    flat_base = cfg.flat_rate * w
+    base = np.where(has_zone & (zone_rate != 0),
+                    np.where(zone_base > 0, zone_base, 0.0),
+                    np.where(flat_base > 0, flat_base, 0.0))
+    rated = has_zone & (zone_rate != 0) | (cfg.flat_rate != 0) | (cfg.min_charge != 0)
+    if cfg.slabs:
+        # one searchsorted per slab zone instead of a per-row bisect; zones are matched per distinct name
+        codes, names = pd.factorize(zone)
+        for i, name in enumerate(names):
+            slab = slab_for_zone(cfg, name)
+            if slab is None:
+                continue
+            rows = np.flatnonzero(codes == i)
+            rated[rows] = True
+            slab_base = slab.freights(w[rows])
+            base[rows] = np.where(slab_base > 0, slab_base, 0.0)
+            zone_rate[rows] = np.divide(base[rows], w[rows], out=np.zeros(rows.size), where=w[rows] > 0)
+
+    docket, insurance = cfg.docket, _insurance(cfg, declared_value)
+
+    oda = np.zeros(n)
+    if cfg.oda_type == "Special":
+        is_oda = (status == "ODA").to_numpy()
+        oda[is_oda] = get_bluedart_oda_charges(oda_distance[is_oda], w[is_oda])
+    elif cfg.oda_type == "Fixed":
+        oda[:] = cfg.oda_fixed
+
+    min_charge = cfg.min_charge
+    pre_fuel = base + docket + insurance + oda
+    subtotal_pre_fuel = np.where(min_charge > pre_fuel, min_charge, pre_fuel)
+    freight = np.where(base > 0, base, min_charge)
+
+    fuel_base = subtotal_pre_fuel if cfg.fuel_basis == "subtotal" else freight
+    fuel = fuel_base * (cfg.fuel_pct/100.0)
+
+    subtotal_for_tax = subtotal_pre_fuel + fuel
+    gst = subtotal_for_tax * (cfg.gst_pct/100.0)
+    total = subtotal_for_tax + gst
+
+    return {
+        "status": status.tolist(), "zone": zone.tolist(), "zone_rate": zone_rate.tolist(),
+        "oda_distance": oda_distance.tolist(), "state": state.tolist(), "location": location.tolist(),
+        "freight": freight.tolist(), "fuel": fuel.tolist(), "insurance": [insurance] * n,
+        "oda": oda.tolist(), "docket": [docket] * n,
+        "subtotal": (subtotal_for_tax - gst).tolist(), "gst": gst.tolist(), "total": total.tolist(),
+        "reason": ["OK"] * n if rated.all() else np.where(rated, "OK", zone.map(_rate_missing)).tolist(),
+    }
@@ -0,0 +1,160 @@
+"""
+On-demand profiling of single requests.
+
+An admin adds `?profile=1` (or the `X-Gamma-Profile: 1` header) to a request and the app
+runs it under a `RequestProfile`: cProfile for the Python call graph, tracemalloc for
+allocations and db.traced_statements for every SQLite statement. The report says where a
+slow request went (sheet parsing, SQLite, pricing, serialization) without redeploying:
+
+  functions   top PROFILE_TOP functions by cumulative and by own time
+  memory      peak traced bytes above the request's starting point, and the source
+              lines holding the most memory still allocated when it finished
+  sql         statements grouped by SQL text: executions, total and slowest time
+              (fetches are charged to their statement)
+
+Reports are saved as <id>.json next to the raw <id>.prof (pstats.Stats / snakeviz can
+load it) in a ring directory that keeps the newest PROFILE_KEEP profiles. One request
+per process is profiled at a time; cProfile and tracemalloc slow it down noticeably, so
+the timings are for comparison, not absolute.
+"""
+import cProfile, datetime, itertools, json, logging, os, pstats, threading, time, tracemalloc
+
+from db import traced_statements
+
+log = logging.getLogger("gamma")
+
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", 40))
+_IGNORED_ALLOCATIONS = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                        tracemalloc.Filter(False, __file__))
+_busy = threading.Lock()
+_ids = itertools.count(1)
+
+def _short(filename: str) -> str:
+    return os.sep.join(filename.split(os.sep)[-2:])
+
+def _where(filename: str, line: int, func: str) -> str:
+    if filename == "~":  # builtins: pstats reports them as ('~', 0, "<built-in method ...>")
+        return func
+    return f"{_short(filename)}:{line}({func})"
+
+class RequestProfile:
+    def __init__(self, label: str):
+        self.label = label
+        self.id = f"{datetime.datetime.now():%Y%m%dT%H%M%S%f}-{os.getpid()}-{next(_ids)}"
+        self.profiler = cProfile.Profile()
+        self.sql = {}  # sql -> [executions, seconds, slowest]
+        self._statements = None
+        self._own_tracing = False
+        self._baseline = None
+        self._started = self._memory_start = 0
+
+    @classmethod
+    def start(cls, label: str):
+        """A started profile, or None while another request in this process is being profiled."""
+        if not _busy.acquire(blocking=False):
+            return None
+        profile = cls(label)
+        try:
+            profile._begin()
+        except Exception:
+            _busy.release()
+            raise
+        return profile
+
+    def _record_sql(self, sql, seconds, executions):
+        entry = self.sql.get(sql)
+        if entry is None:
+            entry = self.sql[sql] = [0, 0.0, 0.0]
+        entry[0] += executions
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+    def _begin(self):
+        self._own_tracing = not tracemalloc.is_tracing()
+        if self._own_tracing:
+            tracemalloc.start()
+        else:
+            self._baseline = tracemalloc.take_snapshot().filter_traces(_IGNORED_ALLOCATIONS)
+        tracemalloc.reset_peak()
+        self._memory_start = tracemalloc.get_traced_memory()[0]
+        self._statements = traced_statements(self._record_sql)
+        self._statements.__enter__()
+        self._started = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self, status=None) -> dict:
+        """Stop profiling and return the report (call once, on the thread that started it)."""
+        try:
+            self.profiler.disable()
+            wall = time.perf_counter() - self._started
+            self._statements.__exit__(None, None, None)
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED_ALLOCATIONS)
+            if self._own_tracing:
+                tracemalloc.stop()
+                retained = snapshot.statistics("lineno")
+            else:
+                retained = [s for s in snapshot.compare_to(self._baseline, "lineno") if s.size_diff > 0]
+        finally:
+            _busy.release()
+        return {
+            "id": self.id, "label": self.label, "status": status, "pid": os.getpid(),
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "wall_ms": round(wall * 1000, 3),
+            "functions": self._functions(),
+            "memory": {
+                "peak_bytes": max(0, peak - self._memory_start),
+                "retained_bytes": max(0, current - self._memory_start),
+                "top": [{"where": f"{_short(s.traceback[0].filename)}:{s.traceback[0].lineno}", "bytes": getattr(s, "size_diff", s.size),
+                         "count": getattr(s, "count_diff", s.count)} for s in retained[:PROFILE_TOP]],
+            },
+            "sql": {
+                "statements": sum(e[0] for e in self.sql.values()),
+                "total_ms": round(sum(e[1] for e in self.sql.values()) * 1000, 3),
+                "top": [{"sql": sql, "executions": e[0], "total_ms": round(e[1] * 1000, 3), "max_ms": round(e[2] * 1000, 3)}
+                        for sql, e in sorted(self.sql.items(), key=lambda kv: -kv[1][1])[:PROFILE_TOP]],
+            },
+        }
+
+    def _functions(self) -> dict:
+        stats = pstats.Stats(self.profiler).stats  # (file, line, func) -> (primitive calls, calls, own, cumulative, callers)
+        rows = [{"function": _where(*key), "calls": nc, "own_ms": round(tt * 1000, 3), "cumulative_ms": round(ct * 1000, 3)}
+                for key, (_, nc, tt, ct, _) in stats.items()]
+        return {
+            "by_cumulative": sorted(rows, key=lambda r: -r["cumulative_ms"])[:PROFILE_TOP],
+            "by_own_time": sorted(rows, key=lambda r: -r["own_ms"])[:PROFILE_TOP],
+        }
+
+    def save(self, directory: str, report: dict) -> str:
+        """Write <id>.json and <id>.prof into the ring directory, dropping the oldest beyond PROFILE_KEEP."""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.id)
+        self.profiler.dump_stats(base + ".prof")
+        tmp = f"{base}.json.tmp"
+        with open(tmp, "w") as fh:
+            json.dump(report, fh)
+        os.replace(tmp, base + ".json")  # listings only see complete reports
+        for old in list_profiles(directory)[PROFILE_KEEP:]:
+            for ext in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(directory, old + ext))
+                except FileNotFoundError:
+                    pass
+        log.info("Profile %s saved: %s, %.1fms, %d SQL statements", self.id, self.label, report["wall_ms"], report["sql"]["statements"])
+        return self.id
+
+def list_profiles(directory: str) -> list:
+    """Saved profile ids, newest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted((n[:-5] for n in names if n.endswith(".json")), reverse=True)
+
+def profile_path(directory: str, profile_id: str, ext: str = ".json"):
+    """Path of a saved profile file, or None for an unknown (or malformed) id."""
+    if profile_id not in list_profiles(directory):
+        return None
+    path = os.path.join(directory, profile_id + ext)
+    return path if os.path.exists(path) else None
@@ -0,0 +1,87 @@
+"""
+Bounded LRU/TTL cache of /api/recommend quotes.
+
+Keys are (courier version, pincode, effective weight, declared value); a value holds one
+(field names, field values, serviceable) triple per courier, in the order of the compiled
+courier configs for that version. Because the courier version is part of the key, a
+courier add/update/delete in any worker makes older entries unreachable; the endpoints
+that write couriers also `clear()` the cache of the worker that served them so the
+memory is returned straight away, or `rekey()` it to the new version when an update only
+changed some pincodes' serviceability rows.
+
+QUOTE_CACHE_SIZE (entries, 0 disables) and QUOTE_CACHE_TTL (seconds) size it; `stats()`
+reports hits, misses and evictions for tuning under real traffic.
+"""
+import os, threading, time
+from collections import OrderedDict
+
+QUOTE_CACHE_SIZE = int(os.environ.get("QUOTE_CACHE_SIZE", 20000))
+QUOTE_CACHE_TTL = float(os.environ.get("QUOTE_CACHE_TTL", 900))
+
+class QuoteCache:
+    def __init__(self, max_entries: int = QUOTE_CACHE_SIZE, ttl: float = QUOTE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def get_many(self, keys) -> list:
+        """Cached values aligned with keys, None for misses; hits become most recently used."""
+        if not self.max_entries:
+            return [None] * len(keys)
+        now = time.monotonic()
+        out = []
+        with self._lock:
+            for key in keys:
+                hit = self._data.get(key)
+                if hit is not None and hit[0] < now:
+                    del self._data[key]
+                    self.expired += 1
+                    hit = None
+                if hit is None:
+                    self.misses += 1
+                    out.append(None)
+                else:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    out.append(hit[1])
+        return out
+
+    def put_many(self, keys, values):
+        if not self.max_entries:
+            return
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._data[key] = (expires, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def rekey(self, old_version, new_version, stale_pins) -> int:
+        """
+        Carry old_version entries over to new_version except those for stale_pins (a courier
+        update that only touched those pincodes); everything else is dropped. Returns the
+        number of entries kept.
+        """
+        with self._lock:
+            kept = OrderedDict(((new_version, *key[1:]), hit) for key, hit in self._data.items()
+                               if key[0] == old_version and key[1] not in stale_pins)
+            self._data = kept
+            return len(kept)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data), "max_entries": self.max_entries, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions, "expired": self.expired,
+            }
@@ -0,0 +1,107 @@
+"""
+Process pool for pricing very large pincode batches on more than one core.
+
+`QuotePool.map_shards` splits a batch into one contiguous shard per worker, runs them on a
+ProcessPoolExecutor and returns the shard results in input order. Batches smaller than
+`threshold` pins are not worth the IPC and stay on the request thread (`should_shard`).
+
+The executor is created lazily, once per process (a gunicorn worker gets its own pool, it
+is never forked per request). Pool workers are never forked from the gunicorn worker
+itself: by the time a large batch arrives it runs request, recent-searches and upload-job
+threads, and a fork can copy a lock one of them holds (SQLite, a queue, the courier or
+pincode index caches) into a child that then deadlocks on it. With the forkserver start
+method (where available, spawn otherwise) workers fork from a separate single-threaded
+server process that has already imported the `preload` modules (the app), so they still
+start warm and a pool re-created after a worker died is just as safe. The fork server is
+a fresh `python -c` whose sys.path only has the working directory (Python 3.11 does not pass
+it the caller's sys.path for the preload), so the directories of the preloaded modules are
+put on PYTHONPATH, which it inherits; otherwise the preload fails silently outside the
+project directory and every worker imports the app cold. `initializer` runs
+once in every worker and is where the caller preloads its courier configs; those and any
+pincode indexes then stay warm in the worker for the life of the pool.
+
+QUOTE_POOL_WORKERS (default: up to 4 CPUs; 0 or 1 disables the pool) and
+QUOTE_POOL_THRESHOLD (pins, default 5000) configure it.
+"""
+import atexit, logging, multiprocessing, os, sys, threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+log = logging.getLogger("gamma")
+
+QUOTE_POOL_WORKERS = int(os.environ.get("QUOTE_POOL_WORKERS", min(4, os.cpu_count() or 1)))
+QUOTE_POOL_THRESHOLD = int(os.environ.get("QUOTE_POOL_THRESHOLD", 5000))
+
+def _import_root(name: str):
+    """Directory a module is imported from (the parent of its top-level package), or None."""
+    path = getattr(sys.modules.get(name), "__file__", None)
+    if not path:
+        return None
+    root = os.path.dirname(os.path.abspath(path))
+    depth = name.count(".") + (1 if os.path.basename(path).startswith("__init__.") else 0)
+    for _ in range(depth):
+        root = os.path.dirname(root)
+    return root
+
+def _mp_context(preload=()):
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        paths = [p for p in os.environ.get("PYTHONPATH", "").split(os.pathsep) if p]
+        missing = [r for r in dict.fromkeys(map(_import_root, preload)) if r and r not in paths]
+        if missing:
+            os.environ["PYTHONPATH"] = os.pathsep.join([*missing, *paths])
+        ctx.set_forkserver_preload(list(preload))
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+class QuotePool:
+    def __init__(self, workers: int = QUOTE_POOL_WORKERS, threshold: int = QUOTE_POOL_THRESHOLD, initializer=None,
+                 preload=()):
+        self.workers = workers
+        self.threshold = threshold
+        self.initializer = initializer  # module-level function: it is pickled to the workers
+        self.preload = tuple(preload)  # modules the fork server imports once for every worker
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 1
+
+    def should_shard(self, n: int) -> bool:
+        return self.enabled and n >= max(self.threshold, self.workers)
+
+    def start(self) -> ProcessPoolExecutor:
+        """This process's executor, created on first use."""
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context(self.preload),
+                                                     initializer=self.initializer)
+                self._pid = os.getpid()
+                log.info("Quote pool started: %d workers (pid %d)", self.workers, self._pid)
+            return self._executor
+
+    def map_shards(self, fn, pincodes, weights, *args) -> list:
+        """[fn(pins_shard, weights_shard, *args), ...] for contiguous shards, in input order."""
+        n = len(pincodes)
+        size = -(-n // self.workers)
+        executor = self.start()
+        try:
+            futures = [executor.submit(fn, pincodes[i:i + size], weights[i:i + size], *args)
+                       for i in range(0, n, size)]
+            return [f.result() for f in futures]
+        except BrokenProcessPool:
+            # a worker died (OOM, signal); drop the pool so the next batch gets a fresh one
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
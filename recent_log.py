@@ -0,0 +1,233 @@
+"""
+Write-behind logger and queries for the recent_searches audit table.
+
+Request handlers hand rows to `RecentSearchWriter.record()`, which only enqueues
+them. A daemon thread drains the queue and writes `executemany` batches, flushing
+when `batch_size` rows are pending or `flush_interval` seconds have passed. At most
+`max_pending` rows (RECENT_MAX_PENDING) are held between `record()` and their write;
+batches beyond that are dropped and counted in `dropped` rather than growing memory.
+
+Each batch also adds its counts to recent_search_daily (one row per day and courier:
+searches, quoted, weight and total sums, min/max total) in the same transaction, so the
+daily history is always current without scanning raw rows. Every `compact_interval`
+seconds the same thread applies retention: raw rows older than RECENT_RETENTION_DAYS
+are deleted (their days live on in the aggregates) and aggregates older than
+RECENT_DAILY_RETENTION_DAYS are dropped.
+
+`recent_page()` reads raw rows newest first with keyset pagination (`before` = the last
+id of the previous page), so deep pages cost the same as the first one.
+"""
+import atexit, datetime, logging, os, queue, threading, time
+
+from db import connect
+
+log = logging.getLogger("gamma")
+
+INSERT_SQL = "INSERT INTO recent_searches(checked_at, pincode, courier, weight, total) VALUES (?,?,?,?,?)"
+DAILY_UPSERT_SQL = """
+    INSERT INTO recent_search_daily(day, courier, searches, quoted, weight_sum, total_sum, total_min, total_max)
+    VALUES (?,?,?,?,?,?,?,?)
+    ON CONFLICT(day, courier) DO UPDATE SET
+        searches=searches+excluded.searches, quoted=quoted+excluded.quoted,
+        weight_sum=weight_sum+excluded.weight_sum, total_sum=total_sum+excluded.total_sum,
+        total_min=min(coalesce(total_min, excluded.total_min), coalesce(excluded.total_min, total_min)),
+        total_max=max(coalesce(total_max, excluded.total_max), coalesce(excluded.total_max, total_max))
+"""
+RECENT_RETENTION_DAYS = float(os.environ.get("RECENT_RETENTION_DAYS", 30))
+RECENT_DAILY_RETENTION_DAYS = float(os.environ.get("RECENT_DAILY_RETENTION_DAYS", 400))
+RECENT_COMPACT_INTERVAL = float(os.environ.get("RECENT_COMPACT_INTERVAL", 3600))
+RECENT_MAX_PENDING = int(os.environ.get("RECENT_MAX_PENDING", 250000))  # rows, not batches
+COMPACT_BATCH = 5000  # rows per delete transaction, so retention never holds the write lock for long
+PAGE_COLUMNS = "id, checked_at, pincode, courier, weight, total"
+
+def _quoted(total) -> bool:
+    return total is not None and total == total  # NaN totals are stored as NULL
+
+def daily_rows(rows) -> list:
+    """recent_search_daily increments for (checked_at, pincode, courier, weight, total) rows."""
+    acc = {}
+    for checked_at, _pin, courier, weight, total in rows:
+        key = (str(checked_at)[:10], courier)
+        a = acc.get(key)
+        if a is None:
+            a = acc[key] = [0, 0, 0.0, 0.0, None, None]
+        a[0] += 1
+        a[2] += float(weight or 0)
+        if _quoted(total):
+            a[1] += 1
+            a[3] += total
+            a[4] = total if a[4] is None else min(a[4], total)
+            a[5] = total if a[5] is None else max(a[5], total)
+    return [(*key, *a) for key, a in acc.items()]
+
+def backfill_daily(conn) -> int:
+    """Aggregate every raw row into an empty recent_search_daily (first migration to the daily table)."""
+    n = conn.execute("""
+        INSERT INTO recent_search_daily(day, courier, searches, quoted, weight_sum, total_sum, total_min, total_max)
+        SELECT substr(checked_at, 1, 10), courier, COUNT(*), COUNT(total), TOTAL(weight), TOTAL(total), MIN(total), MAX(total)
+        FROM recent_searches WHERE checked_at IS NOT NULL AND courier IS NOT NULL GROUP BY 1, 2
+    """).rowcount
+    conn.commit()
+    return n
+
+def _days_ago(days: float, now=None) -> str:
+    now = now or datetime.datetime.now()
+    return (now - datetime.timedelta(days=days)).date().isoformat()
+
+def compact(conn, now=None, retention_days: float = RECENT_RETENTION_DAYS,
+            daily_retention_days: float = RECENT_DAILY_RETENTION_DAYS) -> tuple:
+    """Apply retention to raw rows (whole days) and daily aggregates; returns (rows, days) deleted."""
+    cutoff, rows = _days_ago(retention_days, now), 0
+    while True:
+        n = conn.execute("""DELETE FROM recent_searches WHERE id IN
+                            (SELECT id FROM recent_searches WHERE checked_at < ? LIMIT ?)""", (cutoff, COMPACT_BATCH)).rowcount
+        conn.commit()
+        rows += n
+        if n < COMPACT_BATCH:
+            break
+    days = conn.execute("DELETE FROM recent_search_daily WHERE day < ?", (_days_ago(daily_retention_days, now),)).rowcount
+    conn.commit()
+    return rows, days
+
+def recent_page(conn, limit: int, before=None, pincode=None, courier=None, since=None, until=None) -> tuple:
+    """Newest raw rows matching the filters, older than id `before`; returns (rows, next before or None)."""
+    where, args = [], []
+    for clause, value in (("id < ?", before), ("pincode = ?", pincode), ("courier = ?", courier),
+                          ("checked_at >= ?", since), ("checked_at < ?", until)):
+        if value not in (None, ""):
+            where.append(clause); args.append(value)
+    sql = f"SELECT {PAGE_COLUMNS} FROM recent_searches"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    rows = [dict(r) for r in conn.execute(sql + " ORDER BY id DESC LIMIT ?", (*args, limit + 1)).fetchall()]
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]["id"]
+    return rows, None
+
+def daily_history(conn, since=None, until=None, courier=None) -> list:
+    where, args = [], []
+    for clause, value in (("day >= ?", since), ("day <= ?", until), ("courier = ?", courier)):
+        if value not in (None, ""):
+            where.append(clause); args.append(value)
+    sql = "SELECT * FROM recent_search_daily"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    out = []
+    for r in conn.execute(sql + " ORDER BY day DESC, courier", args).fetchall():
+        d = dict(r)
+        d["avg_total"] = round(d["total_sum"] / d["quoted"], 2) if d["quoted"] else None
+        out.append(d)
+    return out
+
+class RecentSearchWriter:
+    def __init__(self, db_path: str, batch_size: int = 500, flush_interval: float = 1.0,
+                 max_pending: int = RECENT_MAX_PENDING, compact_interval: float = RECENT_COMPACT_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.compact_interval = compact_interval
+        self.dropped = 0
+        self._pending_rows = 0  # recorded and not yet written (queued or in the drain thread's batch)
+        self._queue = queue.Queue()  # bounded by _pending_rows, so flush markers never wait for room
+        self._lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def record(self, rows):
+        """Enqueue (checked_at, pincode, courier, weight, total) rows; never blocks on SQLite."""
+        if not rows:
+            return
+        self._ensure_started()
+        rows = list(rows)
+        with self._count_lock:
+            full = self._pending_rows + len(rows) > self.max_pending
+            if full:
+                self.dropped += len(rows)
+            else:
+                self._pending_rows += len(rows)
+        if full:
+            log.warning("recent_searches queue full; dropped %d rows (%d total)", len(rows), self.dropped)
+            return
+        self._queue.put_nowait(rows)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait up to `timeout` seconds for everything enqueued so far to be written (shutdown and tests)."""
+        if self._thread is None:
+            return True
+        deadline = time.monotonic() + timeout
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(max(0.0, deadline - time.monotonic()))
+
+    def close(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self.flush()
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own drain thread.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                with self._count_lock:
+                    self._queue = queue.Queue()  # rows queued in the parent belong to the parent
+                    self._pending_rows = 0
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="recent-searches-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        conn = connect(self.db_path)
+        pending, waiters = [], []
+        deadline = None
+        next_compact = time.monotonic() + min(60.0, self.compact_interval)  # first pass soon after start
+        while True:
+            wake = next_compact if deadline is None else min(deadline, next_compact)
+            timeout = max(0.0, wake - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    pending.extend(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+            if pending and (waiters or len(pending) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(conn, pending)
+                with self._count_lock:
+                    self._pending_rows -= len(pending)
+                pending, deadline = [], None
+            for w in waiters:
+                w.set()
+            waiters = []
+            if time.monotonic() >= next_compact:
+                self._compact(conn)
+                next_compact = time.monotonic() + self.compact_interval
+
+    def _write(self, conn, rows):
+        try:
+            conn.executemany(INSERT_SQL, rows)
+            conn.executemany(DAILY_UPSERT_SQL, daily_rows(rows))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            log.exception("Failed to write %d recent_searches rows: %s", len(rows), e)
+
+    def _compact(self, conn):
+        try:
+            rows, days = compact(conn)
+            if rows or days:
+                log.info("recent_searches retention: deleted %d rows, %d daily aggregates", rows, days)
+        except Exception as e:
+            conn.rollback()
+            log.exception("recent_searches retention failed: %s", e)
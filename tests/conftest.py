@@ -0,0 +1,22 @@
+import importlib, json, os, sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("gamma")
+    os.environ["GAMMA_DB_PATH"] = str(tmp / "couriers.db")
+    os.environ["GAMMA_UPLOAD_DIR"] = str(tmp / "uploads")
+    app = importlib.import_module("app")
+    app.db_init_migrate_and_report()
+    c = app.app.test_client()
+    with c.session_transaction() as s:
+        s["user"] = "admin"
+    r = c.post("/api/couriers/add", data={"name": "FlatCo", "rates": json.dumps({"rate_per_kg": 30}),
+                                          "oda_type": "Fixed", "oda_fixed": 75, "min_charge": 300})
+    assert r.status_code == 200, r.data
+    yield c
+    app.recent_writer.close()
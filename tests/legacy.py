@@ -0,0 +1,144 @@
+"""
+Pre-series reference implementations, kept verbatim (logging dropped) from the baseline
+app.py so the optimized code paths can be checked against what production used to return.
+"""
+import json
+
+import pandas as pd
+
+LEGACY_ODA_MATRIX = [
+    (20, 50,  [(100, 550),  (250, 990),  (500, 1100), (1000, 1375)]),
+    (51, 100, [(100, 825),  (250, 1210), (500, 1375), (1000, 1650)]),
+    (101,150, [(100,1100),  (250,1650),  (500,1925),  (1000,2200)]),
+    (151,200, [(100,1375),  (250,1925),  (500,2200),  (1000,2475)]),
+    (201,250, [(100,1650),  (250,2200),  (500,2475),  (1000,2750)]),
+    (251,300, [(100,1925),  (250,2475),  (500,2750),  (1000,3025)]),
+    (301,350, [(100,2200),  (250,2750),  (500,3025),  (1000,3300)]),
+    (351,400, [(100,2475),  (250,3025),  (500,3300),  (1000,3575)]),
+    (401,450, [(100,2750),  (250,3300),  (500,3575),  (1000,3850)]),
+    (451,500, [(100,3025),  (250,3575),  (500,3850),  (1000,4125)]),
+]
+
+def legacy_oda_charge(distance_km: float, weight_kg: float) -> float:
+    # matches bands on their first column; user-007 moved to min_km <= d <= max_km
+    row = next((r for r in LEGACY_ODA_MATRIX if distance_km <= r[0]), LEGACY_ODA_MATRIX[-1])
+    tiers = row[2]
+    for max_wt, charge in tiers:
+        if weight_kg <= max_wt:
+            return float(charge)
+    return float(tiers[-1][1])
+
+def legacy_normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Normalize common column header variations to standard names."""
+    if df is None or df.empty:
+        return df
+    # lower-case headers
+    df = df.rename(columns={c: str(c).strip().lower() for c in df.columns})
+    # common aliases
+    aliases = {
+        "pin": "pincode", "pin code": "pincode", "pincode": "pincode", "postal": "pincode", "zip": "pincode",
+        "zone name": "zone", "zonename": "zone",
+        "statename": "state",
+        "loc": "location", "city": "location", "area": "location",
+        "distance": "oda_distance", "dist": "oda_distance", "distance_km": "oda_distance", "oda_km": "oda_distance",
+        "oda": "status"  # sometimes sheet has a column 'oda' with 'yes/no' - map to status
+    }
+    for old, new in list(aliases.items()):
+        if old in df.columns and new not in df.columns:
+            df = df.rename(columns={old: new})
+    # ensure expected columns exist
+    for need in ["pincode","zone","state","location","status","oda_distance"]:
+        if need not in df.columns:
+            df[need] = None
+    # normalize content
+    if "pincode" in df.columns:
+        df["pincode"] = df["pincode"].astype(str).str.replace(r"\.0$", "", regex=True).str.strip()
+    if "status" in df.columns:
+        df["status"] = df["status"].astype(str).str.upper().str.strip()
+        df["status"] = df["status"].replace({"YES":"ODA", "Y":"ODA"})
+    # numeric distance
+    if "oda_distance" in df.columns:
+        def _to_float(x):
+            try: return float(str(x).strip())
+            except: return 0.0
+        df["oda_distance"] = df["oda_distance"].map(_to_float)
+    return df
+
+def legacy_quote(c: dict, row, eff_weight: float, declared_value: float, oda_charge=legacy_oda_charge) -> dict:
+    """One baseline /api/recommend result (without pincode/weight/courier) for courier row `c`."""
+    raw_rates = c.get("rates")
+    try:
+        rates = json.loads(raw_rates or "{}")
+    except Exception:
+        rates = {}
+
+    # Default lookups
+    state = ""; location = ""; zone = ""; zone_rate = 0.0; oda_distance = 0.0; status = "OK"
+    if row:
+        state = row.get("state") or ""
+        location = row.get("location") or ""
+        zone = row.get("zone") or ""
+        status = (row.get("status") or "").upper()
+        if status in ("YES","Y"): status = "ODA"
+        oda_distance = float(row.get("oda_distance") or 0.0)
+        # zone rate from dict-style rates
+        if isinstance(rates, dict) and zone:
+            try:
+                zone_rate = float(rates.get(zone) or 0)
+            except Exception:
+                zone_rate = 0.0
+
+    # Compute base freight (zone rate or generic)
+    base = 0.0
+    if zone and zone_rate:
+        base = max(base, zone_rate * eff_weight)
+    else:
+        if isinstance(rates, dict) and "rate_per_kg" in rates:
+            try:
+                base = max(base, float(rates.get("rate_per_kg") or 0) * eff_weight)
+            except Exception:
+                base = base
+        elif isinstance(rates, list) and rates:
+            rec0 = rates[0]
+            if isinstance(rec0, dict):
+                for key in ["rate","rate_per_kg","z_rate","price"]:
+                    if key in rec0:
+                        try:
+                            base = max(base, float(rec0.get(key) or 0) * eff_weight)
+                        except Exception:
+                            pass
+                        break
+
+    docket = float(c["docket"] or 0)
+    insurance = (declared_value * (float(c["insurance_pct"] or 0)/100.0)) + float(c["insurance_flat"] or 0)
+
+    # ODA charge
+    if c["oda_type"] == "Special" and status == "ODA":
+        oda = oda_charge(oda_distance, eff_weight)
+    elif c["oda_type"] == "Fixed":
+        oda = float(c["oda_fixed"] or 0)
+    else:
+        oda = 0.0
+
+    # ---- Min-charge fallback as SUBTOTAL baseline
+    min_charge = float(c["min_charge"] or 0)
+    subtotal_pre_fuel = max(base + docket + insurance + oda, min_charge)
+
+    # Fuel basis
+    fuel_pct = float(c["fuel_pct"] or 0)
+    basis = (c.get("fuel_basis") or "freight").lower()
+    fuel_base = subtotal_pre_fuel if basis == "subtotal" else (base if base>0 else min_charge)
+    fuel = fuel_base * (fuel_pct/100.0)
+
+    subtotal_for_tax = subtotal_pre_fuel + fuel
+    gst = subtotal_for_tax * (float(c["gst_pct"] or 0)/100.0)
+    total = subtotal_for_tax + gst
+
+    return {
+        "status": status, "zone": zone, "zone_rate": zone_rate, "oda_distance": oda_distance,
+        "state": state, "location": location,
+        "freight": base if base>0 else min_charge,  # show min when used
+        "fuel": fuel, "insurance": insurance, "oda": oda, "docket": docket,
+        "subtotal": subtotal_for_tax - gst,  # before GST (includes fuel)
+        "gst": gst, "total": total,
+    }
@@ -0,0 +1,78 @@
+"""Bluedart quotes must match what /api/recommend returned before the engine registry."""
+import json, os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pricing_engines
+from ingest import PINCODE_COLUMNS, normalize_columns, pincode_frame
+from legacy import legacy_normalize_columns, legacy_quote
+from conftest import ROOT
+
+SHEET = os.path.join(ROOT, "uploads", "Bluedart.xlsx")
+# the courier shipped in couriers.db
+BLUEDART = {"name": "Bluedart", "rates": json.dumps({"North": 10}), "docket": 100.0, "fuel_pct": 22.0,
+            "fuel_basis": "subtotal", "insurance_pct": 0.0, "insurance_flat": 100.0, "oda_type": "Special",
+            "oda_fixed": 0.0, "gst_pct": 18.0, "min_charge": 800.0}
+WEIGHTS = [0.5, 1, 3, 12, 40, 150, 300, 700, 1200]
+
+@pytest.fixture(scope="module")
+def sheet():
+    return pd.read_excel(SHEET)
+
+def manifest(sheet, pins, weights) -> pd.DataFrame:
+    """The frame /api/recommend hands an engine: pins left-joined to the sheet's pincode rows."""
+    served = pincode_frame(normalize_columns(sheet.copy()))
+    frame = pd.DataFrame({"pincode": pins, "weight": weights}).merge(
+        served[["pincode", *PINCODE_COLUMNS]], on="pincode", how="left", indicator=True)
+    frame["matched"] = frame.pop("_merge") == "both"
+    return frame
+
+def engine_quotes(courier, sheet, pins, weights, declared_value):
+    frame = manifest(sheet, pins, weights)
+    engine = pricing_engines.get_engine(courier["name"])
+    assert engine.__name__ == "pricing_engines.bluedart"
+    return pricing_engines.quote_many(engine, courier, frame, declared_value, {})
+
+def legacy_quotes(courier, sheet, pins, weights, declared_value):
+    rows = legacy_normalize_columns(sheet.copy()).drop_duplicates(subset="pincode", keep="first")
+    by_pin = {r["pincode"]: r for r in rows.to_dict(orient="records")}
+    return [legacy_quote(courier, by_pin.get(p), w, declared_value) for p, w in zip(pins, weights)]
+
+@pytest.mark.parametrize("courier", [
+    BLUEDART,
+    {**BLUEDART, "rates": json.dumps({"North": 10, "South": 12, "East": 14, "West": 9}), "fuel_basis": "freight",
+     "min_charge": 300.0, "insurance_pct": 1.0},
+    {**BLUEDART, "rates": json.dumps({"rate_per_kg": 30}), "oda_type": "Fixed", "oda_fixed": 75.0},
+])
+def test_matches_pre_series_quotes(courier, sheet):
+    pins = sheet["Pincode"].astype(str).tolist() + ["999999", ""]
+    weights = [WEIGHTS[i % len(WEIGHTS)] for i in range(len(pins))]
+    got = engine_quotes(courier, sheet, pins, weights, 2500.0)
+    want = legacy_quotes(courier, sheet, pins, weights, 2500.0)
+    for field in ("zone_rate", "oda_distance", "freight", "fuel", "insurance", "oda", "docket", "subtotal", "gst", "total"):
+        np.testing.assert_allclose(got[field], [w[field] for w in want], rtol=1e-12, atol=1e-9, err_msg=field)
+    for field in ("status", "zone", "state", "location"):
+        assert got[field] == [w[field] for w in want], field
+
+def test_shipped_courier_quotes_every_pin(sheet):
+    pins = sheet["Pincode"].astype(str).tolist()
+    got = engine_quotes(BLUEDART, sheet, pins, [1.0] * len(pins), 0.0)
+    assert set(np.round(got["total"], 2)) == {1151.68}
+    assert set(got["reason"]) == {"OK"}
+
+def test_quote_many_matches_quote_with_legacy_distances(sheet):
+    bluedart = pricing_engines.get_engine("Bluedart")
+    pins = sheet["Pincode"].astype(str).tolist()[:400] + ["999999"]
+    weights = [WEIGHTS[i % len(WEIGHTS)] for i in range(len(pins))]
+    legacy_df = pd.DataFrame({"pincode": pins[::2], "distance_km": np.arange(len(pins[::2])) * 7.5 % 520})
+    shared = {"df": legacy_df}
+    frame = manifest(sheet, pins, weights)
+    got = bluedart.quote_many(BLUEDART, frame, 1000.0, shared)
+    for i, rec in enumerate(frame.to_dict(orient="records")):
+        row = {k: (None if pd.isna(v) else v) for k, v in rec.items()} if rec["matched"] else None
+        one = bluedart.quote(BLUEDART, rec["pincode"], row, rec["weight"], 1000.0, shared)
+        for field in ("oda_distance", "oda", "total"):
+            assert got[field][i] == pytest.approx(one[field], rel=1e-12, abs=1e-9), (rec["pincode"], field)
+    assert any(o > 550 for o in got["oda"])  # legacy distances reached the ODA matrix
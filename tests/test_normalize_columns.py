@@ -0,0 +1,45 @@
+"""ingest.normalize_columns must return exactly what the pre-series row-by-row version did."""
+import glob, io, os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+from legacy import legacy_normalize_columns
+from conftest import ROOT
+
+SAMPLE_SHEETS = sorted(glob.glob(os.path.join(ROOT, "uploads", "Bluedart*.xlsx")))
+
+EDGE_FRAMES = {
+    "float pins, text distances, oda status": lambda: pd.DataFrame({
+        "PIN": [110001.0, np.nan, 0.0, -0.0, 1.5, 1e17, 560001.0],
+        "Dist": ["12", " 3.5 ", "", None, "x", "1e3", np.nan],
+        "ODA": ["yes", "Y ", None, np.nan, "no", " oda", "Edl"], "City": list("abcdefg")}),
+    "object pins, mixed status": lambda: pd.DataFrame({
+        "Pin Code": ["110001.0", 110002, " 0110003 ", None, "12.0 "], "distance_km": [1, 2, 3, 4, 5],
+        "status": [1.0, "y", "Yes", None, "nan"]}),
+    "csv text, blank cells": lambda: pd.read_csv(io.StringIO("zip,oda_km,zone name,zone\n110001,5,N,Z\n,abc,S,\n0567,,E,W\n")),
+    "bool distances": lambda: pd.DataFrame({"pincode": [1, 2], "oda_distance": [True, False]}),
+    "inf distances": lambda: pd.DataFrame({"pincode": [1.0, np.inf], "oda_distance": ["inf", "-inf"]}),
+    "missing status and distance": lambda: pd.DataFrame({"Pincode": [110001, 400001], "Zone": ["North", "West"]}),
+}
+
+def assert_same(got: pd.DataFrame, want: pd.DataFrame):
+    assert list(got.columns) == list(want.columns)
+    for col in want.columns:
+        assert str(got[col].dtype) == str(want[col].dtype), col
+        assert got[col].reset_index(drop=True).equals(want[col].reset_index(drop=True)), col
+
+@pytest.mark.parametrize("path", SAMPLE_SHEETS, ids=os.path.basename)
+def test_sample_uploads(path):
+    raw = ingest.read_rate_sheet(path)
+    assert_same(ingest.normalize_columns(raw.copy()), legacy_normalize_columns(raw.copy()))
+
+@pytest.mark.parametrize("name", EDGE_FRAMES)
+def test_edge_frames(name):
+    raw = EDGE_FRAMES[name]()
+    assert_same(ingest.normalize_columns(raw.copy()), legacy_normalize_columns(raw.copy()))
+
+def test_sample_uploads_found():
+    assert len(SAMPLE_SHEETS) == 3
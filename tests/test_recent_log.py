@@ -0,0 +1,28 @@
+"""RecentSearchWriter against the conftest.client database."""
+import importlib
+
+from recent_log import RecentSearchWriter
+
+def rows(n, courier="BoundCo"):
+    return [("2026-01-01T00:00:00", str(110001 + i), courier, 1.0, 100.0) for i in range(n)]
+
+def test_pending_rows_are_bounded_by_rows_not_batches(client):
+    app = importlib.import_module("app")
+    writer = RecentSearchWriter(app.DB_PATH, batch_size=1000, flush_interval=60, max_pending=10)
+    try:
+        writer.record(rows(6))
+        writer.record(rows(6))  # 12 rows would be over the bound: the whole batch is dropped
+        writer.record(rows(4))
+        assert writer.dropped == 6
+        assert writer.flush(timeout=5)
+        writer.record(rows(10))  # written rows no longer count against the bound
+        assert writer.dropped == 6
+        assert writer.flush(timeout=5)
+        cur = app.db.connection().cursor()
+        assert cur.execute("SELECT COUNT(*) FROM recent_searches WHERE courier='BoundCo'").fetchone()[0] == 20
+    finally:
+        writer.close()
+        conn = app.db.connection()
+        conn.execute("DELETE FROM recent_searches WHERE courier='BoundCo'")
+        conn.execute("DELETE FROM recent_search_daily WHERE courier='BoundCo'")
+        conn.commit()
@@ -0,0 +1,76 @@
+"""/api/recommend through Flask's test client, against a throwaway database (conftest.client)."""
+import importlib, json
+
+import pytest
+
+@pytest.mark.parametrize("fmt", ["rows", "columnar"])
+@pytest.mark.parametrize("mode", [None, "best"])
+def test_empty_pincode_list(client, fmt, mode):
+    body = {"pincodes": [], "format": fmt, **({"mode": mode} if mode else {})}
+    r = client.post("/api/recommend", json=body)
+    assert r.status_code == 200, r.data
+    data = r.get_json()
+    if fmt == "columnar":
+        assert data["rows"] == 0 and data["strings"] == []
+        assert all(col == [] for col in data["columns"].values())
+    else:
+        assert data["results"] == []
+
+def test_columnar_matches_rows(client):
+    body = {"pincodes": ["110001", "999999"], "weights": [2, 7], "declared_value": 100}
+    rows = client.post("/api/recommend", json=body).get_json()["results"]
+    col = client.post("/api/recommend", json={**body, "format": "columnar"}).get_json()
+    assert col["rows"] == len(rows) == 2
+    for i, row in enumerate(rows):
+        for k, values in col["columns"].items():
+            v = values[i]
+            if k in ("courier", "status", "zone", "state", "location", "reason"):
+                v = None if v is None else col["strings"][v]
+            assert v == row[k], k
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_bulk_failure_after_first_chunk_is_reported_in_band(client, fmt, monkeypatch):
+    import csv, io
+    app = importlib.import_module("app")
+    real, calls = app.quote_pincodes, []
+    def failing(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError("chunk exploded")
+        return real(*args, **kwargs)
+    monkeypatch.setattr(app, "quote_pincodes", failing)
+    manifest = "pincode,weight\n" + "".join(f"{110001 + i},1\n" for i in range(5))
+    r = client.post("/api/recommend/bulk", data={"format": fmt, "chunk_rows": "2",
+                                                  "file": (io.BytesIO(manifest.encode()), "m.csv")},
+                    content_type="multipart/form-data")
+    assert r.status_code == 200
+    body = r.get_data(as_text=True)
+    if fmt == "csv":
+        rows = list(csv.DictReader(io.StringIO(body)))
+        assert [row["pincode"] for row in rows] == ["110001", "110002", app.BULK_ERROR_PINCODE]
+        assert rows[-1]["reason"] == "Bulk quote failed after 2 lines: chunk exploded"
+    else:
+        last = json.loads(body.splitlines()[-1])
+        assert last == {"error": "chunk exploded", "lines": 2}
+
+def test_best_skips_courier_without_rate(client):
+    r = client.post("/api/couriers/add", data={"name": "NoRateCo", "rates": json.dumps([{"pincode": 110001}])})
+    assert r.status_code == 200, r.data
+    try:
+        rows = client.post("/api/recommend", json={"pincodes": ["110001"], "weights": [2]}).get_json()["results"]
+        by_courier = {row["courier"]: row for row in rows}
+        assert by_courier["NoRateCo"]["reason"] == "Rate missing"
+        best = client.post("/api/recommend", json={"pincodes": ["110001"], "weights": [2], "mode": "best"}).get_json()["results"]
+        assert [row["courier"] for row in best] == ["FlatCo"]
+    finally:
+        client.post("/api/couriers/delete/NoRateCo")
+
+def test_min_charge_quote_without_rate_can_win(client):
+    # a sheet-upload courier (records, no per-kg rate) priced by its min charge is a real price
+    r = client.post("/api/couriers/add", data={"name": "MinCo", "rates": json.dumps([{"pincode": 110001}]), "min_charge": 100})
+    assert r.status_code == 200, r.data
+    try:
+        best = client.post("/api/recommend", json={"pincodes": ["110001"], "weights": [2], "mode": "best"}).get_json()["results"]
+        assert [(row["courier"], row["reason"]) for row in best] == [("MinCo", "OK")]
+    finally:
+        client.post("/api/couriers/delete/MinCo")
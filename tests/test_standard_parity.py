@@ -0,0 +1,137 @@
+"""standard.quote_many against standard.quote and the pre-series inline formula."""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pricing_engines import standard
+from pricing_engines.base import CourierConfig
+from pricing_engines.oda import get_bluedart_oda_charge
+from legacy import legacy_quote
+
+FIELDS = ("zone_rate", "oda_distance", "freight", "fuel", "insurance", "oda", "docket", "subtotal", "gst", "total")
+TEXT = ("status", "zone", "state", "location")
+ZONES = ["North", "South", "East", "West", "north", ""]
+STATUSES = ["ODA", "SERVICEABLE", "YES", "y", "", None]
+RATE_CARDS = [
+    {"North": 10, "South": 12.5, "East": 0},
+    {"rate_per_kg": 30},
+    {"North": 8, "rate_per_kg": 21},
+    [{"rate": 7, "zone": "North"}],
+    [{"price": 11.5}],
+    [{"pincode": 110001}],
+    {},
+]
+
+def random_courier(rng) -> dict:
+    return {
+        "name": "Random", "rates": json.dumps(RATE_CARDS[rng.integers(len(RATE_CARDS))]),
+        "docket": float(rng.choice([0, 50, 100])), "fuel_pct": float(rng.choice([0, 10, 22.5])),
+        "fuel_basis": str(rng.choice(["freight", "subtotal", "SUBTOTAL", ""])),
+        "insurance_pct": float(rng.choice([0, 1, 0.25])), "insurance_flat": float(rng.choice([0, 20, 100])),
+        "oda_type": str(rng.choice(["Special", "Fixed", "None"])), "oda_fixed": float(rng.choice([0, 75])),
+        "gst_pct": float(rng.choice([0, 12, 18])),
+        # a large min charge floors most subtotals, a small one only some
+        "min_charge": float(rng.choice([0, 150, 800, 5000])),
+    }
+
+def random_rows(rng, n: int) -> list:
+    rows = []
+    for _ in range(n):
+        if rng.random() < 0.15:
+            rows.append(None)  # pincode the courier does not serve
+            continue
+        rows.append({
+            "zone": ZONES[rng.integers(len(ZONES))], "state": "S", "location": None if rng.random() < 0.1 else "L",
+            "status": STATUSES[rng.integers(len(STATUSES))],
+            "oda_distance": float(rng.choice([0, 20, 35, 50, 50.5, 120, 499, 650])),
+        })
+    return rows
+
+def frame_for(rows, weights) -> pd.DataFrame:
+    cols = ("zone", "state", "location", "status", "oda_distance")
+    return pd.DataFrame({
+        "pincode": [str(100000 + i) for i in range(len(rows))], "weight": weights,
+        "matched": [r is not None for r in rows],
+        **{c: [np.nan if r is None else r[c] for r in rows] for c in cols},
+    })
+
+@pytest.mark.parametrize("seed", range(60))
+def test_quote_many_matches_quote_and_legacy(seed):
+    rng = np.random.default_rng(seed)
+    courier = random_courier(rng)
+    rows = random_rows(rng, 50)
+    weights = [float(w) for w in rng.choice([0, 0.5, 1, 3, 12.25, 99, 101, 260, 750, 1500], size=len(rows))]
+    declared_value = float(rng.choice([0, 999, 25000]))
+
+    many = standard.quote_many(courier, frame_for(rows, weights), declared_value)
+    for i, (row, w) in enumerate(zip(rows, weights)):
+        one = standard.quote(courier, str(100000 + i), row, w, declared_value)
+        # user-007 matches ODA bands on min_km <= d <= max_km; the amounts are otherwise the baseline's
+        old = legacy_quote(courier, row, w, declared_value, oda_charge=get_bluedart_oda_charge)
+        for field in FIELDS:
+            assert many[field][i] == pytest.approx(one[field], rel=1e-12, abs=1e-9), (i, field)
+            assert many[field][i] == pytest.approx(old[field], rel=1e-12, abs=1e-9), (i, field)
+        for field in TEXT:
+            assert many[field][i] == one[field] == old[field], (i, field)
+
+def test_min_charge_and_subtotal_fuel_basis():
+    courier = {"name": "X", "rates": json.dumps({"North": 10}), "docket": 100, "fuel_pct": 22, "fuel_basis": "subtotal",
+               "insurance_pct": 0, "insurance_flat": 100, "oda_type": "Special", "oda_fixed": 0, "gst_pct": 18,
+               "min_charge": 800}
+    rows = [{"zone": "North", "state": "", "location": "", "status": "ODA", "oda_distance": 0.0},
+            {"zone": "North", "state": "", "location": "", "status": "SERVICEABLE", "oda_distance": 0.0}]
+    many = standard.quote_many(courier, frame_for(rows, [1.0, 100.0]), 0)
+    # 10 + 100 + 100 + 550 ODA < 800 min: fuel and GST on the 800 floor
+    assert many["total"][0] == pytest.approx(800 * 1.22 * 1.18)
+    assert many["freight"][0] == 10
+    # 1000 + 100 + 100 above the floor
+    assert many["total"][1] == pytest.approx(1200 * 1.22 * 1.18)
+
+SLAB_RATES = {"North": 40, "slabs": {
+    "South": {"slabs": [[0.5, 40], [1, 70], [2, 120]], "add_step": 0.5, "add_rate": 30, "per_kg_above": 10, "per_kg": 18},
+    "east": {"slabs": [[1, 50], [5, 150]], "per_kg": 25},
+}}
+SLAB_ZONES = ["South", "south", " SOUTH ", "East", "EAST", "North", "West", ""]
+SLAB_WEIGHTS = [0, 0.25, 0.5, 0.5000001, 1, 1.1, 1.5, 2, 2.1, 2.5, 3, 5, 5.5, 9.9, 10, 10.01, 25, float("nan")]
+
+def slab_courier(**overrides) -> dict:
+    return {"name": "Slabs", "rates": json.dumps(SLAB_RATES), "docket": 50, "fuel_pct": 10, "fuel_basis": "freight",
+            "insurance_pct": 0, "insurance_flat": 0, "oda_type": "None", "oda_fixed": 0, "gst_pct": 18,
+            "min_charge": 0, **overrides}
+
+@pytest.mark.parametrize("min_charge", [0, 100])
+def test_slab_quote_many_matches_quote(min_charge):
+    courier = slab_courier(min_charge=min_charge)
+    pairs = [(z, w) for z in SLAB_ZONES for w in SLAB_WEIGHTS]
+    rows = [{"zone": z, "state": "S", "location": "L", "status": "SERVICEABLE", "oda_distance": 0.0} for z, _ in pairs]
+    weights = [w for _, w in pairs]
+    many = standard.quote_many(courier, frame_for(rows, weights), 0)
+    for i, (row, w) in enumerate(zip(rows, weights)):
+        one = standard.quote(courier, str(100000 + i), row, w, 0)
+        for field in FIELDS:
+            assert many[field][i] == pytest.approx(one[field], rel=1e-12, abs=1e-9), (row["zone"], w, field)
+        assert many["reason"][i] == one["reason"], (row["zone"], w)
+
+@pytest.mark.parametrize("zone, weight, freight", [
+    ("South", 0.25, 40), ("South", 0.5, 40), ("South", 0.5000001, 70), ("South", 1, 70), ("South", 2, 120),
+    # add-on steps: every started 0.5 kg above 2 kg, without float noise billing an extra step
+    ("South", 2.1, 150), ("South", 2.5, 150), ("South", 3, 180), ("south", 10, 120 + 16 * 30),
+    # per_kg_above: per-kg pricing only past 10 kg
+    (" SOUTH ", 10.01, 10.01 * 18), ("South", 25, 25 * 18),
+    # no add steps: per-kg straight after the last slab
+    ("EAST", 5, 150), ("East", 5.5, 5.5 * 25),
+    ("North", 3, 3 * 40),
+])
+def test_slab_freight(zone, weight, freight):
+    row = {"zone": zone, "state": "", "location": "", "status": "", "oda_distance": 0.0}
+    one = standard.quote(slab_courier(), "110001", row, weight, 0)
+    many = standard.quote_many(slab_courier(), frame_for([row], [weight]), 0)
+    assert one["freight"] == pytest.approx(freight)
+    assert many["freight"][0] == pytest.approx(freight)
+
+def test_slab_table_nan_weight_agrees():
+    table = CourierConfig.of(slab_courier()).slabs["SOUTH"]
+    assert np.isnan(table.freight(float("nan")))
+    assert np.isnan(table.freights([float("nan")])).all()
@@ -0,0 +1,66 @@
+"""Rate-sheet upload jobs: going live, rolling back and cleaning up (conftest.client database)."""
+import filecmp, importlib, os, sqlite3, subprocess, sys
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from conftest import ROOT
+from ingest import cache_path, open_pincode_store
+
+FIELDS = {"docket": 100.0, "fuel_pct": 22.0, "fuel_basis": "subtotal", "insurance_pct": 0.0, "insurance_flat": 100.0,
+          "oda_type": "Special", "oda_fixed": 0.0, "gst_pct": 18.0, "min_charge": 800.0}
+
+def run_upload(app, kind, courier, sample, fields):
+    with open(os.path.join(ROOT, "uploads", sample), "rb") as fh:
+        staged, saved_path = app.stage_upload(FileStorage(fh, filename="SheetCo.xlsx"))
+    job = {"kind": kind, "courier": courier, "payload": {"staged_path": staged, "saved_path": saved_path, "fields": fields}}
+    return app.process_upload(job, lambda stage: None), saved_path
+
+@pytest.fixture
+def app(client):
+    app = importlib.import_module("app")
+    yield app
+    client.post("/api/couriers/delete/SheetCo")
+
+def test_upload_goes_live_and_clears_staging(app):
+    result, saved_path = run_upload(app, "add", "SheetCo", "Bluedart.xlsx", FIELDS)
+    assert result["changeset"]["inserted"] > 0
+    assert filecmp.cmp(saved_path, os.path.join(ROOT, "uploads", "Bluedart.xlsx"), shallow=False)
+    assert open_pincode_store(saved_path) is not None
+    assert os.listdir(app.STAGING_DIR) == []
+
+def test_failed_commit_restores_previous_sheet(app, monkeypatch):
+    _, saved_path = run_upload(app, "add", "SheetCo", "Bluedart.xlsx", FIELDS)
+    cur = app.db.connection().cursor()
+    before = cur.execute("SELECT * FROM couriers WHERE name='SheetCo'").fetchone()
+    pins = cur.execute("SELECT COUNT(*) FROM courier_pincodes WHERE courier='SheetCo'").fetchone()[0]
+
+    def failing_commit():
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(app.db.connection(), "commit", failing_commit)
+    with pytest.raises(sqlite3.OperationalError):
+        run_upload(app, "update", "SheetCo", "Bluedart_2.xlsx", {})
+    monkeypatch.undo()
+
+    assert filecmp.cmp(saved_path, os.path.join(ROOT, "uploads", "Bluedart.xlsx"), shallow=False)
+    assert open_pincode_store(saved_path) is not None  # the old store, still stamped for the old sheet
+    assert not os.path.exists(cache_path(saved_path) + ".prev")
+    assert dict(cur.execute("SELECT * FROM couriers WHERE name='SheetCo'").fetchone()) == dict(before)
+    assert cur.execute("SELECT COUNT(*) FROM courier_pincodes WHERE courier='SheetCo'").fetchone()[0] == pins
+    assert os.listdir(app.STAGING_DIR) == []
+
+def test_jobs_of_exited_workers_are_failed(app):
+    exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    dead_pid = int(exited.stdout)
+    conn = app.db.connection()
+    for job_id, status, pid in (("dead-running", "running", dead_pid), ("dead-queued", "queued", dead_pid),
+                                ("live-running", "running", os.getpid())):
+        conn.execute("INSERT INTO upload_jobs(id, courier, kind, status, pid) VALUES (?, 'SheetCo', 'add', ?, ?)",
+                     (job_id, status, pid))
+    conn.commit()
+    assert app.reap_upload_jobs() == 2
+    ids = "('dead-running', 'dead-queued', 'live-running')"
+    status = dict(conn.execute(f"SELECT id, status FROM upload_jobs WHERE id IN {ids}").fetchall())
+    assert status == {"dead-running": "failed", "dead-queued": "failed", "live-running": "running"}
+    conn.execute(f"DELETE FROM upload_jobs WHERE id IN {ids}")
+    conn.commit()
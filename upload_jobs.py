@@ -0,0 +1,148 @@
+"""
+Background processing of rate-sheet uploads.
+
+Parsing a large carrier workbook takes seconds, so the courier upload endpoints only save
+the file to a staging path and `submit()` a job. A daemon thread in the same worker
+process runs the handler (parse, normalize, build the pincode store, apply the pincode
+diff and go live) while the request returns the job id straight away.
+
+Job state lives in the upload_jobs table rather than in memory, so whichever gunicorn
+worker answers GET /api/couriers/jobs/<id> can report it:
+
+  status  queued -> running -> done | failed
+  stage   what a running job is doing (reported by the handler through `progress`)
+  result  the handler's JSON result once done; error holds the message of a failed job
+
+Jobs run one at a time per process, in submission order. A job whose worker died
+(restart, OOM kill) would stay queued/running: `fail_interrupted()` closes every open job
+at startup and `fail_orphaned()` closes those of exited processes as each worker starts.
+Finished jobs are kept for UPLOAD_JOB_RETENTION_DAYS.
+"""
+import datetime, json, logging, os, queue, threading, time, uuid
+
+from db import connect
+
+log = logging.getLogger("gamma")
+
+UPLOAD_JOB_RETENTION_DAYS = float(os.environ.get("UPLOAD_JOB_RETENTION_DAYS", 7))
+CREATE_SQL = """
+    CREATE TABLE IF NOT EXISTS upload_jobs(
+        id TEXT PRIMARY KEY,
+        courier TEXT NOT NULL,
+        kind TEXT,
+        status TEXT,
+        stage TEXT,
+        error TEXT,
+        payload TEXT,
+        result TEXT,
+        pid INTEGER,
+        created_at TEXT,
+        started_at TEXT,
+        finished_at TEXT
+    );
+"""
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+def fail_interrupted(conn) -> int:
+    """Mark jobs left queued/running by a previous run as failed (call once at startup)."""
+    n = conn.execute("""UPDATE upload_jobs SET status='failed', error='interrupted by restart', finished_at=?
+                        WHERE status IN ('queued', 'running')""", (_now(),)).rowcount
+    conn.commit()
+    return n
+
+def _alive(pid) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return True
+
+def fail_orphaned(conn) -> int:
+    """Mark queued/running jobs whose process has exited as failed (call when a worker starts)."""
+    open_jobs = conn.execute("SELECT id, pid FROM upload_jobs WHERE status IN ('queued', 'running')").fetchall()
+    dead = [job_id for job_id, pid in open_jobs if not _alive(pid)]
+    for job_id in dead:
+        conn.execute("""UPDATE upload_jobs SET status='failed', error='worker exited', finished_at=?
+                        WHERE id=? AND status IN ('queued', 'running')""", (_now(), job_id))
+    conn.commit()
+    return len(dead)
+
+class UploadJobs:
+    def __init__(self, db_path: str, handler):
+        self.db_path = db_path
+        self.handler = handler  # handler(job: dict, progress: callable(stage)) -> JSON-able result
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, conn, kind: str, courier: str, payload: dict) -> str:
+        """Record a queued job on the caller's connection and hand it to this process's worker thread."""
+        job_id = uuid.uuid4().hex
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=UPLOAD_JOB_RETENTION_DAYS)).isoformat(timespec="seconds")
+        conn.execute("DELETE FROM upload_jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,))
+        conn.execute("""INSERT INTO upload_jobs(id, courier, kind, status, stage, payload, pid, created_at)
+                        VALUES (?, ?, ?, 'queued', 'queued', ?, ?, ?)""",
+                     (job_id, courier, kind, json.dumps(payload), os.getpid(), _now()))
+        conn.commit()
+        self._ensure_started()
+        self._queue.put(job_id)
+        return job_id
+
+    @staticmethod
+    def get(conn, job_id: str):
+        row = conn.execute("SELECT * FROM upload_jobs WHERE id=?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"] or "null")
+        job["result"] = json.loads(job["result"] or "null")
+        return job
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own job thread.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()  # ids queued in the parent belong to the parent
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="upload-jobs", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        conn = connect(self.db_path)  # job status only; the handler uses its own connection
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._process(conn, job_id)
+            except Exception:
+                log.exception("Upload job %s: could not record its status", job_id)
+
+    def _set(self, conn, job_id: str, **fields):
+        conn.execute(f"UPDATE upload_jobs SET {', '.join(f'{k}=?' for k in fields)} WHERE id=?",
+                     (*fields.values(), job_id))
+        conn.commit()
+
+    def _process(self, conn, job_id: str):
+        job = self.get(conn, job_id)
+        if job is None or job["status"] != "queued":
+            return
+        self._set(conn, job_id, status="running", stage="started", started_at=_now())
+        t = time.perf_counter()
+        try:
+            result = self.handler(job, lambda stage: self._set(conn, job_id, stage=stage))
+        except Exception as e:
+            log.exception("Upload job %s (%s %s) failed: %s", job_id, job["kind"], job["courier"], e)
+            self._set(conn, job_id, status="failed", error=str(e) or type(e).__name__, finished_at=_now())
+        else:
+            self._set(conn, job_id, status="done", stage="done", result=json.dumps(result), finished_at=_now())
+            log.info("Upload job %s (%s %s) done in %.2fs", job_id, job["kind"], job["courier"], time.perf_counter() - t)